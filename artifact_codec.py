@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Serialization for run artifacts (scores, legacy exchanges, advisor output).
+
+YAML goes through libyaml (``CSafeLoader`` / ``CSafeDumper``) when PyYAML
+was built with it and falls back to the pure-Python safe loader/dumper
+otherwise; the output is the same either way.  Artifacts that only the
+tools read (``score_raw``, ``score_advised``) can be written as JSON
+instead (``artifacts.machine_format`` in config.json), which is several
+times faster again.
+
+Readers never need to know which format a run used: ``load`` picks the
+codec from the file suffix, or from the first byte for unknown suffixes,
+and ``find_artifact`` locates ``<stem>.json`` / ``<stem>.yaml`` in a run.
+
+Benchmark on real runs::
+
+    python artifact_codec.py bench runs/<run_id> [runs/<run_id> ...]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+try:
+    import yaml
+except Exception:
+    yaml = None
+
+if yaml is not None:
+    SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    HAS_LIBYAML = SafeLoader is not yaml.SafeLoader
+else:
+    SafeLoader = SafeDumper = None
+    HAS_LIBYAML = False
+
+FORMATS = ("yaml", "json")
+SUFFIXES = {".yaml": "yaml", ".yml": "yaml", ".json": "json"}
+
+
+def ensure_yaml_available() -> None:
+    if yaml is None:
+        raise RuntimeError("PyYAMLが必要です。'pip install pyyaml' を実行してください。")
+
+
+def yaml_load(text: str):
+    ensure_yaml_available()
+    return yaml.load(text, Loader=SafeLoader)
+
+
+def yaml_dump(data) -> str:
+    ensure_yaml_available()
+    return yaml.dump(data, Dumper=SafeDumper, allow_unicode=True, sort_keys=False)
+
+
+def json_dump(data) -> str:
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def detect_format(path: Path, text: str | None = None) -> str:
+    """Codec for a file: by suffix, else JSON if the content starts like JSON."""
+    fmt = SUFFIXES.get(Path(path).suffix.lower())
+    if fmt:
+        return fmt
+    head = (text if text is not None else Path(path).read_text(encoding="utf-8")[:64]).lstrip()
+    return "json" if head[:1] in ("{", "[") else "yaml"
+
+
+def loads(text: str, fmt: str):
+    return json.loads(text) if fmt == "json" else yaml_load(text)
+
+
+def dumps(data, fmt: str) -> str:
+    return json_dump(data) if fmt == "json" else yaml_dump(data)
+
+
+def load(path: Path) -> dict:
+    """Mapping stored at ``path`` in whichever format it was written; {} if there is no such file.
+
+    Parse and other I/O errors propagate: a corrupt artifact is not an empty one.
+    """
+    path = Path(path)
+    try:
+        text = path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return {}
+    data = loads(text, detect_format(path, text))
+    return data if isinstance(data, dict) else {}
+
+
+def dump(path: Path, data: dict, fmt: str | None = None) -> None:
+    """Atomically write ``data``; the format defaults to the one implied by the suffix."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(dumps(data, fmt or SUFFIXES.get(path.suffix.lower(), "yaml")), encoding="utf-8")
+    tmp.replace(path)
+
+
+def artifact_path(run_dir: Path, stem: str, fmt: str) -> Path:
+    return Path(run_dir) / f"{stem}.{'json' if fmt == 'json' else 'yaml'}"
+
+
+def find_artifact(run_dir: Path, stem: str) -> Path | None:
+    """Existing ``<stem>.json`` / ``.yaml`` / ``.yml`` in a run directory, newest format first."""
+    for suffix in (".json", ".yaml", ".yml"):
+        path = Path(run_dir) / f"{stem}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+# --- benchmark -------------------------------------------------------------
+
+
+def _sample_documents(paths: list[Path]) -> list[tuple[str, dict]]:
+    """Full exchange states (history included) and score files found under ``paths``."""
+    from exchange_log import LOG_SUFFIX, apply_event, read_events
+
+    files: list[Path] = []
+    for root in paths:
+        if root.is_file():
+            files.append(root)
+            continue
+        files.extend(sorted(root.glob(f"**/exchange_*{LOG_SUFFIX}")))
+        files.extend(sorted(root.glob("**/exchange_*.yaml")))
+        files.extend(sorted(root.glob("**/score*.yaml")))
+    docs = []
+    for path in files:
+        if path.suffix == LOG_SUFFIX:
+            state: dict = {}
+            for event in read_events(path, 0)[0]:
+                apply_event(state, event)
+            state.pop("history_count", None)
+        else:
+            try:
+                state = load(path)
+            except Exception as exc:
+                print(f"{path} を読み込めません（スキップ）: {exc}", file=sys.stderr)
+                continue
+        if state:
+            docs.append((str(path), state))
+    return docs
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench(paths: list[Path], repeat: int = 5) -> list[dict]:
+    """Best-of-``repeat`` load/dump time per codec over the sample documents."""
+    docs = [d for _, d in _sample_documents(paths)]
+    if not docs:
+        return []
+    codecs = []
+    if yaml is not None:
+        codecs.append(("yaml (pure)", yaml.SafeLoader, yaml.SafeDumper))
+        if HAS_LIBYAML:
+            codecs.append(("yaml (libyaml)", yaml.CSafeLoader, yaml.CSafeDumper))
+    rows = []
+    for name, loader, dumper in codecs:
+        texts = [yaml.dump(d, Dumper=dumper, allow_unicode=True, sort_keys=False) for d in docs]
+        rows.append({
+            "codec": name,
+            "bytes": sum(len(t.encode("utf-8")) for t in texts),
+            "load_ms": _time(lambda: [yaml.load(t, Loader=loader) for t in texts], repeat) * 1000,
+            "dump_ms": _time(lambda: [yaml.dump(d, Dumper=dumper, allow_unicode=True, sort_keys=False) for d in docs], repeat) * 1000,
+        })
+    texts = [json_dump(d) for d in docs]
+    rows.append({
+        "codec": "json",
+        "bytes": sum(len(t.encode("utf-8")) for t in texts),
+        "load_ms": _time(lambda: [json.loads(t) for t in texts], repeat) * 1000,
+        "dump_ms": _time(lambda: [json_dump(d) for d in docs], repeat) * 1000,
+    })
+    return rows
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="実行成果物のシリアライズ形式を比較するベンチマーク")
+    parser.add_argument("command", choices=["bench"], help="bench: 実際の実行ディレクトリのファイルで各形式を計測")
+    parser.add_argument("paths", nargs="+", help="実行ディレクトリまたはファイル")
+    parser.add_argument("--repeat", type=int, default=5, help="計測回数（最良値を表示）")
+    args = parser.parse_args(argv)
+    paths = [Path(p).expanduser() for p in args.paths]
+    count = len(_sample_documents(paths))
+    rows = bench(paths, max(1, args.repeat))
+    if not rows:
+        print("計測対象のファイルが見つかりません。", file=sys.stderr)
+        return 1
+    print(f"対象: {count} ファイル / libyaml: {'あり' if HAS_LIBYAML else 'なし'}")
+    print(f"{'codec':<16}{'bytes':>12}{'load ms':>12}{'dump ms':>12}")
+    for row in rows:
+        print(f"{row['codec']:<16}{row['bytes']:>12}{row['load_ms']:>12.2f}{row['dump_ms']:>12.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
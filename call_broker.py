@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""Machine-local fair-share broker for external CLI calls.
+
+Every orchestrator process on a host asks the broker for a slot before it
+launches a CLI child (claude / codex / gemini).  The broker hands out a
+fixed number of slots using weighted fair queuing across jobs, with an
+``interactive`` lane that is always served before the ``batch`` lane and a
+number of slots reserved for it, so a small interactive job never waits
+behind a 50-performer batch job.
+
+There is no separate daemon: the first process that needs a slot and finds
+no broker running elects itself (guarded by an ``flock`` on a lock file)
+and serves the Unix socket from a daemon thread.  When that process exits,
+the broker goes with it; the next client to reach the socket elects a new
+one.  Each client watches the connections of the slots it holds and, when
+one drops, replays the lease to the new broker (``"held": true``), which
+counts it at once, even above ``max_concurrent``, so the calls still running
+are not forgotten and new grants wait until they finish.  A request that
+was still queued is sent again.  A job's fair-queuing state is dropped as
+soon as it has nothing granted or queued; an idle job rejoins at the
+current virtual time, as in plain WFQ.
+
+Protocol (newline-delimited JSON over the Unix socket):
+    -> {"op": "acquire", "job": "...", "weight": 1.0, "lane": "batch"}
+    <- {"ok": true, "granted": true}
+    ... the slot is held while the connection stays open ...
+    -> {"op": "release"}            (or simply close the connection)
+
+    -> {"op": "acquire", ..., "held": true}   (lease replayed after a hand-over)
+    <- {"ok": true, "granted": true}
+
+    -> {"op": "stats"}
+    <- {"ok": true, "stats": {...}}
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import fcntl
+import itertools
+import json
+import os
+import select
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+LANES = ("interactive", "batch")
+DEFAULT_MAX_CONCURRENT = 4
+DEFAULT_RESERVED_INTERACTIVE = 1
+# How often a client checks the connections of the slots it holds.
+LEASE_POLL_SEC = 0.5
+
+
+def default_socket_path() -> Path:
+    """Per-user socket path; kept short because of the sun_path limit."""
+    return Path(tempfile.gettempdir()) / f"orchestrator-broker-{os.getuid()}.sock"
+
+
+class _Waiter:
+    __slots__ = ("job", "lane", "finish", "seq", "granted", "cancelled")
+
+    def __init__(self, job: str, lane: str, finish: float, seq: int):
+        self.job = job
+        self.lane = lane
+        self.finish = finish
+        self.seq = seq
+        self.granted = False
+        self.cancelled = False
+
+
+class FairShareScheduler:
+    """Weighted fair queuing over a fixed number of slots.
+
+    Each request gets a virtual finish tag ``max(vtime, last_finish[job]) +
+    1 / weight``; the waiting request with the smallest tag is granted
+    first.  Interactive requests are always considered before batch ones,
+    and batch work may never occupy the last ``reserved_interactive`` slots.
+    """
+
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT, reserved_interactive: int = DEFAULT_RESERVED_INTERACTIVE):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.reserved_interactive = max(0, min(int(reserved_interactive), self.max_concurrent - 1))
+        self._cond = threading.Condition()
+        self._vtime = 0.0
+        self._last_finish: dict[str, float] = {}
+        self._waiting: list[_Waiter] = []
+        self._active: dict[str, int] = {lane: 0 for lane in LANES}
+        self._active_by_job: dict[str, int] = {}
+        self._weights: dict[str, float] = {}
+        self._seq = itertools.count()
+        self._granted_total = 0
+
+    def set_weight(self, job: str, weight: float) -> None:
+        with self._cond:
+            self._weights[job] = max(float(weight), 0.01)
+
+    def forget(self, job: str) -> None:
+        """Drop the state of ``job`` if it has nothing granted or queued."""
+        with self._cond:
+            self._forget_if_idle(job)
+
+    def _forget_if_idle(self, job: str) -> None:
+        # Caller holds self._cond.
+        if self._active_by_job.get(job) or any(w.job == job for w in self._waiting):
+            return
+        self._last_finish.pop(job, None)
+        self._weights.pop(job, None)
+
+    def _lane_has_room(self, lane: str) -> bool:
+        in_use = sum(self._active.values())
+        if in_use >= self.max_concurrent:
+            return False
+        if lane == "batch":
+            return self._active["batch"] < self.max_concurrent - self.reserved_interactive
+        return True
+
+    def _dispatch(self) -> None:
+        # Caller holds self._cond.
+        changed = False
+        for lane in LANES:
+            queue = sorted(
+                (w for w in self._waiting if w.lane == lane),
+                key=lambda w: (w.finish, w.seq),
+            )
+            for waiter in queue:
+                if not self._lane_has_room(lane):
+                    break
+                self._waiting.remove(waiter)
+                waiter.granted = True
+                self._active[lane] += 1
+                self._active_by_job[waiter.job] = self._active_by_job.get(waiter.job, 0) + 1
+                self._vtime = max(self._vtime, waiter.finish - 1.0 / self._weights.get(waiter.job, 1.0))
+                self._granted_total += 1
+                changed = True
+        if changed:
+            self._cond.notify_all()
+
+    def enqueue(self, job: str, lane: str = "batch", weight: float | None = None) -> _Waiter:
+        """Queue a slot request and return its handle without blocking."""
+        lane = lane if lane in LANES else "batch"
+        with self._cond:
+            if weight is not None:
+                self._weights[job] = max(float(weight), 0.01)
+            start = max(self._vtime, self._last_finish.get(job, 0.0))
+            finish = start + 1.0 / self._weights.get(job, 1.0)
+            self._last_finish[job] = finish
+            waiter = _Waiter(job, lane, finish, next(self._seq))
+            self._waiting.append(waiter)
+            self._dispatch()
+            return waiter
+
+    def wait(self, waiter: _Waiter, timeout: float | None = None) -> bool:
+        """Wait until ``waiter`` is granted. Returns False on timeout (still queued)."""
+        with self._cond:
+            return self._cond.wait_for(lambda: waiter.granted, timeout)
+
+    def adopt(self, job: str, lane: str = "batch", weight: float | None = None) -> _Waiter:
+        """Count a slot granted by a previous broker; it is held at once, even above the limit."""
+        lane = lane if lane in LANES else "batch"
+        with self._cond:
+            if weight is not None:
+                self._weights[job] = max(float(weight), 0.01)
+            waiter = _Waiter(job, lane, self._vtime, next(self._seq))
+            waiter.granted = True
+            self._active[lane] += 1
+            self._active_by_job[job] = self._active_by_job.get(job, 0) + 1
+            return waiter
+
+    def acquire(self, job: str, lane: str = "batch", weight: float | None = None, timeout: float | None = None) -> _Waiter | None:
+        """Block until a slot is granted. Returns the grant, or None on timeout."""
+        waiter = self.enqueue(job, lane, weight)
+        if self.wait(waiter, timeout):
+            return waiter
+        self.release(waiter)
+        return None
+
+    def release(self, waiter: _Waiter) -> None:
+        with self._cond:
+            if not waiter.granted:
+                if waiter in self._waiting:
+                    self._waiting.remove(waiter)
+                waiter.cancelled = True
+                self._forget_if_idle(waiter.job)
+                return
+            waiter.granted = False
+            self._active[waiter.lane] = max(0, self._active[waiter.lane] - 1)
+            remaining = self._active_by_job.get(waiter.job, 0) - 1
+            if remaining > 0:
+                self._active_by_job[waiter.job] = remaining
+            else:
+                self._active_by_job.pop(waiter.job, None)
+            self._dispatch()
+            self._forget_if_idle(waiter.job)
+
+    def stats(self) -> dict:
+        with self._cond:
+            waiting: dict[str, int] = {}
+            for w in self._waiting:
+                waiting[w.job] = waiting.get(w.job, 0) + 1
+            return {
+                "tracked_jobs": len(self._last_finish.keys() | self._weights.keys()),
+                "max_concurrent": self.max_concurrent,
+                "reserved_interactive": self.reserved_interactive,
+                "active": dict(self._active),
+                "active_by_job": dict(self._active_by_job),
+                "waiting_by_job": waiting,
+                "granted_total": self._granted_total,
+                "vtime": round(self._vtime, 4),
+            }
+
+
+def _peer_closed(conn: socket.socket) -> bool:
+    readable, _, _ = select.select([conn], [], [], 0)
+    if not readable:
+        return False
+    try:
+        return conn.recv(1, socket.MSG_PEEK) == b""
+    except OSError:
+        return True
+
+
+class BrokerServer:
+    """Serves a FairShareScheduler on a Unix socket from daemon threads."""
+
+    def __init__(self, socket_path: Path, scheduler: FairShareScheduler, lock_fd: int):
+        self.socket_path = socket_path
+        self.scheduler = scheduler
+        self._lock_fd = lock_fd
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        with contextlib.suppress(FileNotFoundError):
+            socket_path.unlink()
+        self._sock.bind(str(socket_path))
+        os.chmod(str(socket_path), 0o600)
+        self._sock.listen(64)
+        self._thread = threading.Thread(target=self._serve, name="call-broker", daemon=True)
+
+    @classmethod
+    def try_elect(cls, socket_path: Path, scheduler: FairShareScheduler) -> "BrokerServer | None":
+        """Become the host's broker if nobody else holds the lock."""
+        lock_path = socket_path.with_name(socket_path.name + ".lock")
+        fd = os.open(str(lock_path), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        try:
+            server = cls(socket_path, scheduler, fd)
+        except OSError:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            return None
+        server._thread.start()
+        return server
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket) -> None:
+        held: list[_Waiter] = []
+        jobs: set[str] = set()
+        try:
+            reader = conn.makefile("r", encoding="utf-8")
+            for line in reader:
+                try:
+                    msg = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                op = msg.get("op")
+                if op == "acquire":
+                    job = str(msg.get("job") or "anonymous")
+                    jobs.add(job)
+                    if msg.get("held"):
+                        held.append(self.scheduler.adopt(job, str(msg.get("lane") or "batch"), msg.get("weight")))
+                        conn.sendall(b'{"ok": true, "granted": true}\n')
+                        continue
+                    waiter = self.scheduler.enqueue(job, str(msg.get("lane") or "batch"), msg.get("weight"))
+                    held.append(waiter)
+                    # Poll the peer while queued so a client that gave up
+                    # (killed job, Ctrl-C) does not leave a phantom request.
+                    while not self.scheduler.wait(waiter, 0.5):
+                        if _peer_closed(conn):
+                            return
+                    conn.sendall(b'{"ok": true, "granted": true}\n')
+                elif op == "release":
+                    if held:
+                        self.scheduler.release(held.pop())
+                    conn.sendall(b'{"ok": true}\n')
+                elif op == "set_weight":
+                    job = str(msg.get("job") or "")
+                    jobs.add(job)
+                    self.scheduler.set_weight(job, float(msg.get("weight") or 1.0))
+                    conn.sendall(b'{"ok": true}\n')
+                elif op == "stats":
+                    conn.sendall((json.dumps({"ok": True, "stats": self.scheduler.stats()}) + "\n").encode("utf-8"))
+        except OSError:
+            pass
+        finally:
+            # A dropped connection releases whatever it was holding.
+            for waiter in held:
+                self.scheduler.release(waiter)
+            for job in jobs:
+                self.scheduler.forget(job)
+            with contextlib.suppress(OSError):
+                conn.close()
+
+
+class BrokerClient:
+    """Per-process handle used by ``run_external`` to obtain call slots.
+
+    ``lane`` and ``weight`` may be changed at any time (for example once the
+    score is known and the job turns out to be a large batch job).  If no
+    broker can be reached or elected the client fails open and the call runs
+    without a slot, so a broken socket never blocks a job.
+
+    Granted slots are kept in ``_leases`` and watched by a daemon thread;
+    when the broker that granted one goes away, the lease is replayed to
+    its successor (electing this process if nobody else does).
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        lane: str = "batch",
+        weight: float = 1.0,
+        socket_path: Path | None = None,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+        reserved_interactive: int = DEFAULT_RESERVED_INTERACTIVE,
+        verbose: bool = False,
+    ):
+        self.job_id = job_id
+        self.lane = lane if lane in LANES else "batch"
+        self.weight = weight
+        self.socket_path = socket_path or default_socket_path()
+        self.max_concurrent = max_concurrent
+        self.reserved_interactive = reserved_interactive
+        self.verbose = verbose
+        self._server: BrokerServer | None = None
+        self._elect_lock = threading.Lock()
+        # Held slots: {"sock": ..., "request": ...}; the sock is swapped on a hand-over.
+        self._leases: list[dict] = []
+        self._lease_lock = threading.Lock()
+        self._keeper: threading.Thread | None = None
+
+    def _connect(self) -> socket.socket | None:
+        for _ in range(3):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(str(self.socket_path))
+                return sock
+            except OSError:
+                sock.close()
+            with self._elect_lock:
+                if self._server is None:
+                    self._server = BrokerServer.try_elect(
+                        self.socket_path,
+                        FairShareScheduler(self.max_concurrent, self.reserved_interactive),
+                    )
+                    if self._server is not None and self.verbose:
+                        print(f"[Broker] このプロセスがブローカーになりました: {self.socket_path}", file=sys.stderr)
+            time.sleep(0.05)
+        return None
+
+    def _request(self, request: dict, cancel: threading.Event | None = None) -> tuple[socket.socket | None, bool]:
+        """(connection, granted) for an acquire; ``None`` if no broker could be reached or ``cancel`` was set."""
+        sock = self._connect()
+        if sock is None:
+            return None, False
+        try:
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            # Queued until granted: watch ``cancel`` meanwhile. Closing the
+            # connection withdraws the request from the broker's queue.
+            while cancel is not None and not select.select([sock], [], [], LEASE_POLL_SEC)[0]:
+                if cancel.is_set():
+                    sock.close()
+                    return None, False
+            reply = sock.makefile("r", encoding="utf-8").readline()
+        except OSError:
+            reply = ""
+        if not reply:
+            # The broker went away before answering.
+            sock.close()
+            return None, False
+        try:
+            return sock, bool(json.loads(reply).get("granted"))
+        except ValueError:
+            return sock, False
+
+    def _keep_leases(self) -> None:
+        while True:
+            with self._lease_lock:
+                socks = [lease["sock"] for lease in self._leases]
+            if not socks:
+                time.sleep(LEASE_POLL_SEC)
+                continue
+            try:
+                readable, _, _ = select.select(socks, [], [], LEASE_POLL_SEC)
+            except (OSError, ValueError):
+                readable = []  # a lease was closed under us; look again
+            for sock in readable:
+                try:
+                    closed = _peer_closed(sock)
+                except ValueError:
+                    continue  # released meanwhile
+                if closed:
+                    self._replay(sock)
+
+    def _replay(self, old: socket.socket) -> None:
+        with self._lease_lock:
+            lease = next((lease for lease in self._leases if lease["sock"] is old), None)
+        if lease is None:
+            return
+        sock, granted = self._request({**lease["request"], "held": True})
+        with self._lease_lock:
+            if lease in self._leases and sock is not None and granted:
+                lease["sock"] = sock
+                sock = None
+            elif lease in self._leases:
+                # No broker now: keep the call running and stop watching it.
+                self._leases.remove(lease)
+        if sock is not None:
+            sock.close()
+        with contextlib.suppress(OSError):
+            old.close()
+        if self.verbose:
+            print(f"[Broker] ブローカーが交代しました。実行中のスロットを引き継ぎます: {self.socket_path}", file=sys.stderr)
+
+    @contextlib.contextmanager
+    def slot(self, label: str = "", cancel: threading.Event | None = None):
+        """Hold one broker slot for the duration of the ``with`` block.
+
+        Yields False without a slot when ``cancel`` is set while queued.
+        """
+        waited = time.monotonic()
+        request = {"op": "acquire", "job": self.job_id, "weight": self.weight, "lane": self.lane}
+        sock, granted = None, False
+        # A broker that exits while we are queued drops the connection; ask its successor.
+        for _ in range(3):
+            sock, granted = self._request(request, cancel)
+            if sock is not None or (cancel is not None and cancel.is_set()):
+                break
+        if cancel is not None and cancel.is_set() and sock is None:
+            yield False
+            return
+        if sock is None:
+            if self.verbose:
+                print(f"[Broker] ブローカーに接続できません。スロットなしで実行します ({label})", file=sys.stderr)
+            yield False
+            return
+        if self.verbose and granted:
+            wait_sec = time.monotonic() - waited
+            if wait_sec > 1.0:
+                print(f"[Broker] {label}: スロット待ち {wait_sec:.1f}秒 (lane={self.lane})", file=sys.stderr)
+        lease = {"sock": sock, "request": request}
+        if granted:
+            with self._lease_lock:
+                self._leases.append(lease)
+                if self._keeper is None:
+                    self._keeper = threading.Thread(target=self._keep_leases, name="broker-leases", daemon=True)
+                    self._keeper.start()
+        try:
+            yield granted
+        finally:
+            with self._lease_lock:
+                if lease in self._leases:
+                    self._leases.remove(lease)
+                sock = lease["sock"]
+            with contextlib.suppress(OSError):
+                sock.close()
+
+
+def broker_client_from_config(config: dict, job_id: str, lane: str, verbose: bool = False) -> BrokerClient | None:
+    """Build a BrokerClient from the ``fair_share`` config section, or None if disabled."""
+    cfg = config.get("fair_share") or {}
+    if not cfg.get("enabled"):
+        return None
+    socket_path = cfg.get("socket_path")
+    return BrokerClient(
+        job_id=job_id,
+        lane=lane,
+        weight=float(cfg.get("weight", 1.0)),
+        socket_path=Path(socket_path).expanduser() if socket_path else None,
+        max_concurrent=int(cfg.get("max_concurrent", DEFAULT_MAX_CONCURRENT)),
+        reserved_interactive=int(cfg.get("reserved_interactive", DEFAULT_RESERVED_INTERACTIVE)),
+        verbose=verbose,
+    )
+
+
+def query_stats(socket_path: Path | None = None) -> dict | None:
+    """Return the running broker's stats, or None if no broker is up."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(2.0)
+        sock.connect(str(socket_path or default_socket_path()))
+        sock.sendall(b'{"op": "stats"}\n')
+        reply = sock.makefile("r", encoding="utf-8").readline()
+        return json.loads(reply).get("stats") if reply else None
+    except (OSError, ValueError):
+        return None
+    finally:
+        sock.close()
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="LLM呼び出しのフェアシェアブローカー")
+    parser.add_argument("command", choices=["stats"], help="stats: 稼働中ブローカーの状態を表示")
+    parser.add_argument("--socket", default="", help="ソケットのパス（既定: 一時ディレクトリ）")
+    args = parser.parse_args(argv)
+    stats = query_stats(Path(args.socket).expanduser() if args.socket else None)
+    if stats is None:
+        print("ブローカーは稼働していません。", file=sys.stderr)
+        return 1
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
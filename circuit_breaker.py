@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Per-backend circuit breakers and per-role fallback chains.
+
+Every ``run_external`` result is reported to the breaker of the backend
+(claude / codex / gemini ...) that produced it.  When the recent error rate
+of a backend crosses the threshold, its breaker opens and calls for any role
+skip straight to the next backend of that role's fallback chain instead of
+waiting out another timeout.  After a cooldown the backend is probed in the
+background (``probe_cmd``) or, without a probe command, a single live call is
+let through (half-open); a success closes the breaker again.
+
+Config (``fallback`` section)::
+
+    "fallback": {
+      "enabled": true,
+      "chains": {"performer": ["gemini", "codex", "claude"]},
+      "backends": {
+        "codex": {"cmd": ["codex", "exec", "--skip-git-repo-check"]},
+        "gemini": {"cmd": ["gemini", "-p"], "probe_cmd": ["gemini", "-p", "ping"]}
+      },
+      "breaker": {"window": 10, "min_calls": 3, "failure_rate": 0.5,
+                  "slow_call_sec": 0, "cooldown_sec": 60, "max_cooldown_sec": 600}
+    }
+
+A chain entry is either a backend name from ``backends`` or an inline
+``{"backend": name, "cmd": [...]}`` for role-specific command lines.  The
+role's own configured command is always tried first.
+"""
+from __future__ import annotations
+
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Sliding-window breaker for one backend."""
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 10,
+        min_calls: int = 3,
+        failure_rate: float = 0.5,
+        slow_call_sec: float = 0.0,
+        cooldown_sec: float = 60.0,
+        max_cooldown_sec: float = 600.0,
+        probe_cmd: list[str] | None = None,
+        probe_timeout_sec: float = 60.0,
+        verbose: bool = False,
+    ):
+        self.name = name
+        self.min_calls = max(1, int(min_calls))
+        self.failure_rate = float(failure_rate)
+        self.slow_call_sec = float(slow_call_sec or 0)
+        self.base_cooldown = float(cooldown_sec)
+        self.max_cooldown = max(float(max_cooldown_sec), self.base_cooldown)
+        self.probe_cmd = list(probe_cmd or [])
+        self.probe_timeout_sec = float(probe_timeout_sec)
+        self.verbose = verbose
+        self.state = CLOSED
+        self.cooldown = self.base_cooldown
+        self.opened_at = 0.0
+        self.trips = 0
+        self._outcomes: deque[bool] = deque(maxlen=max(1, int(window)))
+        self._trial_in_flight = False
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if a call may go to this backend now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if self.probe_cmd or time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def abandon(self) -> None:
+        """Give back a half-open trial slot for a call that never produced an outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, ok: bool, latency_sec: float) -> None:
+        if ok and self.slow_call_sec and latency_sec > self.slow_call_sec:
+            ok = False
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial_in_flight = False
+                if ok:
+                    self._close_locked()
+                else:
+                    self._trip_locked(backoff=True)
+                return
+            self._outcomes.append(ok)
+            if self.state != CLOSED or len(self._outcomes) < self.min_calls:
+                return
+            failures = sum(1 for o in self._outcomes if not o)
+            if failures / len(self._outcomes) >= self.failure_rate:
+                self._trip_locked(backoff=False)
+
+    def _close_locked(self) -> None:
+        self.state = CLOSED
+        self.cooldown = self.base_cooldown
+        self._outcomes.clear()
+        if self.verbose:
+            print(f"[Breaker] {self.name}: 復旧しました（closed）", file=sys.stderr)
+
+    def _trip_locked(self, backoff: bool) -> None:
+        if backoff:
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self._outcomes.clear()
+        if self.verbose:
+            print(f"[Breaker] {self.name}: 遮断（{self.cooldown:.0f}s 後に再確認）", file=sys.stderr)
+        if self.probe_cmd and not self._probing:
+            self._probing = True
+            threading.Thread(target=self._probe_loop, name=f"probe-{self.name}", daemon=True).start()
+
+    def _probe_loop(self) -> None:
+        while True:
+            with self._lock:
+                wait = self.opened_at + self.cooldown - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                proc = subprocess.run(
+                    self.probe_cmd,
+                    stdin=subprocess.DEVNULL,
+                    capture_output=True,
+                    timeout=self.probe_timeout_sec,
+                )
+                ok = proc.returncode == 0
+            except (OSError, subprocess.SubprocessError):
+                ok = False
+            with self._lock:
+                if self.state != OPEN:
+                    self._probing = False
+                    return
+                if ok:
+                    self._close_locked()
+                    self._probing = False
+                    return
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            snap = {"state": self.state, "trips": self.trips}
+            if self.state != CLOSED:
+                snap["retry_in_sec"] = max(0.0, round(self.opened_at + self.cooldown - time.monotonic(), 1))
+            return snap
+
+
+class BreakerBoard:
+    """Breakers for every backend seen in this run plus the role fallback chains."""
+
+    def __init__(
+        self,
+        chains: dict[str, list],
+        backends: dict[str, dict],
+        breaker_cfg: dict,
+        prepare: Callable[[list[str]], list[str]] | None = None,
+        verbose: bool = False,
+    ):
+        self.chains = chains
+        self.backends = backends
+        self.breaker_cfg = breaker_cfg
+        self.prepare = prepare or (lambda cmd: list(cmd))
+        self.verbose = verbose
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(
+        cls,
+        config: dict,
+        prepare: Callable[[list[str]], list[str]] | None = None,
+        verbose: bool = False,
+    ) -> "BreakerBoard | None":
+        cfg = config.get("fallback") or {}
+        if not cfg.get("enabled"):
+            return None
+        return cls(
+            dict(cfg.get("chains") or {}),
+            dict(cfg.get("backends") or {}),
+            dict(cfg.get("breaker") or {}),
+            prepare,
+            verbose,
+        )
+
+    def breaker(self, backend: str) -> CircuitBreaker | None:
+        if not backend:
+            return None
+        with self._lock:
+            if backend not in self._breakers:
+                known = self.backends.get(backend) or {}
+                self._breakers[backend] = CircuitBreaker(
+                    backend,
+                    window=self.breaker_cfg.get("window", 10),
+                    min_calls=self.breaker_cfg.get("min_calls", 3),
+                    failure_rate=self.breaker_cfg.get("failure_rate", 0.5),
+                    slow_call_sec=self.breaker_cfg.get("slow_call_sec", 0),
+                    cooldown_sec=self.breaker_cfg.get("cooldown_sec", 60),
+                    max_cooldown_sec=self.breaker_cfg.get("max_cooldown_sec", 600),
+                    probe_cmd=known.get("probe_cmd"),
+                    probe_timeout_sec=self.breaker_cfg.get("probe_timeout_sec", 60),
+                    verbose=self.verbose,
+                )
+            return self._breakers[backend]
+
+    def candidates(self, role: str, primary_backend: str, primary_cmd: list[str]) -> list[tuple[str, list[str]]]:
+        """(backend, cmd template) pairs to try for a role, primary first."""
+        result = [(primary_backend, primary_cmd)]
+        seen = {primary_backend}
+        for entry in self.chains.get(role) or []:
+            if isinstance(entry, dict):
+                name = str(entry.get("backend") or "")
+                cmd = entry.get("cmd") or (self.backends.get(name) or {}).get("cmd")
+            else:
+                name = str(entry)
+                cmd = (self.backends.get(name) or {}).get("cmd")
+            if not name or name in seen or not cmd:
+                continue
+            seen.add(name)
+            result.append((name, self.prepare(list(cmd))))
+        return result
+
+    def open_backends(self) -> dict[str, dict]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {b.name: b.snapshot() for b in breakers if b.state != CLOSED}
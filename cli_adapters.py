@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""Structured output modes of the supported CLIs.
+
+Each adapter switches a command template to the CLI's JSON output mode and
+turns what the CLI prints back into the answer text plus the exact usage
+it reports:
+
+- claude: ``--output-format json`` (one result object; ``stream-json``
+  lines are understood too).  Input tokens are reported net of the prompt
+  cache, so the cache writes and reads are added back to the input.
+- codex: ``exec --json`` (JSON lines).  The last agent message is the
+  answer; ``turn.completed`` usage is summed over turns.  The older
+  ``{"msg": {...}}`` event shape is also accepted.
+- gemini: ``--output-format json`` (``response`` plus per-model ``stats``).
+
+The CLI is identified from the executable name only (like
+``detect_cli_type``, but a prompt mentioning another CLI cannot confuse
+it).  Templates that already pick an output format are left alone, and
+output that does not parse as the expected JSON is returned as plain text
+with no usage, so the caller falls back to estimates.
+"""
+from __future__ import annotations
+
+import abc
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass
+class StructuredOutput:
+    """Answer text and exact token usage from one structured CLI call."""
+    text: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    cost_usd: float | None = None
+    is_error: bool = False
+    parsed: bool = False
+
+    @property
+    def has_usage(self) -> bool:
+        return self.parsed and bool(self.input_tokens or self.output_tokens)
+
+    def usage_meta(self) -> dict:
+        meta = {
+            "tokens_exact": True,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+        }
+        if self.cost_usd is not None:
+            meta["cost_usd"] = self.cost_usd
+        return meta
+
+
+def _int(value) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _json_objects(stdout: str) -> list[dict]:
+    """The whole output as one JSON object, else every JSON object line."""
+    text = stdout.strip()
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        return [data]
+    if isinstance(data, list):
+        return [d for d in data if isinstance(d, dict)]
+    objects = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(obj, dict):
+            objects.append(obj)
+    return objects
+
+
+class CliAdapter(abc.ABC):
+    """Base adapter; subclasses know one CLI's flags and output shape."""
+    cli = ""
+    format_flags: tuple[str, ...] = ()
+    # Flags whose presence means the template already chose an output format.
+    format_markers: tuple[str, ...] = ()
+
+    def insert_at(self, cmd_tmpl: list[str]) -> int | None:
+        return 1
+
+    def structured(self, cmd_tmpl: list[str]) -> list[str]:
+        """The template with the JSON output flags added (unchanged if not applicable)."""
+        if any(part in self.format_markers for part in cmd_tmpl):
+            return cmd_tmpl
+        at = self.insert_at(cmd_tmpl)
+        if at is None:
+            return cmd_tmpl
+        return [*cmd_tmpl[:at], *self.format_flags, *cmd_tmpl[at:]]
+
+    @abc.abstractmethod
+    def parse(self, stdout: str) -> StructuredOutput:
+        """Answer and usage from the CLI's output; plain text with no usage if it does not parse."""
+
+
+class ClaudeAdapter(CliAdapter):
+    cli = "claude"
+    format_flags = ("--output-format", "json")
+    format_markers = ("--output-format",)
+
+    def parse(self, stdout: str) -> StructuredOutput:
+        results = [o for o in _json_objects(stdout) if o.get("type") == "result" or "result" in o]
+        if not results:
+            return StructuredOutput(stdout)
+        data = results[-1]
+        usage = data.get("usage") or {}
+        cache_write = _int(usage.get("cache_creation_input_tokens"))
+        cache_read = _int(usage.get("cache_read_input_tokens"))
+        cost = data.get("total_cost_usd", data.get("cost_usd"))
+        return StructuredOutput(
+            text=str(data.get("result") or ""),
+            input_tokens=_int(usage.get("input_tokens")) + cache_write + cache_read,
+            output_tokens=_int(usage.get("output_tokens")),
+            cache_read_tokens=cache_read,
+            cache_write_tokens=cache_write,
+            cost_usd=float(cost) if isinstance(cost, (int, float)) else None,
+            is_error=bool(data.get("is_error")),
+            parsed=True,
+        )
+
+
+class CodexAdapter(CliAdapter):
+    cli = "codex"
+    format_flags = ("--json",)
+    format_markers = ("--json", "--experimental-json")
+
+    def insert_at(self, cmd_tmpl: list[str]) -> int | None:
+        # Only non-interactive ``codex exec`` has a JSON mode.
+        return cmd_tmpl.index("exec") + 1 if "exec" in cmd_tmpl else None
+
+    def parse(self, stdout: str) -> StructuredOutput:
+        objects = _json_objects(stdout)
+        text = None
+        input_tokens = output_tokens = cached = 0
+        saw_usage = is_error = False
+        for obj in objects:
+            kind = obj.get("type")
+            if kind == "item.completed":
+                item = obj.get("item") or {}
+                if item.get("type") in ("agent_message", "assistant_message"):
+                    text = str(item.get("text") or "")
+            elif kind == "turn.completed":
+                usage = obj.get("usage") or {}
+                input_tokens += _int(usage.get("input_tokens"))
+                output_tokens += _int(usage.get("output_tokens"))
+                cached += _int(usage.get("cached_input_tokens"))
+                saw_usage = True
+            elif kind in ("turn.failed", "error"):
+                is_error = True
+            msg = obj.get("msg")
+            if isinstance(msg, dict):  # pre-0.44 event stream
+                if msg.get("type") == "agent_message":
+                    text = str(msg.get("message") or "")
+                elif msg.get("type") == "token_count":
+                    info = msg.get("info") or {}
+                    usage = info.get("total_token_usage") or msg
+                    # Running totals: the last event wins.
+                    input_tokens = _int(usage.get("input_tokens"))
+                    output_tokens = _int(usage.get("output_tokens"))
+                    cached = _int(usage.get("cached_input_tokens"))
+                    saw_usage = True
+                elif msg.get("type") == "error":
+                    is_error = True
+        if text is None and not saw_usage:
+            return StructuredOutput(stdout)
+        return StructuredOutput(
+            text=text or "",
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cache_read_tokens=cached,
+            is_error=is_error,
+            parsed=True,
+        )
+
+
+class GeminiAdapter(CliAdapter):
+    cli = "gemini"
+    format_flags = ("--output-format", "json")
+    format_markers = ("--output-format", "-o")
+
+    def parse(self, stdout: str) -> StructuredOutput:
+        objects = [o for o in _json_objects(stdout) if "response" in o or "stats" in o]
+        if not objects:
+            return StructuredOutput(stdout)
+        data = objects[-1]
+        input_tokens = output_tokens = cached = 0
+        models = ((data.get("stats") or {}).get("models") or {})
+        for model in models.values():
+            tokens = (model or {}).get("tokens") or {}
+            input_tokens += _int(tokens.get("prompt"))
+            output_tokens += _int(tokens.get("candidates")) + _int(tokens.get("thoughts"))
+            cached += _int(tokens.get("cached"))
+        return StructuredOutput(
+            text=str(data.get("response") or ""),
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cache_read_tokens=cached,
+            is_error=bool(data.get("error")),
+            parsed=True,
+        )
+
+
+ADAPTERS: dict[str, CliAdapter] = {a.cli: a for a in (ClaudeAdapter(), CodexAdapter(), GeminiAdapter())}
+
+
+def adapter_for(cmd_tmpl: list[str]) -> CliAdapter | None:
+    """Adapter for the CLI a command template runs, if it is a known one."""
+    if not cmd_tmpl:
+        return None
+    # Same precedence as orchestrator.detect_cli_type, on the executable only.
+    executable = Path(cmd_tmpl[0]).name.lower()
+    for cli in ("claude", "codex", "gemini"):
+        if cli in executable:
+            return ADAPTERS[cli]
+    return None
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""Local control channel between the web server and a running orchestrator.
+
+Each orchestrator run serves a Unix socket and records where it is in
+``<run_dir>/control.json``.  The web server sends user replies, kill and
+priority changes through it; the orchestrator applies them under its own
+exchange locks, so a reply wakes the waiting concertmaster immediately
+instead of on the next file poll.  The other way, every ``status.json``
+write and exchange state change is pushed to subscribers as an event.
+
+Protocol (newline-delimited JSON, like ``call_broker``)::
+
+    -> {"op": "reply", "exchange": "1", "reply": "OK", "approved": true, "choice": null}
+    <- {"ok": true, "status": "waiting_for_concertmaster"}
+    -> {"op": "kill"}
+    <- {"ok": true}
+    -> {"op": "priority", "lane": "batch", "weight": 0.5}
+    <- {"ok": true, "lane": "batch", "weight": 0.5}
+    -> {"op": "status"}
+    <- {"ok": true, "status": {...}}
+    -> {"op": "subscribe"}
+    <- {"ok": true}
+    <- {"event": "status", "data": {...}}     ... until the connection closes
+
+Events are queued per subscriber and sent by that subscriber's own thread,
+so publishing never waits on a socket; a subscriber more than
+``SUBSCRIBER_QUEUE`` events behind is disconnected (the browser's
+EventSource reconnects).
+
+When no socket can be reached the web server falls back to files: replies
+go into the exchange log directly, and other requests are appended to
+``control_inbox.jsonl``, which the orchestrator polls.
+"""
+from __future__ import annotations
+
+import contextlib
+import datetime as dt
+import json
+import os
+import queue
+import socket
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable
+
+CONTROL_FILE = "control.json"
+INBOX_FILE = "control_inbox.jsonl"
+SOCKET_NAME = "control.sock"
+INBOX_POLL_SEC = 1.0
+# sun_path is 108 bytes on Linux (104 on macOS); long run dirs use the temp dir.
+MAX_SOCKET_PATH = 100
+# Events buffered per subscriber; one that falls this far behind is dropped.
+SUBSCRIBER_QUEUE = 256
+SUBSCRIBER_SEND_TIMEOUT_SEC = 2.0
+
+
+def apply_reply(data: dict, reply: str, approved: bool, choice: str | None = None) -> dict:
+    """Record the user's answer to the pending question of an exchange."""
+    pending = data.get("pending") or {}
+    pending["user_reply"] = reply
+    if choice:
+        pending["user_choice"] = choice
+    pending["user_approved"] = bool(approved)
+    data["pending"] = pending
+    data["updated_at"] = dt.datetime.now().isoformat()
+    return data
+
+
+def _socket_path(run_dir: Path) -> Path:
+    path = run_dir / SOCKET_NAME
+    if len(str(path)) <= MAX_SOCKET_PATH:
+        return path
+    return Path(tempfile.gettempdir()) / f"orchestrator-ctl-{os.getuid()}-{run_dir.name}.sock"
+
+
+class _Subscriber:
+    """One event stream: a bounded queue drained by its own sender thread.
+
+    ``publish`` only enqueues, so a slow or dead reader never blocks the
+    worker threads that write status and exchange updates.
+    """
+
+    def __init__(self, conn: socket.socket, on_dead: Callable[["_Subscriber"], None]):
+        self.conn = conn
+        self.on_dead = on_dead
+        self.queue: queue.Queue[bytes | None] = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self._closed = False
+
+    def start(self, first: list[bytes]) -> None:
+        for line in first:
+            self.queue.put_nowait(line)
+        threading.Thread(target=self._drain, name="control-subscriber", daemon=True).start()
+
+    def offer(self, line: bytes) -> bool:
+        """Enqueue without blocking; False when the subscriber is too far behind."""
+        try:
+            self.queue.put_nowait(line)
+            return True
+        except queue.Full:
+            return False
+
+    def _drain(self) -> None:
+        while True:
+            line = self.queue.get()
+            if line is None:
+                break
+            try:
+                self.conn.sendall(line)
+            except OSError:
+                break
+        self.close()
+        self.on_dead(self)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        with contextlib.suppress(queue.Full):
+            self.queue.put_nowait(None)  # wake the sender
+        with contextlib.suppress(OSError):
+            self.conn.shutdown(socket.SHUT_RDWR)
+        with contextlib.suppress(OSError):
+            self.conn.close()
+
+
+class ControlServer:
+    """Serves the control socket of one run; use ``ControlServer.start``."""
+
+    _registry: dict[str, "ControlServer"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, run_dir: Path, verbose: bool = False):
+        self.run_dir = run_dir
+        self.verbose = verbose
+        self.socket_path: Path | None = None
+        self._sock: socket.socket | None = None
+        self._handlers: dict[str, Callable[[dict], dict]] = {}
+        self._subscribers: list[_Subscriber] = []
+        self._last_status: dict = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._inbox_offset = 0
+
+    @classmethod
+    def start(cls, run_dir: Path, verbose: bool = False) -> "ControlServer":
+        server = cls(run_dir, verbose)
+        with contextlib.suppress(OSError):
+            # Requests left over from an earlier process of this run are stale.
+            server._inbox_offset = (run_dir / INBOX_FILE).stat().st_size
+        try:
+            server._listen()
+        except (OSError, AttributeError) as exc:  # AttributeError: no AF_UNIX
+            server._sock = None
+            if verbose:
+                print(f"[Control] ソケットを開けません（ファイル経由のみ）: {exc}", file=sys.stderr)
+        server._write_control_file()
+        threading.Thread(target=server._poll_inbox, name="control-inbox", daemon=True).start()
+        with cls._registry_lock:
+            cls._registry[str(run_dir.resolve())] = server
+        return server
+
+    @classmethod
+    def for_run(cls, run_dir: Path) -> "ControlServer | None":
+        with cls._registry_lock:
+            return cls._registry.get(str(Path(run_dir).resolve()))
+
+    def _listen(self) -> None:
+        path = _socket_path(self.run_dir)
+        with contextlib.suppress(OSError):
+            path.unlink()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(str(path))
+            os.chmod(path, 0o600)
+            sock.listen(16)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self.socket_path = path
+        threading.Thread(target=self._serve, name="control-server", daemon=True).start()
+
+    def _write_control_file(self) -> None:
+        info = {
+            "pid": os.getpid(),
+            "socket": str(self.socket_path) if self.socket_path else None,
+            "inbox": INBOX_FILE,
+            "started_at": dt.datetime.now().isoformat(),
+        }
+        tmp = self.run_dir / (CONTROL_FILE + ".tmp")
+        tmp.write_text(json.dumps(info, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.run_dir / CONTROL_FILE)
+
+    def on(self, op: str, handler: Callable[[dict], dict]) -> None:
+        """Register (or replace) the handler for one request op."""
+        with self._lock:
+            self._handlers[op] = handler
+
+    def dispatch(self, msg: dict) -> dict:
+        op = str(msg.get("op") or "")
+        if op == "status":
+            with self._lock:
+                return {"ok": True, "status": dict(self._last_status)}
+        with self._lock:
+            handler = self._handlers.get(op)
+        if handler is None:
+            return {"ok": False, "error": f"unsupported op: {op}"}
+        try:
+            return handler(msg)
+        except Exception as exc:
+            return {"ok": False, "error": str(exc)}
+
+    def publish(self, event: str, data: dict) -> None:
+        """Queue an event for every subscriber (never blocks); ones too far behind are dropped."""
+        line = (json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if event == "status":
+                self._last_status = dict(data)
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            if not sub.offer(line):
+                self._drop(sub)
+                sub.close()
+
+    def _drop(self, sub: _Subscriber) -> None:
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def _serve(self) -> None:
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket) -> None:
+        try:
+            reader = conn.makefile("r", encoding="utf-8")
+            for line in reader:
+                try:
+                    msg = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if msg.get("op") == "subscribe":
+                    conn.settimeout(SUBSCRIBER_SEND_TIMEOUT_SEC)
+                    sub = _Subscriber(conn, self._drop)
+                    first = [b'{"ok": true}\n']
+                    with self._lock:
+                        # Registered under the lock that publish() snapshots with,
+                        # so no event falls between the status and the stream.
+                        if self._last_status:
+                            first.append((json.dumps({"event": "status", "data": self._last_status}, ensure_ascii=False) + "\n").encode("utf-8"))
+                        self._subscribers.append(sub)
+                    sub.start(first)
+                    return  # the subscriber's sender thread owns the connection
+                reply = self.dispatch(msg)
+                conn.sendall((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+        except OSError:
+            pass
+        with contextlib.suppress(OSError):
+            conn.close()
+
+    def _poll_inbox(self) -> None:
+        path = self.run_dir / INBOX_FILE
+        while not self._closed.wait(INBOX_POLL_SEC):
+            try:
+                if path.stat().st_size <= self._inbox_offset:
+                    continue
+                with path.open("rb") as f:
+                    f.seek(self._inbox_offset)
+                    chunk = f.read()
+            except OSError:
+                continue
+            end = chunk.rfind(b"\n") + 1
+            self._inbox_offset += end
+            for line in chunk[:end].splitlines():
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                reply = self.dispatch(msg)
+                if self.verbose and not reply.get("ok"):
+                    print(f"[Control] {msg.get('op')}: {reply.get('error')}", file=sys.stderr)
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._registry_lock:
+            self._registry.pop(str(self.run_dir.resolve()), None)
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for sub in subscribers:
+            sub.close()
+        if self._sock is not None:
+            with contextlib.suppress(OSError):
+                self._sock.close()
+        with contextlib.suppress(OSError):
+            if self.socket_path is not None:
+                self.socket_path.unlink()
+        with contextlib.suppress(OSError):
+            (self.run_dir / CONTROL_FILE).unlink()
+
+
+# --- client side (web server) ----------------------------------------------
+
+
+def _connect(run_dir: Path, timeout: float) -> socket.socket | None:
+    try:
+        info = json.loads((run_dir / CONTROL_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if not info.get("socket"):
+        return None
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    except (OSError, AttributeError):
+        return None
+    sock.settimeout(timeout)
+    try:
+        sock.connect(str(info["socket"]))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def is_live(run_dir: Path) -> bool:
+    """True if the run has an orchestrator process serving control requests."""
+    try:
+        pid = int(json.loads((run_dir / CONTROL_FILE).read_text(encoding="utf-8")).get("pid") or 0)
+    except (OSError, ValueError):
+        return False
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def request(run_dir: Path, msg: dict, timeout: float = 5.0) -> dict | None:
+    """Send one request over the run's socket; None if it cannot be reached.
+
+    Once the request is sent the orchestrator may have acted on it, so a
+    missing or broken answer is an error (``"unanswered": true``), not None.
+    """
+    sock = _connect(run_dir, timeout)
+    if sock is None:
+        return None
+    try:
+        try:
+            sock.sendall((json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8"))
+        except OSError:
+            return None
+        try:
+            line = sock.makefile("r", encoding="utf-8").readline()
+            if line:
+                return json.loads(line)
+            error = "connection closed"
+        except (OSError, ValueError) as exc:
+            error = str(exc) or type(exc).__name__
+        return {"ok": False, "unanswered": True, "error": f"no answer from the orchestrator: {error}"}
+    finally:
+        sock.close()
+
+
+def post_inbox(run_dir: Path, msg: dict) -> bool:
+    """File fallback: queue a request for the orchestrator's inbox poller."""
+    if not is_live(run_dir):
+        return False
+    try:
+        with (run_dir / INBOX_FILE).open("a", encoding="utf-8") as f:
+            f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+    except OSError:
+        return False
+    return True
+
+
+def subscribe(run_dir: Path, timeout: float = 30.0):
+    """Yield events pushed by the run until it closes the connection.
+
+    Yields ``None`` every ``timeout`` seconds without events so callers can
+    send keep-alives; returns immediately if the socket cannot be reached.
+    """
+    sock = _connect(run_dir, timeout)
+    if sock is None:
+        return
+    buf = b""
+    acked = False
+    try:
+        sock.sendall(b'{"op": "subscribe"}\n')
+        while True:
+            while b"\n" not in buf:
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    yield None
+                    continue
+                if not chunk:
+                    return
+                buf += chunk
+            line, buf = buf.split(b"\n", 1)
+            if not acked:  # the {"ok": true} for the subscribe request itself
+                acked = True
+                continue
+            with contextlib.suppress(ValueError):
+                yield json.loads(line)
+    except OSError:
+        return
+    finally:
+        sock.close()
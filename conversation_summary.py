@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Rolling summaries of exchange conversations.
+
+Prompts for the performer and the concertmaster are built from the task,
+a summary of the older turns and the most recent turns, so their size
+stays bounded however long an exchange runs.  Once the turns older than
+the last ``keep_recent`` messages that the summary does not cover yet add
+up to ``threshold_chars``, they are folded into the summary once and the
+result is cached in the exchange state::
+
+    "summary": {"text": "...", "covered": 12, "updated_at": "..."}
+
+``covered`` counts messages from the start of the conversation (archived
+segments included), so the summary stays valid across history rollover.
+Messages that were archived before being summarized are not read back.
+
+With ``cmd`` set, the summary is written by that CLI (previous summary
+plus the new messages in, new summary out).  Without it, or when the call
+fails, an extractive summary is kept instead: one clipped line per
+message.  In both cases the summary is capped at ``max_summary_chars``.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import threading
+
+from exchange_log import archived_count
+
+EXTRACT_LINE_CHARS = 200
+# Floor for ``tighten``: below this, summarizing costs more than it saves.
+MIN_THRESHOLD_CHARS = 1000
+
+
+def _one_line(text: str, limit: int) -> str:
+    line = " ".join((text or "").split())
+    return line if len(line) <= limit else line[: limit - 1] + "…"
+
+
+def _clip(text: str, limit: int) -> str:
+    text = text or ""
+    return text if len(text) <= limit else text[:limit] + "\n...(truncated)"
+
+
+class ConversationSummarizer:
+    """Decides when an exchange needs summarizing and renders prompt context."""
+
+    def __init__(
+        self,
+        threshold_chars: int = 6000,
+        keep_recent: int = 4,
+        message_chars: int = 1000,
+        max_summary_chars: int = 2000,
+        cmd: list[str] | None = None,
+        timeout_sec: int | None = 120,
+    ):
+        self.threshold_chars = max(MIN_THRESHOLD_CHARS, int(threshold_chars))
+        self.keep_recent = max(1, int(keep_recent))
+        self.message_chars = max(100, int(message_chars))
+        self.max_summary_chars = max(200, int(max_summary_chars))
+        self.cmd = list(cmd or [])
+        self.timeout_sec = timeout_sec
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict, prepare=None) -> "ConversationSummarizer | None":
+        cfg = config.get("summaries") or {}
+        if not cfg.get("enabled"):
+            return None
+        cmd = list(cfg.get("cmd") or [])
+        if cmd and prepare is not None:
+            cmd = prepare(cmd)
+        return cls(
+            threshold_chars=cfg.get("threshold_chars", 6000),
+            keep_recent=cfg.get("keep_recent", 4),
+            message_chars=cfg.get("message_chars", 1000),
+            max_summary_chars=cfg.get("max_summary_chars", 2000),
+            cmd=cmd,
+            timeout_sec=cfg.get("timeout_sec", 120),
+        )
+
+    def tighten(self) -> int:
+        """Halve the threshold (run-wide token pressure); returns the new value."""
+        with self._lock:
+            self.threshold_chars = max(MIN_THRESHOLD_CHARS, self.threshold_chars // 2)
+            return self.threshold_chars
+
+    # --- summarizing --------------------------------------------------------
+
+    def _covered(self, state: dict) -> tuple[int, int]:
+        base = archived_count(state)
+        covered = int((state.get("summary") or {}).get("covered") or 0)
+        return base, max(covered, base)
+
+    def pending(self, state: dict) -> tuple[list[dict], int] | None:
+        """Messages to fold into the summary now and the new ``covered``; None if not due."""
+        history = state.get("history") or []
+        base, covered = self._covered(state)
+        end = base + len(history) - self.keep_recent
+        if end <= covered:
+            return None
+        aged = history[covered - base : end - base]
+        with self._lock:
+            threshold = self.threshold_chars
+        if sum(len(m.get("content") or "") for m in aged) < threshold:
+            return None
+        return aged, end
+
+    def prompt(self, previous: str, messages: list[dict]) -> str:
+        lines = "\n".join(f"[{m.get('role', '')}] {_clip(m.get('content') or '', self.message_chars)}" for m in messages)
+        return (
+            "Summarize this conversation between a concertmaster and a performer.\n"
+            "Keep decisions, constraints, results and open issues; drop pleasantries.\n"
+            f"Output plain text only, at most {self.max_summary_chars} characters.\n\n"
+            f"Previous summary:\n{previous or '(none)'}\n\n"
+            f"New messages:\n{lines}"
+        )
+
+    def extractive(self, previous: str, messages: list[dict]) -> str:
+        lines = previous.splitlines() if previous else []
+        lines += [f"- [{m.get('role', '')}] {_one_line(m.get('content') or '', EXTRACT_LINE_CHARS)}" for m in messages]
+        # Over the cap, the oldest lines go first.
+        size = sum(len(line) + 1 for line in lines)
+        while len(lines) > 1 and size > self.max_summary_chars:
+            size -= len(lines.pop(0)) + 1
+        return "\n".join(lines)
+
+    def record(self, text: str, covered: int) -> dict:
+        return {
+            "text": text.strip()[: self.max_summary_chars],
+            "covered": covered,
+            "updated_at": dt.datetime.now().isoformat(),
+        }
+
+    # --- prompt context -----------------------------------------------------
+
+    def context(self, state: dict, skip_last: int = 0) -> tuple[str, list[dict]]:
+        """(summary text, recent messages after it) minus the last ``skip_last`` messages."""
+        history = state.get("history") or []
+        base, covered = self._covered(state)
+        recent = history[covered - base :]
+        if skip_last:
+            recent = recent[:-skip_last]
+        return (state.get("summary") or {}).get("text") or "", recent
+
+    def render(self, state: dict, skip_last: int = 0) -> str:
+        """Summary plus recent turns, each clipped, as a prompt section ("" if empty)."""
+        summary, recent = self.context(state, skip_last)
+        parts = []
+        if summary:
+            parts.append(f"Conversation summary:\n{summary}")
+        if recent:
+            turns = "\n".join(f"[{m.get('role', '')}] {_clip(m.get('content') or '', self.message_chars)}" for m in recent)
+            parts.append(f"Recent turns:\n{turns}")
+        return "\n\n".join(parts)
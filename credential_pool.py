@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""Several credential profiles per role, load-balanced per call.
+
+A role is tied to one CLI command, so one account's rate limit used to be
+the ceiling for the whole host.  A profile is a set of environment
+overrides that points the same CLI at another account, typically
+``CODEX_HOME`` or ``CLAUDE_CONFIG_DIR``::
+
+    "credentials": {
+      "enabled": true,
+      "profiles": {
+        "codex-a": {"env": {"CODEX_HOME": "~/.codex-a"}},
+        "codex-b": {"env": {"CODEX_HOME": "~/.codex-b"}},
+        "claude-a": {"env": {"CLAUDE_CONFIG_DIR": "~/.claude-a"}}
+      },
+      "roles": {"performer": ["codex-a", "codex-b"], "concertmaster": ["claude-a"]},
+      "quota_poll_sec": 300, "exhausted_pct": 95,
+      "error_window": 20, "max_failures": 3, "cooldown_sec": 300
+    }
+
+A profile serves the CLI named by its ``provider``, or else by its
+environment keys (``CODEX_HOME`` → codex, ``CLAUDE_CONFIG_DIR`` → claude).
+A call gets one of the role's profiles for the CLI it is about to run:
+
+- a conversation (role + exchange) stays on the profile it started on, so
+  session state and provider-side prompt caches stay with one account,
+  unless that profile is cooling down or out of quota;
+- otherwise the profile with the fewest calls in flight wins, then the
+  lower recent error rate, then the lower quota use.
+
+A profile cools down for ``cooldown_sec`` after ``max_failures`` failures
+in a row, or after one failure that looks like a rate limit.  Quota use is
+read per profile from ``quota_telemetry`` every ``quota_poll_sec`` seconds
+(0 disables it); profiles past ``exhausted_pct`` are avoided.  When every
+profile is unhealthy, the one that recovers first is used.
+"""
+from __future__ import annotations
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from quota_telemetry import PROVIDERS
+
+# Environment keys that identify the CLI a profile is for.
+PROVIDER_ENV = {"CODEX_HOME": "codex", "CLAUDE_CONFIG_DIR": "claude", "GEMINI_API_KEY": "gemini"}
+RATE_LIMIT_PATTERN = re.compile(r"rate.?limit|usage limit|too many requests|\b429\b|quota", re.I)
+
+
+@dataclass
+class Profile:
+    name: str
+    provider: str
+    env: dict[str, str]
+    in_flight: int = 0
+    calls: int = 0
+    failures_in_row: int = 0
+    cooldown_until: float = 0.0
+    used_pct: float | None = None
+    outcomes: deque = field(default_factory=lambda: deque(maxlen=20))
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+
+@dataclass
+class Lease:
+    """One call's hold on a profile; hand it back to ``release``."""
+    profile: Profile
+    key: str
+
+    @property
+    def name(self) -> str:
+        return self.profile.name
+
+    @property
+    def env(self) -> dict[str, str]:
+        return self.profile.env
+
+
+def _expand(value) -> str:
+    return os.path.expanduser(os.path.expandvars(str(value)))
+
+
+class CredentialPool:
+    """Picks a credential profile per call and tracks each profile's health."""
+
+    def __init__(
+        self,
+        profiles: list[Profile],
+        roles: dict[str, list[str]],
+        exhausted_pct: float = 95.0,
+        max_failures: int = 3,
+        cooldown_sec: float = 300.0,
+        quota_poll_sec: float = 300.0,
+        verbose: bool = False,
+    ):
+        self.profiles = {p.name: p for p in profiles}
+        self.roles = {role: [n for n in names if n in self.profiles] for role, names in roles.items()}
+        self.exhausted_pct = float(exhausted_pct)
+        self.max_failures = max(1, int(max_failures))
+        self.cooldown_sec = float(cooldown_sec)
+        self.quota_poll_sec = float(quota_poll_sec)
+        self.verbose = verbose
+        self._sticky: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(cls, config: dict, verbose: bool = False) -> "CredentialPool | None":
+        cfg = config.get("credentials") or {}
+        if not cfg.get("enabled"):
+            return None
+        window = max(1, int(cfg.get("error_window", 20)))
+        profiles = []
+        for name, spec in (cfg.get("profiles") or {}).items():
+            env = {str(k): _expand(v) for k, v in ((spec or {}).get("env") or {}).items()}
+            provider = (spec or {}).get("provider") or next((PROVIDER_ENV[k] for k in env if k in PROVIDER_ENV), "")
+            profiles.append(Profile(str(name), str(provider), env, outcomes=deque(maxlen=window)))
+        if not profiles:
+            return None
+        pool = cls(
+            profiles,
+            {str(role): list(names or []) for role, names in (cfg.get("roles") or {}).items()},
+            exhausted_pct=cfg.get("exhausted_pct", 95),
+            max_failures=cfg.get("max_failures", 3),
+            cooldown_sec=cfg.get("cooldown_sec", 300),
+            quota_poll_sec=cfg.get("quota_poll_sec", 300),
+            verbose=verbose,
+        )
+        if pool.quota_poll_sec > 0:
+            threading.Thread(target=pool._poll, name="credential-quota", daemon=True).start()
+        return pool
+
+    # --- quota --------------------------------------------------------------
+
+    def _poll(self) -> None:
+        while not self._stop.is_set():
+            for profile in list(self.profiles.values()):
+                fetch = PROVIDERS.get(profile.provider)
+                if fetch is None or self._stop.is_set():
+                    continue
+                try:
+                    status = fetch(profile.env)
+                except Exception as exc:
+                    print(f"[Credentials] {profile.name} のクォータ取得に失敗: {exc}", file=sys.stderr)
+                    continue
+                used = [v for v in (status.get("short_term_percentage"), status.get("weekly_percentage")) if v is not None]
+                with self._lock:
+                    profile.used_pct = max(used) if used else None
+            self._stop.wait(self.quota_poll_sec)
+
+    # --- selection ----------------------------------------------------------
+
+    def _healthy_locked(self, profile: Profile, now: float) -> bool:
+        if profile.cooldown_until > now:
+            return False
+        return profile.used_pct is None or profile.used_pct < self.exhausted_pct
+
+    def acquire(self, role: str, provider: str, conversation: str = "") -> Lease | None:
+        """A profile of ``role`` for ``provider``; None when the role has none (use the default account)."""
+        names = self.roles.get(role) or []
+        with self._lock:
+            candidates = [self.profiles[n] for n in names if self.profiles[n].provider == provider]
+            if not candidates:
+                return None
+            now = time.monotonic()
+            key = f"{role}:{provider}:{conversation}" if conversation else ""
+            chosen = None
+            sticky = self._sticky.get(key) if key else None
+            if sticky is not None:
+                profile = self.profiles[sticky]
+                if profile in candidates and self._healthy_locked(profile, now):
+                    chosen = profile
+            if chosen is None:
+                healthy = [p for p in candidates if self._healthy_locked(p, now)]
+                if healthy:
+                    chosen = min(healthy, key=lambda p: (p.in_flight, round(p.error_rate(), 1), p.used_pct or 0.0))
+                else:
+                    chosen = min(candidates, key=lambda p: p.cooldown_until)
+                if key:
+                    if sticky is not None and self.verbose:
+                        print(f"[Credentials] {key}: {sticky} → {chosen.name}", file=sys.stderr)
+                    self._sticky[key] = chosen.name
+            chosen.in_flight += 1
+            chosen.calls += 1
+            return Lease(chosen, key)
+
+    def release(self, lease: Lease, ok: bool | None, detail: str = "") -> None:
+        """Record the call's outcome (None: abandoned, not the profile's fault)."""
+        profile = lease.profile
+        with self._lock:
+            profile.in_flight = max(0, profile.in_flight - 1)
+            if ok is None:
+                return
+            profile.outcomes.append(ok)
+            if ok:
+                profile.failures_in_row = 0
+                return
+            profile.failures_in_row += 1
+            limited = bool(RATE_LIMIT_PATTERN.search(detail or ""))
+            if limited or profile.failures_in_row >= self.max_failures:
+                profile.cooldown_until = time.monotonic() + self.cooldown_sec
+                profile.failures_in_row = 0
+                if self.verbose:
+                    reason = "レート制限" if limited else "連続失敗"
+                    print(f"[Credentials] {profile.name} を {self.cooldown_sec:.0f} 秒休止します（{reason}）", file=sys.stderr)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    "provider": p.provider,
+                    "calls": p.calls,
+                    "in_flight": p.in_flight,
+                    "error_rate": round(p.error_rate(), 3),
+                    "used_pct": p.used_pct,
+                    **({"cooldown_sec": round(p.cooldown_until - now)} if p.cooldown_until > now else {}),
+                }
+                for name, p in self.profiles.items()
+            }
+
+    def close(self) -> None:
+        self._stop.set()
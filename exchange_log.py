@@ -0,0 +1,709 @@
+#!/usr/bin/env python3
+"""Append-only storage for concertmaster/performer exchanges.
+
+Each exchange is kept as two files under ``runs/<run>/exchanges/``:
+
+- ``exchange_N.jsonl``          event log, one JSON object per line
+- ``exchange_N.snapshot.json``  small snapshot of everything except the
+                                history, plus ``history_count`` and the log
+                                offset it is valid for
+
+Events::
+
+    {"op": "init", "state": {...}}          start of a new exchange
+    {"op": "append", "entry": {...}}        one history message
+    {"op": "set", "fields": {...}}          top-level fields changed
+    {"op": "unset", "keys": [...]}          top-level fields removed
+    {"op": "history", "history": [...]}     history rewritten (rare)
+
+    {"op": "archive", "segment": {...}}     oldest history moved to a segment
+
+A state change therefore costs one short append instead of re-serializing
+the whole document.  Writers from different processes are serialized with
+``flock`` on the log file.
+
+Long conversations roll over: once the history passes
+``ROLLOVER_MAX_ENTRIES`` entries or ``ROLLOVER_MAX_BYTES`` of content, all
+but the newest turns are sealed into a read-only gzip segment
+(``exchange_N.seg00001.jsonl.gz``), an ``archive`` index entry is added to
+the state and the log is compacted to a fresh ``init`` line.  The live state
+(and every API response built from it) therefore stays small; archived turns
+are read on demand with ``read_segment``.
+
+Two views sit on top of the log:
+
+- ``SharedExchange`` is the in-process store the orchestrator's workers
+  share.  Reads and updates touch only memory under a
+  ``threading.Condition``; events are persisted by a background writer
+  that coalesces them, except at durability points (``waiting_for_user``,
+  ``done``, ``error``) where the update is flushed before it returns.
+  Events appended by other processes (web replies) are picked up on the
+  next read, and — when watchdog is installed — one process-wide
+  ``ExchangeWatcher`` wakes the exchange's waiters as soon as they land.
+- ``ExchangeLog`` is for other processes (the web server): it caches the
+  replayed state and byte offset and only parses lines written since the
+  last read.
+"""
+from __future__ import annotations
+
+import atexit
+import contextlib
+import copy
+import functools
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+try:
+    import fcntl
+except Exception:  # not available on Windows
+    fcntl = None
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except Exception:
+    FileSystemEventHandler = None
+    Observer = None
+
+LOG_SUFFIX = ".jsonl"
+SNAPSHOT_SUFFIX = ".snapshot.json"
+SEGMENT_SUFFIX = ".jsonl.gz"
+# Rewrite the snapshot at least this often even when only history grows.
+SNAPSHOT_EVERY = 16
+MAX_OPEN_LOGS = 256
+# Statuses that hand the exchange to another process (the user via the web
+# UI) or end it; updates entering them are written before returning.
+DURABLE_STATUSES = frozenset({"waiting_for_user", "done", "error", "budget_exhausted"})
+WRITE_BEHIND_SEC = 0.2
+# Pause before retrying exchanges whose write-behind flush failed.
+RETRY_SEC = 1.0
+# History rollover thresholds (``exchanges`` in config.json, see configure_rollover).
+ROLLOVER_MAX_ENTRIES = 200
+ROLLOVER_MAX_BYTES = 512 * 1024
+ROLLOVER_KEEP = 50
+
+
+def configure_rollover(cfg: dict) -> None:
+    global ROLLOVER_MAX_ENTRIES, ROLLOVER_MAX_BYTES, ROLLOVER_KEEP
+    ROLLOVER_MAX_ENTRIES = max(2, int(cfg.get("rollover_max_entries", ROLLOVER_MAX_ENTRIES)))
+    ROLLOVER_MAX_BYTES = max(1024, int(cfg.get("rollover_max_bytes", ROLLOVER_MAX_BYTES)))
+    ROLLOVER_KEEP = max(1, min(int(cfg.get("rollover_keep", ROLLOVER_KEEP)), ROLLOVER_MAX_ENTRIES - 1))
+
+
+def snapshot_path(log_path: Path) -> Path:
+    return log_path.with_name(log_path.name[: -len(LOG_SUFFIX)] + SNAPSHOT_SUFFIX)
+
+
+def segment_path(log_path: Path, seq: int) -> Path:
+    return log_path.with_name(f"{log_path.name[: -len(LOG_SUFFIX)]}.seg{seq:05d}{SEGMENT_SUFFIX}")
+
+
+def log_inode(path: Path) -> int | None:
+    try:
+        return os.stat(path).st_ino
+    except OSError:
+        return None
+
+
+def archived_count(state: dict) -> int:
+    return sum(int(seg.get("count") or 0) for seg in state.get("archive") or [])
+
+
+def count_role(state: dict, role: str) -> int:
+    """Messages from ``role`` over the whole conversation, archived segments included."""
+    archived = sum(int((seg.get("roles") or {}).get(role) or 0) for seg in state.get("archive") or [])
+    return archived + sum(1 for item in state.get("history") or [] if item.get("role") == role)
+
+
+def apply_event(state: dict, event: dict, with_history: bool = True) -> None:
+    op = event.get("op")
+    if op == "init":
+        state.clear()
+        state.update(copy.deepcopy(event.get("state") or {}))
+        history = list(state.get("history") or [])
+        state["history"] = history if with_history else []
+        state["history_count"] = archived_count(state) + len(history)
+    elif op == "append":
+        if with_history:
+            state.setdefault("history", []).append(event.get("entry") or {})
+        state["history_count"] = int(state.get("history_count") or 0) + 1
+    elif op == "set":
+        state.update(event.get("fields") or {})
+    elif op == "unset":
+        for key in event.get("keys") or []:
+            state.pop(key, None)
+    elif op == "history":
+        history = list(event.get("history") or [])
+        state["history"] = history if with_history else []
+        state["history_count"] = archived_count(state) + len(history)
+    elif op == "archive":
+        segment = dict(event.get("segment") or {})
+        state["archive"] = [*(state.get("archive") or []), segment]
+        if with_history:
+            state["history"] = list(state.get("history") or [])[int(segment.get("count") or 0):]
+
+
+def diff_events(before: dict, before_history: list, after: dict) -> list[dict]:
+    """Events turning ``before`` (+ ``before_history``) into ``after``."""
+    events: list[dict] = []
+    history = after.get("history") or []
+    n = len(before_history)
+    # Compared by value: a rebuilt or reloaded history that only grew still
+    # appends, and an edited entry is caught (shared entries compare by identity first).
+    if len(history) >= n and history[:n] == before_history:
+        events.extend({"op": "append", "entry": entry} for entry in history[n:])
+    else:
+        events.append({"op": "history", "history": history})
+    changed = {
+        k: v for k, v in after.items() if k not in ("history", "history_count") and (k not in before or before[k] != v)
+    }
+    if changed:
+        events.append({"op": "set", "fields": changed})
+    removed = [k for k in before if k not in after and k not in ("history", "history_count")]
+    if removed:
+        events.append({"op": "unset", "keys": removed})
+    return events
+
+
+@contextlib.contextmanager
+def locked_log(path: Path):
+    """Open the log for appending with an exclusive flock held."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        f = path.open("ab")
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        # A rollover replaces the file; if we locked the old one, start over.
+        if log_inode(path) == os.fstat(f.fileno()).st_ino:
+            break
+        f.close()
+    try:
+        yield f
+    finally:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+
+def read_events(path: Path, offset: int) -> tuple[list[dict], int]:
+    """Complete lines after ``offset``; returns (events, new offset)."""
+    try:
+        with path.open("rb") as f:
+            f.seek(offset)
+            chunk = f.read()
+    except OSError:
+        return [], offset
+    end = chunk.rfind(b"\n") + 1  # leave a partially written line for next time
+    events = []
+    for line in chunk[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue
+    return events, offset + end
+
+
+def append_events(f, events: list[dict]) -> int:
+    payload = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events).encode("utf-8")
+    f.write(payload)
+    f.flush()
+    return len(payload)
+
+
+def write_snapshot(log_path: Path, state: dict, offset: int) -> None:
+    snap = {k: v for k, v in state.items() if k != "history"}
+    snap["log_offset"] = offset
+    snap["log_inode"] = log_inode(log_path)
+    target = snapshot_path(log_path)
+    tmp = target.with_name(target.name + ".tmp")
+    tmp.write_text(json.dumps(snap, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(target)
+
+
+def rewrite_log(log_path: Path, events: list[dict]) -> int:
+    """Atomically replace the log with ``events``; returns the new size."""
+    payload = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events).encode("utf-8")
+    tmp = log_path.with_name(log_path.name + ".tmp")
+    tmp.write_bytes(payload)
+    tmp.replace(log_path)
+    return len(payload)
+
+
+def _entry_size(entry: dict) -> int:
+    # Content dominates; the rest of an entry is a few short fields.
+    return len(entry.get("content") or "") + 100
+
+
+def rollover_split(history: list[dict]) -> int:
+    """Number of oldest entries to archive now (0 while under both limits)."""
+    if len(history) <= ROLLOVER_MAX_ENTRIES and sum(_entry_size(e) for e in history) <= ROLLOVER_MAX_BYTES:
+        return 0
+    keep = size = 0
+    for entry in reversed(history):
+        if keep >= ROLLOVER_KEEP or (keep and size + _entry_size(entry) > ROLLOVER_MAX_BYTES // 2):
+            break
+        keep += 1
+        size += _entry_size(entry)
+    return len(history) - keep
+
+
+def seal_segment(log_path: Path, seq: int, start: int, entries: list[dict]) -> dict:
+    """Write ``entries`` to a read-only gzip segment; returns its index entry."""
+    target = segment_path(log_path, seq)
+    payload = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries).encode("utf-8")
+    tmp = target.with_name(target.name + ".tmp")
+    with contextlib.suppress(OSError):
+        tmp.unlink()
+    with gzip.open(tmp, "wb") as f:
+        f.write(payload)
+    os.chmod(tmp, 0o444)
+    tmp.replace(target)
+    return {
+        "seq": seq,
+        "file": target.name,
+        "start": start,
+        "count": len(entries),
+        "bytes": len(payload),
+        "first_at": entries[0].get("timestamp"),
+        "last_at": entries[-1].get("timestamp"),
+        "roles": dict(Counter(e.get("role") or "" for e in entries)),
+    }
+
+
+@functools.lru_cache(maxsize=32)
+def _load_segment(path: str, mtime_ns: int) -> tuple[dict, ...]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return tuple(json.loads(line) for line in f if line.strip())
+
+
+def read_segment(log_path: Path, segment: dict) -> list[dict]:
+    """Entries of one archived segment (sealed files are cached once read)."""
+    path = Path(log_path).with_name(Path(str(segment.get("file") or "")).name)
+    try:
+        return list(_load_segment(str(path), path.stat().st_mtime_ns))
+    except (OSError, ValueError, EOFError):
+        return []
+
+
+def copy_state(state: dict) -> dict:
+    """Caller-owned copy: fields deep-copied, history list copied (entries shared, read-only)."""
+    data = {k: copy.deepcopy(v) for k, v in state.items() if k not in ("history", "history_count")}
+    data["history"] = list(state.get("history") or [])
+    return data
+
+
+def _diff_update(state: dict, update_fn) -> list[dict]:
+    before = {k: copy.deepcopy(v) for k, v in state.items() if k not in ("history", "history_count")}
+    before_history = list(state.get("history") or [])
+    data = copy.deepcopy(before)
+    data["history"] = list(before_history)
+    data = update_fn(data)
+    return diff_events(before, before_history, data)
+
+
+class ExchangeLog:
+    """Replayed view of one exchange log; use ``ExchangeLog.open`` to share instances."""
+
+    _registry: dict[str, "ExchangeLog"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._state: dict = {}
+        self._offset = 0
+        self._inode: int | None = None
+        self._since_snapshot = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def open(cls, path: Path) -> "ExchangeLog":
+        key = str(Path(path).resolve())
+        with cls._registry_lock:
+            log = cls._registry.pop(key, None) or cls(Path(path))
+            cls._registry[key] = log  # most recently used last
+            while len(cls._registry) > MAX_OPEN_LOGS:
+                cls._registry.pop(next(iter(cls._registry)))
+            return log
+
+    def _refresh_locked(self) -> None:
+        try:
+            st = self.path.stat()
+        except OSError:
+            self._state, self._offset = {}, 0
+            return
+        size = st.st_size
+        if size < self._offset or st.st_ino != self._inode:  # log was recreated or rolled over
+            self._state, self._offset, self._inode = {}, 0, st.st_ino
+        if size == self._offset:
+            return
+        events, self._offset = read_events(self.path, self._offset)
+        for event in events:
+            apply_event(self._state, event)
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def archived(self, seq: int) -> dict | None:
+        """One archived history segment: its index entry plus the entries."""
+        with self._lock:
+            self._refresh_locked()
+            segment = next((s for s in self._state.get("archive") or [] if s.get("seq") == seq), None)
+        if segment is None:
+            return None
+        return {"segment": dict(segment), "history": read_segment(self.path, segment)}
+
+    def read(self) -> dict:
+        with self._lock:
+            self._refresh_locked()
+            if not self._state:
+                return {}
+            return copy_state(self._state)
+
+    def _append_locked(self, f, events: list[dict]) -> None:
+        if not events:
+            return
+        self._offset += append_events(f, events)
+        for event in events:
+            apply_event(self._state, event)
+        self._since_snapshot += len(events)
+        if self._since_snapshot >= SNAPSHOT_EVERY or any(e["op"] != "append" for e in events):
+            write_snapshot(self.path, self._state, self._offset)
+            self._since_snapshot = 0
+
+    def create(self, state: dict) -> dict:
+        with self._lock, locked_log(self.path) as f:
+            f.truncate(0)
+            self._state, self._offset, self._inode = {}, 0, os.fstat(f.fileno()).st_ino
+            self._append_locked(f, [{"op": "init", "state": state}])
+            return copy_state(self._state)
+
+    def update(self, update_fn) -> dict:
+        """Apply ``update_fn`` to a copy of the state and append the resulting events."""
+        with self._lock, locked_log(self.path) as f:
+            self._refresh_locked()
+            self._append_locked(f, _diff_update(self._state, update_fn))
+            return copy_state(self._state)
+
+
+class SharedExchange:
+    """In-memory exchange shared by the workers of one process, persisted write-behind.
+
+    ``cond`` guards the state; every update bumps ``version`` and notifies
+    it, so a role waiting for its turn wakes as soon as the previous role
+    hands over.
+    """
+
+    _registry: dict[str, "SharedExchange"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.cond = threading.Condition()
+        # Tags our own lines so they are not applied twice when re-reading the log.
+        self.src = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._state: dict = {}
+        self._pending: list[dict] = []
+        self._disk_offset = 0
+        self._inode: int | None = None
+        self._since_snapshot = 0
+        self.version = 0
+
+    @classmethod
+    def open(cls, path: Path) -> "SharedExchange":
+        key = str(Path(path).resolve())
+        with cls._registry_lock:
+            shared = cls._registry.get(key)
+            if shared is None:
+                shared = cls._registry[key] = cls(Path(path))
+                with shared.cond:
+                    shared._absorb_locked()
+                _watcher.watch(key, shared)
+            return shared
+
+    @classmethod
+    def create(cls, path: Path, state: dict) -> dict:
+        shared = cls.open(path)
+        with shared.cond:
+            shared._pending.clear()
+            with locked_log(shared.path) as f:
+                f.truncate(0)
+                shared._state, shared._disk_offset = {}, 0
+                shared._inode = os.fstat(f.fileno()).st_ino
+                event = {"op": "init", "state": state, "src": shared.src}
+                shared._disk_offset = append_events(f, [event])
+                apply_event(shared._state, event)
+                write_snapshot(shared.path, shared._state, shared._disk_offset)
+            shared._changed_locked()
+            return copy_state(shared._state)
+
+    def _absorb_locked(self) -> bool:
+        """Apply lines other processes appended since our last write. True if any."""
+        inode = log_inode(self.path)
+        if self._inode is not None and inode is not None and inode != self._inode:
+            # Rolled over by another process: rebuild, then redo our unsaved changes.
+            self._inode = inode
+            events, self._disk_offset = read_events(self.path, 0)
+            self._state = {}
+            for event in [*events, *self._pending]:
+                apply_event(self._state, event)
+            return True
+        self._inode = inode
+        events, offset = read_events(self.path, self._disk_offset)
+        foreign = [e for e in events if e.get("src") != self.src]
+        if foreign and self._pending:
+            # Our unsaved events will land after the foreign lines: replay in
+            # that order so memory, the log and the snapshot agree.
+            events, offset = read_events(self.path, 0)
+            self._state = {}
+            for event in [*events, *self._pending]:
+                apply_event(self._state, event)
+        else:
+            for event in foreign:
+                apply_event(self._state, event)
+        self._disk_offset = offset
+        return bool(foreign)
+
+    def _changed_locked(self) -> None:
+        self.version += 1
+        self.cond.notify_all()
+
+    def _flush_locked(self) -> None:
+        with locked_log(self.path) as f:
+            # Foreign lines first, so the snapshot matches what is on disk.
+            if self._absorb_locked():
+                self._changed_locked()
+            if self._pending:
+                # Dropped only once written, so a failed flush is retried.
+                events = list(self._pending)
+                self._disk_offset += append_events(f, events)
+                del self._pending[: len(events)]
+                self._since_snapshot += len(events)
+                if self._since_snapshot >= SNAPSHOT_EVERY or any(e["op"] != "append" for e in events):
+                    write_snapshot(self.path, self._state, self._disk_offset)
+                    self._since_snapshot = 0
+            self._rollover_locked()
+
+    def _rollover_locked(self) -> None:
+        """Seal old history into a segment and compact the log (log lock held)."""
+        history = self._state.get("history") or []
+        count = rollover_split(history)
+        if count <= 0:
+            return
+        archive = self._state.get("archive") or []
+        seq = (int(archive[-1].get("seq") or 0) if archive else 0) + 1
+        segment = seal_segment(self.path, seq, archived_count(self._state), history[:count])
+        apply_event(self._state, {"op": "archive", "segment": segment})
+        state = {k: v for k, v in self._state.items() if k != "history_count"}
+        self._disk_offset = rewrite_log(self.path, [{"op": "init", "state": state, "src": self.src}])
+        self._inode = log_inode(self.path)
+        write_snapshot(self.path, self._state, self._disk_offset)
+        self._since_snapshot = 0
+
+    def read(self) -> dict:
+        with self.cond:
+            self._poll_foreign_locked()
+            return copy_state(self._state) if self._state else {}
+
+    def read_with_version(self) -> tuple[int, dict]:
+        """State plus the version to pass to ``wait`` for the next change."""
+        with self.cond:
+            self._poll_foreign_locked()
+            return self.version, (copy_state(self._state) if self._state else {})
+
+    def wait(self, seen_version: int, timeout: float | None = None) -> bool:
+        """Block until the exchange changes after ``seen_version``. False on timeout."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.version != seen_version, timeout)
+
+    def wake(self) -> None:
+        """Wake every waiter without changing the state (e.g. a stop request)."""
+        with self.cond:
+            self._changed_locked()
+
+    def _poll_foreign_locked(self) -> None:
+        try:
+            st = self.path.stat()
+        except OSError:
+            return
+        if st.st_size > self._disk_offset or st.st_ino != self._inode:
+            self._flush_locked()
+
+    def update(self, update_fn) -> dict:
+        with self.cond:
+            self._poll_foreign_locked()
+            events = _diff_update(self._state, update_fn)
+            if not events:
+                return copy_state(self._state)
+            for event in events:
+                event["src"] = self.src
+                apply_event(self._state, event)
+            self._pending.extend(events)
+            if self._state.get("status") in DURABLE_STATUSES and any(e["op"] == "set" and "status" in e["fields"] for e in events):
+                self._flush_locked()
+            else:
+                _writer.mark_dirty(self)
+            self._changed_locked()
+            return copy_state(self._state)
+
+    def flush(self) -> None:
+        with self.cond:
+            self._flush_locked()
+
+    @classmethod
+    def flush_all(cls) -> None:
+        with cls._registry_lock:
+            shared = list(cls._registry.values())
+        for item in shared:
+            item.flush()
+
+    @classmethod
+    def release(cls, path: Path) -> None:
+        """Flush and drop an exchange from the registry (end of run)."""
+        with cls._registry_lock:
+            shared = cls._registry.pop(str(Path(path).resolve()), None)
+        if shared is not None:
+            _watcher.unwatch(str(Path(path).resolve()))
+            shared.flush()
+
+    def absorb_external(self) -> None:
+        """Pick up lines another process appended and wake waiters if there were any."""
+        with self.cond:
+            if self._absorb_locked():
+                self._changed_locked()
+
+
+class _WriteBehind:
+    """One daemon thread persisting dirty exchanges, coalescing bursts of updates."""
+
+    def __init__(self, delay_sec: float):
+        self.delay_sec = delay_sec
+        self._dirty: set[SharedExchange] = set()
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def mark_dirty(self, shared: SharedExchange) -> None:
+        with self._cond:
+            self._dirty.add(shared)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="exchange-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._dirty:
+                    self._cond.wait()
+            time.sleep(self.delay_sec)
+            with self._cond:
+                batch, self._dirty = self._dirty, set()
+            failed = []
+            for shared in batch:
+                try:
+                    shared.flush()
+                except Exception as exc:
+                    # e.g. disk full or the run dir gone: keep it dirty and retry.
+                    print(f"[ExchangeLog] {shared.path} の保存に失敗: {exc}", file=sys.stderr)
+                    failed.append(shared)
+            if failed:
+                with self._cond:
+                    self._dirty.update(failed)
+                time.sleep(max(self.delay_sec, RETRY_SEC))
+
+
+class ExchangeWatcher:
+    """A single watchdog observer for every exchange log in the process.
+
+    Directories are scheduled once; file events are dispatched by path with a
+    dict lookup, so the cost does not grow with the number of exchanges.
+    """
+
+    def __init__(self):
+        self._targets: dict[str, SharedExchange] = {}
+        self._dirs: set[str] = set()
+        self._observer = None
+        self._failed = Observer is None or FileSystemEventHandler is None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self._observer is not None
+
+    def watch(self, key: str, shared: SharedExchange) -> None:
+        if self._failed:
+            return
+        directory = os.path.dirname(key)
+        with self._lock:
+            self._targets[key] = shared
+            if directory in self._dirs:
+                return
+            try:
+                if self._observer is None:
+                    self._observer = Observer()
+                    self._observer.daemon = True
+                    self._observer.start()
+                Path(directory).mkdir(parents=True, exist_ok=True)
+                self._observer.schedule(_WatchDispatch(self), directory, recursive=False)
+                self._dirs.add(directory)
+            except Exception:
+                # e.g. inotify limits: readers fall back to polling on read.
+                self._failed = True
+                self._observer = None
+
+    def unwatch(self, key: str) -> None:
+        with self._lock:
+            self._targets.pop(key, None)
+
+    def dispatch(self, path: str) -> None:
+        shared = self._targets.get(path)
+        if shared is not None:
+            shared.absorb_external()
+
+
+if FileSystemEventHandler is not None:
+    class _WatchDispatch(FileSystemEventHandler):
+        def __init__(self, watcher: ExchangeWatcher):
+            self.watcher = watcher
+
+        def on_modified(self, event):
+            self.watcher.dispatch(event.src_path)
+
+        def on_created(self, event):
+            self.watcher.dispatch(event.src_path)
+
+
+def wakes_on_external_writes() -> bool:
+    """True if waiters are woken by other processes' writes (otherwise poll)."""
+    return _watcher.active
+
+
+_watcher = ExchangeWatcher()
+_writer = _WriteBehind(WRITE_BEHIND_SEC)
+atexit.register(SharedExchange.flush_all)
+
+
+def read_summary(log_path: Path) -> dict:
+    """Everything but the history, from the snapshot plus any newer log lines."""
+    state: dict = {}
+    offset = 0
+    try:
+        state = json.loads(snapshot_path(Path(log_path)).read_text(encoding="utf-8"))
+        offset = int(state.pop("log_offset", 0))
+        if state.pop("log_inode", None) not in (None, log_inode(Path(log_path))):
+            state, offset = {}, 0  # snapshot predates a rollover
+    except (OSError, ValueError):
+        state, offset = {}, 0
+    events, _ = read_events(Path(log_path), offset)
+    for event in events:
+        apply_event(state, event, with_history=False)
+    state.pop("history", None)
+    return state
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Per-assignment backend routing for performer tasks.
+
+Each assignment is reduced to a few coarse features (task type from
+keywords, size bucket from text length, ``dag``/``bag`` group).  The
+backend and timeout are then chosen by, in order:
+
+1. ``routing.rules`` in config.json — first matching rule wins,
+2. outcomes of earlier runs for the same (type, size) bucket, read from
+   ``routing_history.jsonl`` — the fastest backend that still meets
+   ``min_success_rate`` over at least ``min_samples`` runs,
+3. the configured ``performer.cmd``.
+
+Every finished assignment appends its outcome (turns used, latency,
+success) to the history file so later runs route on it.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import json
+import random
+import re
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# Checked in order; the first type whose pattern matches the task text wins.
+TASK_TYPES = [
+    ("trivial", r"\brename|\btypo|\bformat(ting)?\b|\blint|\bbump|名前変更|リネーム|誤字|整形"),
+    ("design", r"\bdesign|architect|\bplan\b|設計|アーキテクチャ|方針|構成案"),
+    ("test", r"\btests?\b|pytest|unit test|テスト"),
+    ("docs", r"readme|\bdocument|docstring|ドキュメント|説明書|コメント"),
+    ("fix", r"\bfix|\bbug|\berror|\bcrash|修正|不具合|バグ|エラー"),
+    ("research", r"investigat|research|survey|調査|比較|検討"),
+    ("implement", r"implement|\badd\b|\bcreate|\bbuild|\bwrite|実装|追加|作成|構築"),
+]
+SIZE_LIMITS = (("small", 80), ("medium", 300))
+
+
+def task_features(inst: dict) -> dict:
+    text = f"{inst.get('task') or ''}\n{inst.get('notes') or ''}".strip()
+    lowered = text.lower()
+    task_type = "other"
+    for name, pattern in TASK_TYPES:
+        if re.search(pattern, lowered):
+            task_type = name
+            break
+    size = "large"
+    for name, limit in SIZE_LIMITS:
+        if len(text) <= limit:
+            size = name
+            break
+    if task_type == "trivial" and size == "medium":
+        size = "small"
+    return {
+        "type": task_type,
+        "size": size,
+        "group": inst.get("group") or "",
+        "deps": len(inst.get("deps") or []),
+        "chars": len(text),
+    }
+
+
+@dataclass
+class Route:
+    backend: str
+    cmd: list[str]
+    timeout_sec: int | None
+    reason: str
+    features: dict = field(default_factory=dict)
+
+    def describe(self) -> dict:
+        return {"backend": self.backend, "timeout_sec": self.timeout_sec, "reason": self.reason, **self.features}
+
+
+def _rule_matches(match: dict, features: dict, text: str) -> bool:
+    for key in ("type", "size", "group"):
+        want = match.get(key)
+        if want is None:
+            continue
+        allowed = want if isinstance(want, list) else [want]
+        if features.get(key) not in allowed:
+            return False
+    if "max_chars" in match and features["chars"] > int(match["max_chars"]):
+        return False
+    if "min_chars" in match and features["chars"] < int(match["min_chars"]):
+        return False
+    pattern = match.get("pattern")
+    if pattern and not re.search(pattern, text, re.IGNORECASE):
+        return False
+    return True
+
+
+class ModelRouter:
+    """Chooses a performer backend per assignment and learns from outcomes."""
+
+    def __init__(
+        self,
+        cfg: dict,
+        backends: dict[str, dict],
+        default_cmd: list[str],
+        default_timeout: int | None,
+        default_backend: str,
+        history_path: Path,
+        prepare=None,
+    ):
+        self.rules = list(cfg.get("rules") or [])
+        self.learn = bool(cfg.get("learn", True))
+        self.candidates = list(cfg.get("candidates") or dict.fromkeys([default_backend, *backends]))
+        self.min_samples = int(cfg.get("min_samples", 3))
+        self.min_success_rate = float(cfg.get("min_success_rate", 0.8))
+        self.explore_rate = float(cfg.get("explore_rate", 0.0))
+        self.timeout_factor = float(cfg.get("timeout_factor", 3.0))
+        self.min_timeout_sec = int(cfg.get("min_timeout_sec", 120))
+        self.max_history = int(cfg.get("max_history", 5000))
+        self.backends = backends
+        self.default_cmd = default_cmd
+        self.default_timeout = default_timeout
+        self.default_backend = default_backend
+        self.history_path = history_path
+        self.prepare = prepare or (lambda cmd: list(cmd))
+        self._lock = threading.Lock()
+        self._history = self._load()
+
+    @classmethod
+    def from_config(
+        cls,
+        config: dict,
+        backends: dict[str, dict],
+        default_cmd: list[str],
+        default_timeout: int | None,
+        default_backend: str,
+        runs_dir: Path,
+        prepare=None,
+    ) -> "ModelRouter | None":
+        cfg = config.get("routing") or {}
+        if not cfg.get("enabled"):
+            return None
+        history = Path(str(cfg.get("history") or runs_dir / "routing_history.jsonl")).expanduser()
+        return cls(cfg, backends, default_cmd, default_timeout, default_backend, history, prepare)
+
+    def _load(self) -> list[dict]:
+        try:
+            lines = self.history_path.read_text(encoding="utf-8").splitlines()
+        except OSError:
+            return []
+        records = []
+        for line in lines[-self.max_history:]:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def _route_to(self, backend: str, timeout: int | None, reason: str, features: dict) -> Route | None:
+        spec = self.backends.get(backend) or {}
+        if backend == self.default_backend:
+            cmd = list(self.default_cmd)
+        elif spec.get("cmd"):
+            cmd = self.prepare(list(spec["cmd"]))
+        else:
+            return None
+        if timeout is None:
+            timeout = spec.get("timeout_sec", self.default_timeout)
+        return Route(backend, cmd, timeout, reason, features)
+
+    def _learned(self, features: dict) -> tuple[str, int | None] | None:
+        stats: dict[str, list[dict]] = {}
+        with self._lock:
+            for rec in self._history:
+                if rec.get("type") == features["type"] and rec.get("size") == features["size"]:
+                    stats.setdefault(rec.get("backend") or "", []).append(rec)
+        best = None
+        for backend in self.candidates:
+            runs = stats.get(backend) or []
+            if len(runs) < self.min_samples:
+                continue
+            wins = [r for r in runs if r.get("success")]
+            if len(wins) / len(runs) < self.min_success_rate:
+                continue
+            latencies = sorted(float(r.get("latency_sec") or 0) for r in wins)
+            median = latencies[len(latencies) // 2]
+            p90 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))]
+            if best is None or median < best[1]:
+                best = (backend, median, p90)
+        if best is None:
+            return None
+        timeout = max(self.min_timeout_sec, int(best[2] * self.timeout_factor))
+        if self.default_timeout:
+            timeout = min(timeout, int(self.default_timeout))
+        return best[0], timeout
+
+    def route(self, inst: dict) -> Route:
+        features = task_features(inst)
+        text = f"{inst.get('task') or ''}\n{inst.get('notes') or ''}"
+        for idx, rule in enumerate(self.rules):
+            if _rule_matches(rule.get("match") or {}, features, text):
+                chosen = self._route_to(str(rule.get("backend") or ""), rule.get("timeout_sec"), f"rule:{idx}", features)
+                if chosen is not None:
+                    return chosen
+        if self.learn:
+            if self.explore_rate and random.random() < self.explore_rate and self.candidates:
+                chosen = self._route_to(random.choice(self.candidates), None, "explore", features)
+                if chosen is not None:
+                    return chosen
+            learned = self._learned(features)
+            if learned is not None:
+                chosen = self._route_to(learned[0], learned[1], "history", features)
+                if chosen is not None:
+                    return chosen
+        return Route(self.default_backend, list(self.default_cmd), self.default_timeout, "default", features)
+
+    def record(self, route: Route, turns: int, latency_sec: float, success: bool) -> None:
+        rec = {
+            "timestamp": dt.datetime.now().isoformat(),
+            "type": route.features.get("type"),
+            "size": route.features.get("size"),
+            "group": route.features.get("group"),
+            "backend": route.backend,
+            "reason": route.reason,
+            "turns": turns,
+            "latency_sec": round(latency_sec, 2),
+            "success": success,
+        }
+        with self._lock:
+            self._history.append(rec)
+            del self._history[:-self.max_history]
+            try:
+                self.history_path.parent.mkdir(parents=True, exist_ok=True)
+                with self.history_path.open("a", encoding="utf-8") as f:
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            except OSError:
+                pass
@@ -2,38 +2,54 @@
 from __future__ import annotations
 
 import argparse
+import concurrent.futures
+import contextlib
 import datetime as dt
 import json
 import os
 import re
+import shutil
+import signal
+import socket
 import subprocess
 import sys
+import tempfile
 import textwrap
 import threading
 import time
+import traceback
 import uuid
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Callable
 
-try:
-    import yaml
-except Exception:
-    yaml = None
-
-try:
-    from watchdog.events import FileSystemEventHandler
-    from watchdog.observers import Observer
-except Exception:
-    FileSystemEventHandler = None
-    Observer = None
-
 try:
     from ssh_remote import setup_remote, teardown_remote
 except Exception:
     setup_remote = None
     teardown_remote = None
 
+import artifact_codec
+from artifact_codec import ensure_yaml_available, yaml_dump
+from call_broker import BrokerClient, broker_client_from_config
+from circuit_breaker import BreakerBoard, CircuitBreaker
+from cli_adapters import CliAdapter, adapter_for
+from control_plane import ControlServer, apply_reply as apply_user_reply
+from conversation_summary import ConversationSummarizer
+from credential_pool import CredentialPool
+from exchange_log import SharedExchange, configure_rollover, count_role, wakes_on_external_writes
+from model_router import ModelRouter
+from prompt_layout import PromptCache, layered, prefix_id
+from quota_pacer import QuotaPacer
+from resource_limits import ResourcePolicy, RoleLimits
+from run_estimator import estimate_run, format_estimate
+import structured_extract
+from token_budget import BudgetExhausted, TokenBudget
+from token_estimator import TokenEstimator
+from token_ledger import RECENT_CALLS, TokenLedger
+from token_service import TokenService
+from turn_queue import DEFAULT_LEASE_SEC, TurnQueue, open_queue
+
 
 _BULLET_RE = re.compile(r"^\s*(?:[-*•・]|(?:\d+)[\)\.\:]?|\(\d+\))\s+")
 
@@ -52,12 +68,17 @@ _PERCENT_USED_PATTERN = re.compile(r"(\d+)%\s*(?:used|usage)", re.IGNORECASE)
 
 @dataclass
 class TokenUsage:
-    """Tracks cumulative token usage across orchestrator operations."""
+    """Tracks cumulative token usage across orchestrator operations.
+
+    ``add_usage`` is called from every worker thread; totals and the ledger
+    are updated under one lock, and threshold callbacks run outside it.
+    """
     total_input: int = 0
     total_output: int = 0
     total_combined: int = 0
     call_count: int = 0
-    history: list = field(default_factory=list)
+    # Recent calls (bounded) plus per-role / per-task / per-backend aggregates.
+    ledger: TokenLedger = field(default_factory=TokenLedger)
 
     # Configurable limits
     warning_threshold: float = 0.75  # Warn at 75% of limit
@@ -67,24 +88,46 @@ class TokenUsage:
     # Callbacks for threshold events
     on_warning: Callable[["TokenUsage"], None] | None = None
     on_compact_needed: Callable[["TokenUsage"], None] | None = None
+    # When set, threshold events go to this background service instead of
+    # running the callbacks in the calling worker thread.
+    service: "TokenService | None" = None
+
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def history(self) -> list[dict]:
+        """The most recent calls (at most the ledger's ring size)."""
+        with self._lock:
+            return list(self.ledger.recent)
 
-    def add_usage(self, input_tokens: int = 0, output_tokens: int = 0, label: str = "") -> None:
+    def add_usage(self, input_tokens: int = 0, output_tokens: int = 0, label: str = "", meta: dict | None = None) -> None:
         """Record token usage from an operation."""
-        self.total_input += input_tokens
-        self.total_output += output_tokens
         combined = input_tokens + output_tokens
-        self.total_combined += combined
-        self.call_count += 1
-        self.history.append({
+        entry = {
             "label": label,
             "input": input_tokens,
             "output": output_tokens,
             "combined": combined,
-            "cumulative": self.total_combined,
             "timestamp": dt.datetime.now().isoformat(),
-        })
+        }
+        if meta:
+            entry.update(meta)
+        with self._lock:
+            self.total_input += input_tokens
+            self.total_output += output_tokens
+            self.total_combined += combined
+            self.call_count += 1
+            entry["cumulative"] = self.total_combined
+            self.ledger.record(entry)
         self._check_thresholds()
 
+    def rescale(self, factor: float) -> None:
+        """Scale the running totals, e.g. after a context compaction."""
+        with self._lock:
+            self.total_combined = int(self.total_combined * factor)
+            self.total_input = int(self.total_input * factor)
+            self.total_output = int(self.total_output * factor)
+
     def usage_ratio(self) -> float:
         """Return current usage as a ratio of max_tokens."""
         if self.max_tokens <= 0:
@@ -94,24 +137,36 @@ class TokenUsage:
     def _check_thresholds(self) -> None:
         """Check if thresholds are exceeded and trigger callbacks."""
         ratio = self.usage_ratio()
+        if self.service is not None:
+            if ratio >= self.compact_threshold:
+                self.service.submit("compact", self)
+            elif ratio >= self.warning_threshold:
+                self.service.submit("warning", self)
+            else:
+                self.service.submit("ok")
+            return
         if ratio >= self.compact_threshold and self.on_compact_needed:
             self.on_compact_needed(self)
         elif ratio >= self.warning_threshold and self.on_warning:
             self.on_warning(self)
 
     def to_dict(self) -> dict:
-        """Export usage stats as a dictionary."""
-        return {
-            "total_input": self.total_input,
-            "total_output": self.total_output,
-            "total_combined": self.total_combined,
-            "call_count": self.call_count,
-            "usage_ratio": round(self.usage_ratio(), 4),
-            "max_tokens": self.max_tokens,
-            "warning_threshold": self.warning_threshold,
-            "compact_threshold": self.compact_threshold,
-            "history": self.history,
-        }
+        """Export usage stats as a dictionary (size independent of run length)."""
+        with self._lock:
+            history = list(self.ledger.recent)
+            return {
+                "total_input": self.total_input,
+                "total_output": self.total_output,
+                "total_combined": self.total_combined,
+                "call_count": self.call_count,
+                "usage_ratio": round(self.usage_ratio(), 4),
+                "max_tokens": self.max_tokens,
+                "warning_threshold": self.warning_threshold,
+                "compact_threshold": self.compact_threshold,
+                "history": history,
+                "history_dropped": self.call_count - len(history),
+                **self.ledger.to_dict(),
+            }
 
     def status_message(self) -> str:
         """Generate a human-readable status message."""
@@ -122,18 +177,180 @@ class TokenUsage:
         )
 
 
+class CallCancelled(Exception):
+    """A CLI call was abandoned because another racer already won.
+
+    ``output`` is the (stdout, stderr) of a child that was killed after it
+    started; it is None when the call was stopped before launching one.
+    """
+
+    def __init__(self, label: str = "", output: tuple[str, str] | None = None):
+        super().__init__(label)
+        self.output = output
+
+
+def backend_name(cmd: list[str]) -> str:
+    """Backend id of a command: claude/codex/gemini, else the executable name."""
+    backend = detect_cli_type(cmd)
+    if backend == "unknown":
+        return Path(cmd[0]).name if cmd else ""
+    return backend
+
+
+@dataclass
+class CallRuntime:
+    """Run-scoped services consulted by run_external around every CLI call."""
+    job_id: str = ""
+    broker: "BrokerClient | None" = None
+    # Distributed mode: turns for these roles go to the shared queue.
+    queue: "TurnQueue | None" = None
+    dispatch_roles: tuple = ()
+    dispatch_grace_sec: float = 300.0
+    poll_sec: float = 0.5
+    resources: "ResourcePolicy | None" = None
+    breakers: "BreakerBoard | None" = None
+    # Set by a kill request on the control socket; cancels every CLI call in flight.
+    killed: threading.Event = field(default_factory=threading.Event)
+    control: "ControlServer | None" = None
+    estimator: "TokenEstimator | None" = None
+    # Run known CLIs in their JSON output mode (``structured_output.enabled``).
+    structured_output: bool = False
+    budget: "TokenBudget | None" = None
+    summarizer: "ConversationSummarizer | None" = None
+    token_service: "TokenService | None" = None
+    pacer: "QuotaPacer | None" = None
+    credentials: "CredentialPool | None" = None
+    prompt_cache: PromptCache | None = None
+    # Fair-share lane when there is no broker to hold it ("interactive" / "batch").
+    priority: str = "interactive"
+
+    def call_slot(self, label: str, cancel: threading.Event | None = None):
+        """Context manager holding a fair-share slot (no-op without a broker); ``cancel`` ends the wait."""
+        if self.broker is None:
+            return contextlib.nullcontext(False)
+        return self.broker.slot(label, cancel)
+
+    def structured(self, cmd_tmpl: list[str]) -> tuple[list[str], "CliAdapter | None"]:
+        """The template switched to its CLI's JSON output mode, with the adapter that parses it."""
+        if not self.structured_output:
+            return cmd_tmpl, None
+        adapter = adapter_for(cmd_tmpl)
+        if adapter is None:
+            return cmd_tmpl, None
+        structured = adapter.structured(cmd_tmpl)
+        return structured, adapter if structured is not cmd_tmpl else None
+
+    def lane(self) -> str:
+        return self.broker.lane if self.broker is not None else self.priority
+
+    def token_state(self) -> str:
+        """"ok" / "warning" / "compact": the run's token pressure, free to read."""
+        return self.token_service.state if self.token_service is not None else "ok"
+
+    def count_tokens(self, text: str, backend: str = "", with_overhead: bool = False) -> int:
+        """Token estimate, calibrated for ``backend`` when the run has an estimator."""
+        if self.estimator is None:
+            return estimate_tokens(text)
+        return self.estimator.count(text, backend, with_overhead)
+
+    def dispatches(self, role: str) -> bool:
+        return self.queue is not None and role in self.dispatch_roles
+
+    def limits_for(self, role: str) -> "RoleLimits | None":
+        if self.resources is None:
+            return None
+        return self.resources.for_role(role)
+
+    def backend_chain(self, role: str, cmd_tmpl: list[str]) -> list[tuple[str, list[str]]]:
+        """Backends to try for a call, the role's own command first."""
+        if self.breakers is None:
+            return [("", cmd_tmpl)]
+        return self.breakers.candidates(role, backend_name(cmd_tmpl), cmd_tmpl)
+
+    def breaker_for(self, backend: str) -> "CircuitBreaker | None":
+        if self.breakers is None:
+            return None
+        return self.breakers.breaker(backend)
+
+
+def dispatch_turn(
+    runtime: CallRuntime,
+    role: str,
+    cmd_tmpl: list[str],
+    prompt: str,
+    label: str,
+    timeout_sec: int | None,
+    extra_vars: dict,
+    cancel: threading.Event | None = None,
+    env: dict | None = None,
+) -> dict:
+    """Submit one CLI turn to the shared queue and block until a worker answers."""
+    turn_id = runtime.queue.submit(
+        role,
+        {
+            "job": runtime.job_id,
+            "label": label,
+            "cmd": list(cmd_tmpl),
+            "prompt": prompt,
+            "timeout_sec": timeout_sec,
+            "extra_vars": extra_vars,
+            **({"env": env} if env else {}),
+        },
+    )
+    wait_sec = None if timeout_sec is None else timeout_sec + runtime.dispatch_grace_sec
+    if cancel is None:
+        result = runtime.queue.wait_result(turn_id, wait_sec, runtime.poll_sec)
+    else:
+        deadline = None if wait_sec is None else time.monotonic() + wait_sec
+        result = None
+        while result is None and not cancel.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            result = runtime.queue.wait_result(turn_id, 1.0, runtime.poll_sec)
+        if result is None and cancel.is_set():
+            runtime.queue.cancel(turn_id)
+            raise CallCancelled(label)
+    if result is None:
+        runtime.queue.cancel(turn_id)
+        raise subprocess.TimeoutExpired(cmd_tmpl, wait_sec or 0)
+    runtime.queue.discard(turn_id)
+    if result.get("timed_out"):
+        raise subprocess.TimeoutExpired(result.get("cmd") or cmd_tmpl, timeout_sec or 0)
+    return result
+
+
+def runtime_queue_from_config(config: dict, runtime: CallRuntime, verbose: bool) -> None:
+    """Attach the distributed turn queue to ``runtime`` when enabled in config."""
+    dist_cfg = config.get("distributed") or {}
+    if not dist_cfg.get("enabled"):
+        return
+    queue_url = str(dist_cfg.get("queue") or "").strip()
+    if not queue_url:
+        print("[Distributed] 警告: distributed.queue が未設定のためローカル実行します。", file=sys.stderr)
+        return
+    runtime.queue = open_queue(queue_url)
+    runtime.dispatch_roles = tuple(dist_cfg.get("roles") or ("performer", "concertmaster"))
+    runtime.dispatch_grace_sec = float(dist_cfg.get("dispatch_grace_sec", 300))
+    runtime.poll_sec = float(dist_cfg.get("poll_sec", 0.5))
+    if verbose:
+        print(
+            f"[Distributed] {', '.join(runtime.dispatch_roles)} をキュー {queue_url} へディスパッチします。",
+            file=sys.stderr,
+        )
+
+
+# Uncalibrated, but shares the single-pass counter and fragment cache.
+_DEFAULT_ESTIMATOR = TokenEstimator()
+
+
 def estimate_tokens(text: str) -> int:
     """Estimate token count from text (rough approximation)."""
-    # Rough estimate: ~4 chars per token for English, ~1.5 for Japanese
     if not text:
         return 0
-    # Count Japanese characters
-    jp_chars = len(re.findall(r'[\u3040-\u309f\u30a0-\u30ff\u4e00-\u9fff]', text))
-    other_chars = len(text) - jp_chars
-    return int(jp_chars / 1.5 + other_chars / 4)
+    return _DEFAULT_ESTIMATOR.count(text)
 
 
-def parse_token_usage(output: str) -> tuple[int, int]:
+def parse_token_usage(output: str, estimate: Callable[[str], int] = estimate_tokens) -> tuple[int, int]:
     """
     Parse token usage from CLI output.
     Returns (input_tokens, output_tokens) or estimates if not found.
@@ -152,7 +369,7 @@ def parse_token_usage(output: str) -> tuple[int, int]:
         return (max(tokens), 0)
 
     # Fallback: estimate from output length
-    return (0, estimate_tokens(output))
+    return (0, estimate(output))
 
 
 def parse_usage_from_json_lines(output: str) -> tuple[int, int]:
@@ -352,92 +569,36 @@ def ensure_run_dir(base: Path, forced: Path | None = None) -> Path:
 
 
 def extract_json(text: str) -> dict:
-    # Try to strip code fences if present.
-    fenced = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", text, re.S)
-    if fenced:
-        return json.loads(fenced.group(1))
-    # Fallback: grab the first {...} block.
-    raw = re.search(r"\{.*\}", text, re.S)
-    if not raw:
+    data = structured_extract.extract(text, json_only=True)
+    if data is None:
         raise ValueError("JSONが見つかりませんでした。")
-    return json.loads(raw.group(0))
-
-
-def ensure_yaml_available() -> None:
-    if yaml is None:
-        raise RuntimeError("PyYAMLが必要です。'pip install pyyaml' を実行してください。")
+    return data
 
 
-def extract_yaml(text: str) -> dict:
+def extract_yaml(text: str, schema: structured_extract.Schema = structured_extract.ANY) -> dict:
+    """The first YAML/JSON document in ``text`` that passes ``schema`` (see structured_extract)."""
     ensure_yaml_available()
-    fenced = re.search(r"```(?:yaml|yml)?\s*(.*?)\s*```", text, re.S)
-    if fenced:
-        data = yaml.safe_load(fenced.group(1))
-        if isinstance(data, dict):
-            return data
-    raw = text.strip()
-    data = yaml.safe_load(raw)
-    if not isinstance(data, dict):
-        raise ValueError("YAMLが辞書形式ではありません。")
+    data = structured_extract.extract(text, schema)
+    if data is None:
+        raise ValueError(f"YAMLが見つかりませんでした（{schema.name}）。")
     return data
 
 
 def read_yaml(path: Path) -> dict:
     ensure_yaml_available()
-    if not path.exists():
-        return {}
-    try:
-        data = yaml.safe_load(path.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
-    return data if isinstance(data, dict) else {}
+    return artifact_codec.load(path)
 
 
 def write_yaml(path: Path, data: dict) -> None:
     ensure_yaml_available()
-    path.parent.mkdir(parents=True, exist_ok=True)
-    tmp = path.with_suffix(path.suffix + ".tmp")
-    tmp.write_text(
-        yaml.safe_dump(data, allow_unicode=True, sort_keys=False),
-        encoding="utf-8",
-    )
-    tmp.replace(path)
-
-
-class WatchHandle:
-    def __init__(self, path: Path):
-        self.path = path
-        self.event = threading.Event()
-        self.observer = None
-        if Observer is None or FileSystemEventHandler is None:
-            return
-
-        class Handler(FileSystemEventHandler):
-            def on_modified(inner_self, event):
-                if Path(event.src_path).resolve() == self.path.resolve():
-                    self.event.set()
+    artifact_codec.dump(path, data, "yaml")
 
-            def on_created(inner_self, event):
-                if Path(event.src_path).resolve() == self.path.resolve():
-                    self.event.set()
 
-        self._handler = Handler()
-        self.observer = Observer()
-        self.observer.schedule(self._handler, str(self.path.parent), recursive=False)
-        self.observer.start()
-
-    def wait(self, timeout: float = 2.0) -> None:
-        if self.observer is None:
-            time.sleep(timeout)
-            return
-        self.event.wait(timeout)
-        self.event.clear()
-
-    def stop(self) -> None:
-        if self.observer is None:
-            return
-        self.observer.stop()
-        self.observer.join()
+def write_artifact(run_dir: Path, stem: str, data: dict, fmt: str = "yaml") -> Path:
+    """Machine-only artifact in the configured format (``artifacts.machine_format``)."""
+    path = artifact_codec.artifact_path(run_dir, stem, fmt)
+    artifact_codec.dump(path, data, fmt)
+    return path
 
 
 def command_uses(cmd_tmpl: list[str], placeholder: str) -> bool:
@@ -450,6 +611,9 @@ def write_status(run_dir: Path, status: dict) -> None:
     (run_dir / "status.json").write_text(
         json.dumps(status, ensure_ascii=False, indent=2), encoding="utf-8"
     )
+    control = ControlServer.for_run(run_dir)
+    if control is not None:
+        control.publish("status", status)
 
 
 def split_task_lines(task: str) -> list[str]:
@@ -761,6 +925,125 @@ def apply_permission_flags(cmd: list[str], permissions: dict, cli_type: str | No
     return result
 
 
+def render_command(cmd_tmpl: list[str], prompt: str, prompt_path: Path, extra_vars: dict) -> tuple[list[str], str | None]:
+    """Fill placeholders; the prompt goes to stdin unless the template takes it."""
+    uses_prompt = command_uses(cmd_tmpl, "prompt")
+    uses_prompt_file = command_uses(cmd_tmpl, "prompt_file")
+    fmt_vars = {
+        "prompt": prompt,
+        "prompt_file": str(prompt_path),
+        **extra_vars,
+    }
+    cmd = [part.format(**fmt_vars) for part in cmd_tmpl]
+    stdin_text = None if (uses_prompt or uses_prompt_file) else prompt
+    return cmd, stdin_text
+
+
+def run_cancellable(
+    cmd: list[str],
+    stdin_text: str | None,
+    timeout_sec: int | None,
+    preexec_fn,
+    cancel: threading.Event,
+    label: str,
+    env: dict | None = None,
+    on_start: Callable[[int], None] | None = None,
+) -> subprocess.CompletedProcess:
+    """subprocess.run that also kills the child's process group once ``cancel`` is set.
+
+    ``on_start`` gets the child's pid as soon as it is running (cgroup attach).
+    """
+    if cancel.is_set():
+        raise CallCancelled(label)
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if stdin_text is not None else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        env={**os.environ, **(env or {})},
+        preexec_fn=preexec_fn,
+        start_new_session=True,
+    )
+    if on_start is not None:
+        on_start(proc.pid)
+    deadline = None if timeout_sec is None else time.monotonic() + timeout_sec
+    pending_input = stdin_text
+    while True:
+        try:
+            stdout, stderr = proc.communicate(pending_input, timeout=0.2)
+            return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+        except subprocess.TimeoutExpired:
+            pending_input = None  # already handed to communicate()
+        expired = deadline is not None and time.monotonic() >= deadline
+        if not expired and not cancel.is_set():
+            continue
+        with contextlib.suppress(OSError):
+            if hasattr(os, "killpg"):
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        stdout, stderr = proc.communicate()
+        if expired:
+            raise subprocess.TimeoutExpired(cmd, timeout_sec, output=stdout, stderr=stderr)
+        raise CallCancelled(label, (stdout or "", stderr or ""))
+
+
+def invoke_backend(
+    runtime: CallRuntime,
+    role: str,
+    cmd_tmpl: list[str],
+    cmd: list[str],
+    stdin_text: str | None,
+    prompt: str,
+    label: str,
+    timeout_sec: int | None,
+    extra_vars: dict,
+    cancel: threading.Event | None = None,
+    env: dict | None = None,
+) -> tuple[str, str, int, dict | None]:
+    """Run one CLI call locally or on a worker. Returns (stdout, stderr, returncode, limits).
+
+    ``env`` holds overrides on top of this process's environment.
+    """
+    if runtime.dispatches(role):
+        remote = dispatch_turn(runtime, role, cmd_tmpl, prompt, label, timeout_sec, extra_vars, cancel, env)
+        return remote.get("stdout") or "", remote.get("stderr") or "", remote.get("returncode", 1), remote.get("limits")
+    role_limits = runtime.limits_for(role)
+    # A cancel while queued for the slot leaves it ungranted; run_cancellable then raises.
+    with runtime.call_slot(label, cancel):
+        proc = run_cancellable(
+            role_limits.wrap_command(cmd) if role_limits else cmd,
+            stdin_text,
+            timeout_sec,
+            role_limits.preexec() if role_limits else None,
+            cancel if cancel is not None else threading.Event(),
+            label,
+            env,
+            on_start=role_limits.attach if role_limits else None,
+        )
+    return proc.stdout or "", proc.stderr or "", proc.returncode, role_limits.describe() if role_limits else None
+
+
+def measure_usage(runtime: CallRuntime, prompt: str, stdout: str, structured, backend: str) -> tuple[int, int, bool]:
+    """(input, output, exact) tokens of one call whose answer text is ``stdout``.
+
+    Exact when the CLI reports usage (which also calibrates the estimator),
+    otherwise a per-backend calibrated estimate.
+    """
+    if structured is not None and structured.has_usage:
+        exact_input, exact_output = structured.input_tokens, structured.output_tokens
+    else:
+        exact_input, exact_output = parse_usage_from_json_lines(stdout)
+    if exact_input or exact_output:
+        if runtime.estimator is not None and exact_input:
+            runtime.estimator.observe(backend, prompt, exact_input, with_overhead=True)
+        return exact_input, exact_output, True
+    input_tokens = runtime.count_tokens(prompt, backend, with_overhead=True)
+    parsed_input, output_tokens = parse_token_usage(stdout, lambda text: runtime.count_tokens(text, backend))
+    return parsed_input or input_tokens, output_tokens, False
+
+
 def run_external(
     cmd_tmpl: list[str],
     prompt: str,
@@ -770,8 +1053,29 @@ def run_external(
     dry_run: bool,
     extra_vars: dict | None = None,
     token_tracker: TokenUsage | None = None,
+    runtime: CallRuntime | None = None,
+    role: str = "",
+    cancel: threading.Event | None = None,
+    exchange: str = "",
+    env: dict | None = None,
 ) -> dict:
     extra_vars = extra_vars or {}
+    runtime = runtime or CallRuntime()
+    if cancel is None:
+        cancel = runtime.killed
+    # Admission control: reserve the estimated tokens before the call starts,
+    # shrinking the prompt or moving to a cheaper backend when it would not fit.
+    admission = None
+    if runtime.budget is not None and cmd_tmpl and not dry_run:
+        admission = runtime.budget.admit(
+            role,
+            exchange,
+            prompt,
+            cmd_tmpl,
+            backend_name(cmd_tmpl),
+            lambda text, name: runtime.count_tokens(text, name, with_overhead=True),
+        )
+        prompt, cmd_tmpl = admission.prompt, admission.cmd_tmpl
     prompt_path = run_dir / f"{label}_prompt.txt"
     prompt_path.write_text(prompt, encoding="utf-8")
 
@@ -791,15 +1095,7 @@ def run_external(
             "tokens_output": 0,
         }
 
-    uses_prompt = command_uses(cmd_tmpl, "prompt")
-    uses_prompt_file = command_uses(cmd_tmpl, "prompt_file")
-    fmt_vars = {
-        "prompt": prompt,
-        "prompt_file": str(prompt_path),
-        **extra_vars,
-    }
-    cmd = [part.format(**fmt_vars) for part in cmd_tmpl]
-    stdin_text = None if (uses_prompt or uses_prompt_file) else prompt
+    cmd, stdin_text = render_command(cmd_tmpl, prompt, prompt_path, extra_vars)
 
     if dry_run:
         stdout_path.write_text("[dry-run] 実行をスキップしました。", encoding="utf-8")
@@ -814,83 +1110,380 @@ def run_external(
             "tokens_output": 0,
         }
 
-    result = subprocess.run(
-        cmd,
-        input=stdin_text,
-        text=True,
-        capture_output=True,
-        timeout=timeout_sec,
-        env=os.environ.copy(),
-    )
-    stdout_path.write_text(result.stdout or "", encoding="utf-8")
-    stderr_path.write_text(result.stderr or "", encoding="utf-8")
-
-    # Track token usage
-    input_tokens = estimate_tokens(prompt)
-    output_text = result.stdout or ""
-    parsed_input, parsed_output = parse_token_usage(output_text)
-    output_tokens = parsed_output if parsed_output else estimate_tokens(output_text)
-    if parsed_input:
-        input_tokens = parsed_input
+    # Walk the role's fallback chain: backends with an open breaker are skipped
+    # outright, a failing backend hands over to the next one.
+    call_started = time.monotonic()
+    # Usage of a child killed by a cancel: charged instead of released.
+    cancelled_usage: tuple[int, str] | None = None
+    try:
+        outcome = None
+        backend = ""
+        adapter = None
+        attempts: list[dict] = []
+        timeout_exc: subprocess.TimeoutExpired | None = None
+        paced = 0.0
+        credential = ""
+        chain = runtime.backend_chain(role, cmd_tmpl)
+        if runtime.pacer is not None:
+            chain = runtime.pacer.order(chain)
+        for candidate, tmpl in chain:
+            breaker = runtime.breaker_for(candidate)
+            if breaker is not None and not breaker.allow():
+                attempts.append({"backend": candidate, "skipped": "circuit_open"})
+                continue
+            if runtime.pacer is not None:
+                waited = runtime.pacer.acquire(tmpl, runtime.lane(), cancel)
+                if waited is None:
+                    if breaker is not None:
+                        breaker.abandon()
+                    raise CallCancelled(label)
+                paced += waited
+            tmpl, tmpl_adapter = runtime.structured(tmpl)
+            # Cache hint: the stable prefix goes where the CLI caches it.
+            call_prompt = prompt
+            if runtime.prompt_cache is not None:
+                tmpl, call_prompt = runtime.prompt_cache.apply(tmpl, prompt)
+            # Rendered per candidate: the chain may be reordered, so the
+            # previous candidate's argv is never the right one.
+            cmd, stdin_text = render_command(tmpl, call_prompt, prompt_path, extra_vars)
+            # One of the role's credential profiles; a conversation keeps its own.
+            lease = None
+            if runtime.credentials is not None:
+                lease = runtime.credentials.acquire(role, detect_cli_type(tmpl), exchange)
+            call_env = {**(env or {}), **lease.env} if lease is not None else env
+            started = time.monotonic()
+            call_ok, call_detail = None, ""
+            try:
+                outcome = invoke_backend(
+                    runtime, role, tmpl, cmd, stdin_text, call_prompt, label, timeout_sec, extra_vars, cancel, call_env
+                )
+                call_ok, call_detail = outcome[2] == 0, outcome[1]
+            except subprocess.TimeoutExpired as exc:
+                call_ok = False
+                if breaker is not None:
+                    breaker.record(False, time.monotonic() - started)
+                attempts.append({"backend": candidate, "error": "timeout"})
+                timeout_exc = exc
+                continue
+            except CallCancelled as exc:
+                if breaker is not None:
+                    breaker.abandon()
+                if exc.output is not None:
+                    # The child ran (e.g. a race loser): what it used is real spend.
+                    partial = exc.output[0]
+                    parsed = tmpl_adapter.parse(partial) if tmpl_adapter is not None else None
+                    text = parsed.text if parsed is not None and parsed.parsed else partial
+                    spent_backend = candidate or backend_name(tmpl)
+                    cin, cout, cexact = measure_usage(runtime, prompt, text, parsed, spent_backend)
+                    cancelled_usage = (cin + cout, spent_backend)
+                    if token_tracker:
+                        meta = {"tokens_exact": cexact, "backend": spent_backend, "cancelled": True}
+                        meta["latency_sec"] = round(time.monotonic() - call_started, 3)
+                        if role:
+                            meta["role"] = role
+                        if exchange:
+                            meta["exchange"] = exchange
+                        if lease is not None:
+                            meta["credential"] = lease.name
+                        token_tracker.add_usage(cin, cout, label, meta)
+                raise
+            finally:
+                if lease is not None:
+                    runtime.credentials.release(lease, call_ok, call_detail)
+            backend, adapter = candidate, tmpl_adapter
+            credential = lease.name if lease is not None else ""
+            if breaker is not None:
+                breaker.record(outcome[2] == 0, time.monotonic() - started)
+            if outcome[2] == 0:
+                break
+            attempts.append({"backend": candidate, "returncode": outcome[2]})
+        if outcome is None:
+            if timeout_exc is not None:
+                raise timeout_exc
+            skipped = ", ".join(a["backend"] for a in attempts)
+            outcome = ("", f"[fallback] 利用可能なバックエンドがありません（遮断中: {skipped}）", 75, None)
+    except BaseException:
+        if admission is not None:
+            if cancelled_usage is not None:
+                runtime.budget.settle(admission, *cancelled_usage)
+            else:
+                runtime.budget.release(admission)
+        raise
+    stdout, stderr, returncode, limits = outcome
+    # Structured calls: keep the raw JSON, hand the answer text downstream.
+    structured = adapter.parse(stdout) if adapter is not None else None
+    if structured is not None and structured.parsed:
+        (run_dir / f"{label}_stdout.json").write_text(stdout, encoding="utf-8")
+        stdout = structured.text
+    stdout_path.write_text(stdout, encoding="utf-8")
+    stderr_path.write_text(stderr, encoding="utf-8")
+
+    token_backend = backend or backend_name(cmd_tmpl)
+    input_tokens, output_tokens, exact = measure_usage(runtime, prompt, stdout, structured, token_backend)
+    if admission is not None:
+        runtime.budget.settle(admission, input_tokens + output_tokens, token_backend)
 
     if token_tracker:
-        token_tracker.add_usage(input_tokens, output_tokens, label)
+        if structured is not None and structured.has_usage:
+            meta = structured.usage_meta()
+        else:
+            meta = {"tokens_exact": True} if exact else {}
+        meta["backend"] = token_backend
+        meta["returncode"] = returncode
+        meta["latency_sec"] = round(time.monotonic() - call_started, 3)
+        if role:
+            meta["role"] = role
+        if exchange:
+            meta["exchange"] = exchange
+        if limits:
+            meta["limits"] = limits
+        if attempts:
+            meta["fallback"] = attempts
+        if paced:
+            meta["paced_sec"] = round(paced, 1)
+        if credential:
+            meta["credential"] = credential
+        if prefix_id(prompt):
+            meta["prompt_prefix"] = prefix_id(prompt)
+        if admission is not None and admission.describe():
+            meta["budget"] = admission.describe()
+        token_tracker.add_usage(input_tokens, output_tokens, label, meta)
 
     return {
         "cmd": cmd,
-        "stdout": result.stdout or "",
-        "stderr": result.stderr or "",
-        "returncode": result.returncode,
+        "stdout": stdout,
+        "stderr": stderr,
+        "returncode": returncode,
         "used_stdin": stdin_text is not None,
         "tokens_input": input_tokens,
         "tokens_output": output_tokens,
+        "tokens_cache_read": structured.cache_read_tokens if structured is not None else 0,
+        "tokens_exact": exact,
+        "limits": limits,
+        "backend": backend,
+        "attempts": attempts,
+        "credential": credential,
     }
 
 
+def backend_registry(config: dict, section: str) -> dict[str, dict]:
+    """Named backend commands: ``fallback.backends`` overlaid with ``<section>.backends``."""
+    registry = dict((config.get("fallback") or {}).get("backends") or {})
+    registry.update((config.get(section) or {}).get("backends") or {})
+    return registry
+
+
+def race_entrants(config: dict, role: str, permissions: dict) -> list[tuple[str, list[str]]]:
+    """Extra backends racing the role's own command, from ``race.roles.<role>``."""
+    race_cfg = config.get("race") or {}
+    if not race_cfg.get("enabled"):
+        return []
+    registry = backend_registry(config, "race")
+    entrants = []
+    for entry in (race_cfg.get("roles") or {}).get(role) or []:
+        if isinstance(entry, dict):
+            name = str(entry.get("backend") or "")
+            cmd = entry.get("cmd") or (registry.get(name) or {}).get("cmd")
+        else:
+            name = str(entry)
+            cmd = (registry.get(name) or {}).get("cmd")
+        if name and cmd:
+            entrants.append((name, apply_permission_flags(list(cmd), permissions)))
+    return entrants
+
+
+def score_output_valid(stdout: str) -> bool:
+    """Rewriter/advisor output is usable if it holds a YAML document with a dag or bag list."""
+    data = structured_extract.extract(stdout, structured_extract.SCORE)
+    return data is not None and (isinstance(data.get("dag"), list) or isinstance(data.get("bag"), list))
+
+
+# How quickly a kill or stop reaches calls started with a linked cancel event.
+CANCEL_LINK_POLL_SEC = 0.2
+
+
+@contextlib.contextmanager
+def linked_cancel(*parents: threading.Event | None):
+    """An event that is set as soon as any of ``parents`` is (polled; the watcher ends on exit)."""
+    parents = tuple(p for p in parents if p is not None)
+    child = threading.Event()
+    done = threading.Event()
+
+    def watch() -> None:
+        while not done.is_set():
+            if any(p.is_set() for p in parents):
+                child.set()
+                return
+            done.wait(CANCEL_LINK_POLL_SEC)
+
+    threading.Thread(target=watch, name="cancel-link", daemon=True).start()
+    try:
+        yield child
+    finally:
+        done.set()
+
+
+def race_external(
+    cmd_tmpl: list[str],
+    racers: list[tuple[str, list[str]]],
+    prompt: str,
+    run_dir: Path,
+    label: str,
+    timeout_sec: int | None,
+    dry_run: bool,
+    validate,
+    extra_vars: dict | None = None,
+    token_tracker: TokenUsage | None = None,
+    runtime: CallRuntime | None = None,
+    role: str = "",
+    exchange: str = "",
+    cancel: threading.Event | None = None,
+) -> dict:
+    """Send the same prompt to the role's command and every racer at once.
+
+    The first output accepted by ``validate`` wins and the other calls are
+    killed; what a killed entrant had used is still recorded (``cancelled``
+    in the ledger) and charged to the budget. Without racers (or in
+    dry-run) this is a plain run_external.
+    A kill (``runtime.killed``) or the caller's ``cancel`` stops every
+    entrant and raises CallCancelled.
+    """
+    runtime = runtime or CallRuntime()
+    if not racers or dry_run:
+        with linked_cancel(runtime.killed, cancel) if cancel is not None else contextlib.nullcontext(None) as call_cancel:
+            return run_external(
+                cmd_tmpl, prompt, run_dir, label, timeout_sec, dry_run,
+                extra_vars=extra_vars, token_tracker=token_tracker, runtime=runtime, role=role, exchange=exchange,
+                cancel=call_cancel,
+            )
+    entrants = [(backend_name(cmd_tmpl), cmd_tmpl)]
+    entrants += [(name, cmd) for name, cmd in racers if name not in {e[0] for e in entrants}]
+    started = time.monotonic()
+    record: dict = {"timestamp": dt.datetime.now().isoformat(), "run": run_dir.name, "role": role, "label": label, "entrants": []}
+    winner: tuple[str, dict] | None = None
+    fallback: tuple[str, dict] | None = None
+    with linked_cancel(runtime.killed, cancel) as race_cancel, concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(entrants), thread_name_prefix=f"race-{label}"
+    ) as pool:
+        futures = {
+            pool.submit(
+                run_external, cmd, prompt, run_dir, f"{label}_{name}", timeout_sec, False,
+                extra_vars=extra_vars, token_tracker=token_tracker, runtime=runtime, role=role, cancel=race_cancel,
+                exchange=exchange,
+            ): name
+            for name, cmd in entrants
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            entry = {"backend": name, "elapsed_sec": round(time.monotonic() - started, 2)}
+            try:
+                result = future.result()
+            except CallCancelled:
+                entry["status"] = "cancelled"
+            except subprocess.TimeoutExpired:
+                entry["status"] = "timeout"
+            except Exception as exc:
+                entry["status"] = f"error: {exc}"
+            else:
+                if winner is None and result["returncode"] == 0 and validate(result["stdout"]):
+                    entry["status"] = "won"
+                    winner = (name, result)
+                    race_cancel.set()
+                else:
+                    entry["status"] = "late" if winner is not None else "invalid"
+                    if fallback is None:
+                        fallback = (name, result)
+            record["entrants"].append(entry)
+
+    aborted = winner is None and any(e is not None and e.is_set() for e in (runtime.killed, cancel))
+    chosen = winner or fallback
+    record["winner"] = winner[0] if winner else None
+    with contextlib.suppress(OSError):
+        with (run_dir.parent / "race_history.jsonl").open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if aborted:
+        raise CallCancelled(label)
+    if chosen is None:
+        result = {
+            "cmd": [],
+            "stdout": "",
+            "stderr": "[race] 全ての候補が失敗しました。",
+            "returncode": 1,
+            "used_stdin": False,
+            "tokens_input": 0,
+            "tokens_output": 0,
+        }
+    else:
+        result = dict(chosen[1])
+    # Keep the usual <label>_* artifacts pointing at the chosen output.
+    (run_dir / f"{label}_prompt.txt").write_text(prompt, encoding="utf-8")
+    (run_dir / f"{label}_stdout.txt").write_text(result["stdout"], encoding="utf-8")
+    (run_dir / f"{label}_stderr.txt").write_text(result["stderr"], encoding="utf-8")
+    result["race"] = record
+    return result
+
+
 def rewriter_prompt(task: str, instruments: list[str]) -> str:
     """Rewriter prompt (Japanese) - relies on CLAUDE.md for full instructions."""
     inst_list = ", ".join(instruments)
     return f"タスク: {task}\n楽器: {inst_list}"
 
 
+CONCERTMASTER_RULES = (
+    "YOU ARE THE CONCERTMASTER. OUTPUT ONLY YAML. DO NOT DO ANY WORK.\n"
+    "DO NOT read files. DO NOT execute commands. DO NOT generate code.\n"
+    "The PERFORMER will do all the actual work.\n\n"
+    "First turn: give the performer its first, brief instruction.\n"
+    "Later turns: review the performer's output and decide: done, reply, or needs_user_confirm.\n"
+    "If you choose needs_user_confirm, you MUST include a concise 'question' field describing what needs confirmation.\n\n"
+    "YAML format (choose one):\n"
+    "For reply:   action: reply / reply: \"instruction\" / reason: \"why\"\n"
+    "For done:    action: done / reason: \"why complete\"\n"
+    "For confirm: action: needs_user_confirm / question: \"what to confirm\" / reason: \"why\"\n\n"
+    "IMPORTANT: If using needs_user_confirm, 'question' field is REQUIRED and must summarize what needs user decision."
+)
+
+
+def score_context(refined_task: str, global_notes: str = "") -> str:
+    """The run-wide part of a prompt: identical for every performer and turn."""
+    return f"Task: {refined_task}\nNotes: {global_notes}" if global_notes else f"Task: {refined_task}"
+
+
 def concertmaster_initial_prompt(refined_task: str, global_notes: str, performer: dict) -> str:
-    """Initial prompt (English) - relies on AGENT.md for schema."""
-    return (
-        "YOU ARE THE CONCERTMASTER. OUTPUT ONLY YAML. DO NOT DO ANY WORK.\n"
-        "Your ONLY job is to give the first instruction to the performer.\n"
-        "DO NOT read files. DO NOT execute commands. DO NOT generate code.\n"
-        "The PERFORMER will do all the actual work.\n\n"
-        f"Task: {refined_task}\n"
-        f"Notes: {global_notes}\n"
-        f"Performer: {performer.get('name','')} - {performer.get('task','')}\n\n"
-        "Now output ONLY this YAML format:\n"
-        "action: reply\n"
-        "reply: \"Your brief instruction to performer\"\n"
-        "reason: \"Why\""
+    """Initial prompt (English) - relies on AGENT.md for schema.
+
+    Shares its prefix (rules, task, notes) with every concertmaster turn of
+    the run, see prompt_layout.
+    """
+    return layered(
+        [CONCERTMASTER_RULES, score_context(refined_task, global_notes)],
+        [
+            f"Performer: {performer.get('name','')} - {performer.get('task','')}",
+            "This is the first turn. Now output ONLY this YAML format:\n"
+            "action: reply\n"
+            "reply: \"Your brief instruction to performer\"\n"
+            "reason: \"Why\"",
+        ],
     )
 
 
-def concertmaster_review_prompt(refined_task: str, global_notes: str, performer: dict, output: str) -> str:
+def concertmaster_review_prompt(refined_task: str, global_notes: str, performer: dict, output: str, context: str = "") -> str:
     """Review prompt (English) - relies on AGENT.md for schema.
     Include a clear question when action is needs_user_confirm.
+    ``context`` is the conversation summary and recent turns, if any.
     """
     # Truncate long output to save tokens
     max_output_len = 2000
     if len(output) > max_output_len:
         output = output[:max_output_len] + "\n...(truncated)"
-    return (
-        "YOU ARE THE CONCERTMASTER. OUTPUT ONLY YAML. DO NOT DO ANY WORK.\n"
-        "Review the performer's output and decide: done, reply, or needs_user_confirm.\n"
-        "If you choose needs_user_confirm, you MUST include a concise 'question' field describing what needs confirmation.\n"
-        "DO NOT read files. DO NOT execute commands. DO NOT generate code.\n\n"
-        f"Task: {refined_task}\n"
-        f"Performer: {performer.get('name','')}\n"
-        f"Output:\n{output}\n\n"
-        "YAML format (choose one):\n"
-        "For reply:   action: reply / reply: \"instruction\" / reason: \"why\"\n"
-        "For done:    action: done / reason: \"why complete\"\n"
-        "For confirm: action: needs_user_confirm / question: \"what to confirm\" / reason: \"why\"\n\n"
-        "IMPORTANT: If using needs_user_confirm, 'question' field is REQUIRED and must summarize what needs user decision."
+    return layered(
+        [CONCERTMASTER_RULES, score_context(refined_task, global_notes)],
+        [
+            f"Performer: {performer.get('name','')} - {performer.get('task','')}",
+            context,
+            f"Output:\n{output}",
+            "Review this output. Output ONLY YAML (done, reply, or needs_user_confirm).",
+        ],
     )
 
 
@@ -928,28 +1521,36 @@ def advisor_prompt(score_yaml: str) -> str:
     )
 
 
+REVIEWER_RULES = (
+    "You are reviewing SSH commands of a performer, in two phases:\n"
+    "- BEFORE execution, check for: destructive operations, path safety, command syntax, scope.\n"
+    "- AFTER execution, check for: task completion, errors, output quality, unexpected results.\n\n"
+    "Output ONLY YAML with verdict (approved/revise), reason, feedback."
+)
+
+
 def reviewer_pre_prompt(refined_task: str, performer: dict, instruction: str) -> str:
     """Build prompt for Codex reviewer to review commands BEFORE execution."""
-    return (
-        "You are reviewing SSH commands BEFORE execution.\n"
-        "Check for: destructive operations, path safety, command syntax, scope.\n\n"
-        f"Task: {refined_task}\n"
-        f"Performer: {performer.get('name', '')} — {performer.get('task', '')}\n\n"
-        f"Commands to review:\n{instruction}\n\n"
-        "Output ONLY YAML with verdict (approved/revise), reason, feedback."
+    return layered(
+        [REVIEWER_RULES, score_context(refined_task)],
+        [
+            f"Performer: {performer.get('name', '')} — {performer.get('task', '')}",
+            "Phase: BEFORE execution.",
+            f"Commands to review:\n{instruction}",
+        ],
     )
 
 
 def reviewer_post_prompt(refined_task: str, performer: dict, instruction: str, output: str) -> str:
     """Build prompt for Codex reviewer to review results AFTER execution."""
-    return (
-        "You are reviewing SSH execution results AFTER execution.\n"
-        "Check for: task completion, errors, output quality, unexpected results.\n\n"
-        f"Task: {refined_task}\n"
-        f"Performer: {performer.get('name', '')} — {performer.get('task', '')}\n\n"
-        f"Instruction given:\n{instruction}\n\n"
-        f"Execution output:\n{output}\n\n"
-        "Output ONLY YAML with verdict (approved/revise), reason, feedback."
+    return layered(
+        [REVIEWER_RULES, score_context(refined_task)],
+        [
+            f"Performer: {performer.get('name', '')} — {performer.get('task', '')}",
+            "Phase: AFTER execution.",
+            f"Instruction given:\n{instruction}",
+            f"Execution output:\n{output}",
+        ],
     )
 
 
@@ -959,7 +1560,7 @@ def parse_reviewer_output(text: str) -> dict:
     Defaults to 'revise' on parse failure (safe side).
     """
     try:
-        data = extract_yaml(text)
+        data = extract_yaml(text, structured_extract.REVIEW)
         verdict = (data.get("verdict") or "").strip().lower()
         if verdict not in ("approved", "revise"):
             verdict = "revise"
@@ -984,13 +1585,16 @@ def run_advisor(
     verbose: bool,
     dry_run: bool,
     token_tracker: TokenUsage | None = None,
+    runtime: CallRuntime | None = None,
+    racers: list[tuple[str, list[str]]] | None = None,
+    artifact_format: str = "yaml",
 ) -> dict:
     """Run Codex advisor to review the score. Returns (possibly modified) score.
 
     On any failure, returns the original score unchanged.
     """
     ensure_yaml_available()
-    score_yaml_str = yaml.safe_dump(score, allow_unicode=True, sort_keys=False)
+    score_yaml_str = yaml_dump(score)
 
     advisor_cmd = list(advisor_cfg.get("cmd", []))
     if not advisor_cmd:
@@ -1001,14 +1605,18 @@ def run_advisor(
     advisor_cmd = apply_permission_flags(advisor_cmd, permissions)
 
     try:
-        result = run_external(
+        result = race_external(
             advisor_cmd,
+            racers or [],
             advisor_prompt(score_yaml_str),
             run_dir,
             "advisor",
             advisor_cfg.get("timeout_sec", 300),
             dry_run,
+            score_output_valid,
             token_tracker=token_tracker,
+            runtime=runtime,
+            role="advisor",
         )
     except Exception as exc:
         if verbose:
@@ -1027,7 +1635,7 @@ def run_advisor(
         return score
 
     try:
-        advised_score = extract_yaml(stdout)
+        advised_score = extract_yaml(stdout, structured_extract.SCORE)
     except Exception as exc:
         if verbose:
             print(f"[Advisor] YAML解析エラー: {exc}", file=sys.stderr)
@@ -1040,7 +1648,7 @@ def run_advisor(
         return score
 
     # Save advisor output
-    write_yaml(run_dir / "score_advised.yaml", advised_score)
+    write_artifact(run_dir, "score_advised", advised_score, artifact_format)
 
     if verbose:
         approved = advised_score.get("advisor_approved", "N/A")
@@ -1079,8 +1687,7 @@ def init_exchange(path: Path, performer: dict) -> dict:
         "pending": {},
         "updated_at": dt.datetime.now().isoformat(),
     }
-    write_yaml(path, data)
-    return data
+    return SharedExchange.create(path, data)
 
 
 def append_exchange_message(data: dict, role: str, content: str, msg_type: str = "message") -> dict:
@@ -1106,8 +1713,12 @@ def get_last_message(data: dict, role: str) -> str | None:
     return None
 
 
-def build_performer_prompt(data: dict, performer: dict) -> str:
-    """Build performer prompt with conversation context."""
+def build_performer_prompt(data: dict, performer: dict, summarizer: "ConversationSummarizer | None" = None) -> str:
+    """Build performer prompt with conversation context.
+
+    With a summarizer the context is the cached summary plus the recent
+    turns instead of only the previous output.
+    """
     history = data.get("history") or []
     task = performer.get("task", "")
 
@@ -1126,32 +1737,61 @@ def build_performer_prompt(data: dict, performer: dict) -> str:
     if not last_instruction:
         return task
 
-    parts = [f"Task: {task}"]
-    if last_output:
+    parts = []
+    if summarizer is not None:
+        skip = 1 if history and history[-1].get("role") == "concertmaster" else 0
+        parts.append(summarizer.render(data, skip_last=skip))
+    elif last_output:
         parts.append(f"Your previous output:\n{last_output}")
     parts.append(f"New instruction: {last_instruction}")
 
-    return "\n\n".join(parts)
+    # The task is the same on every turn of this performer.
+    return layered([f"Task: {task}"], parts)
+
+
+# Safety net only: hand-offs between roles wake waiters immediately.
+HANDOFF_WAIT_SEC = 30.0
+USER_REPLY_POLL_SEC = 1.5
+# Exchange statuses after which no worker of the exchange acts any more.
+TERMINAL_EXCHANGE_STATUSES = ("done", "error", "budget_exhausted")
 
 
 def read_exchange(path: Path) -> dict:
-    data = read_yaml(path)
-    if not data:
-        return {}
-    return data
+    """Current exchange state from the in-process store (no disk parse)."""
+    return SharedExchange.open(path).read()
 
 
 def update_exchange(path: Path, lock: threading.Lock, update_fn) -> dict:
+    """Apply ``update_fn`` to the exchange unless it has already ended.
+
+    A worker returning from a call after its exchange was ended (e.g. marked
+    ``error`` by the supervisor) must not overwrite the terminal status.
+    """
+
+    def guarded(d: dict) -> dict:
+        if d.get("status") in TERMINAL_EXCHANGE_STATUSES:
+            return d
+        return update_fn(d)
+
     with lock:
-        data = read_exchange(path)
-        data = update_fn(data)
-        write_yaml(path, data)
-        return data
+        data = SharedExchange.open(path).update(guarded)
+    control = ControlServer.for_run(path.parent.parent)
+    if control is not None:
+        control.publish(
+            "exchange",
+            {
+                "id": path.name[: -len(".jsonl")].replace("exchange_", ""),
+                "status": data.get("status"),
+                "turn": data.get("turn"),
+                "updated_at": data.get("updated_at"),
+            },
+        )
+    return data
 
 
 def parse_action_output(text: str) -> dict:
     try:
-        return extract_yaml(text)
+        return extract_yaml(text, structured_extract.ACTION)
     except Exception:
         return {"action": "reply", "reply": text.strip(), "reason": "YAML解析に失敗したため全文を返却"}
 
@@ -1258,6 +1898,65 @@ def build_reply_from_pending(pending: dict) -> str:
     return "ユーザー回答: NG。修正案を提示してください。"
 
 
+def summarize_exchange(
+    exchange_path: Path,
+    lock: threading.Lock,
+    data: dict,
+    runtime: CallRuntime,
+    run_dir: Path,
+    label_prefix: str,
+    dry_run: bool,
+    token_tracker: TokenUsage | None = None,
+) -> dict:
+    """Fold aged turns into the exchange's cached summary when due; returns the current state."""
+    summarizer = runtime.summarizer
+    due = summarizer.pending(data)
+    if due is None:
+        return data
+    messages, covered = due
+    previous = (data.get("summary") or {}).get("text") or ""
+    text = ""
+    if summarizer.cmd and not dry_run:
+        try:
+            result = run_external(
+                summarizer.cmd,
+                summarizer.prompt(previous, messages),
+                run_dir,
+                f"{label_prefix}_summary_{covered}",
+                summarizer.timeout_sec,
+                dry_run,
+                token_tracker=token_tracker,
+                runtime=runtime,
+                role="summarizer",
+                exchange=exchange_path.stem,
+            )
+            if result["returncode"] == 0:
+                text = result["stdout"].strip()
+        except (BudgetExhausted, subprocess.TimeoutExpired):
+            pass
+    if not text:
+        text = summarizer.extractive(previous, messages)
+    record = summarizer.record(text, covered)
+
+    def apply(d: dict) -> dict:
+        if int((d.get("summary") or {}).get("covered") or 0) < covered:
+            d["summary"] = record
+        return d
+
+    return update_exchange(exchange_path, lock, apply)
+
+
+def end_exchange_over_budget(exchange_path: Path, lock: threading.Lock, exc: BudgetExhausted) -> None:
+    """Close an exchange whose next call does not fit its token budget."""
+    def apply(d: dict) -> dict:
+        append_exchange_message(d, "system", str(exc), "system")
+        d["status"] = "budget_exhausted"
+        d["pending"] = {}
+        return d
+
+    update_exchange(exchange_path, lock, apply)
+
+
 def concertmaster_worker(
     exchange_path: Path,
     performer: dict,
@@ -1275,51 +1974,61 @@ def concertmaster_worker(
     token_tracker: TokenUsage | None = None,
     ssh_reviewer_active: bool = False,
     ssh_reviewer_pre_enabled: bool = False,
+    runtime: CallRuntime | None = None,
 ) -> None:
-    watcher = WatchHandle(exchange_path)
-    turn = 0
-    try:
-        while not stop_event.is_set():
-            data = read_exchange(exchange_path)
-            status = data.get("status")
-            if status in ("done", "error"):
-                break
+    shared = SharedExchange.open(exchange_path)
+    # Resume from persisted state when the supervisor restarts this worker.
+    turn = int(read_exchange(exchange_path).get("turn") or 0)
+    while not stop_event.is_set():
+        version, data = shared.read_with_version()
+        status = data.get("status")
+        if status in TERMINAL_EXCHANGE_STATUSES:
+            break
 
-            if status == "waiting_for_user":
-                pending = data.get("pending") or {}
-                if pending.get("user_reply") or pending.get("user_choice") or pending.get("user_approved"):
-                    reply = build_reply_from_pending(pending)
+        if status == "waiting_for_user":
+            pending = data.get("pending") or {}
+            if pending.get("user_reply") or pending.get("user_choice") or pending.get("user_approved"):
+                reply = build_reply_from_pending(pending)
 
-                    def apply_user(d: dict) -> dict:
-                        append_exchange_message(d, "concertmaster", reply, "prompt")
-                        d["status"] = "waiting_for_performer"
-                        d["pending"] = {}
-                        d["turn"] = d.get("turn", 0) + 1
-                        return d
+                def apply_user(d: dict) -> dict:
+                    append_exchange_message(d, "concertmaster", reply, "prompt")
+                    d["status"] = "waiting_for_performer"
+                    d["pending"] = {}
+                    d["turn"] = d.get("turn", 0) + 1
+                    return d
 
-                    update_exchange(exchange_path, lock, apply_user)
-                else:
-                    watcher.wait(1.5)
-                continue
+                update_exchange(exchange_path, lock, apply_user)
+            else:
+                # The reply comes from the web server process: without the
+                # shared file watcher, fall back to re-reading periodically.
+                shared.wait(version, HANDOFF_WAIT_SEC if wakes_on_external_writes() else USER_REPLY_POLL_SEC)
+            continue
 
-            if status != "waiting_for_concertmaster":
-                watcher.wait(1.5)
-                continue
+        if status != "waiting_for_concertmaster":
+            shared.wait(version, HANDOFF_WAIT_SEC)
+            continue
 
-            if turn >= max_turns:
-                def force_done(d: dict) -> dict:
-                    d["status"] = "done"
-                    return d
+        if turn >= max_turns:
+            def force_done(d: dict) -> dict:
+                d["status"] = "done"
+                return d
 
-                update_exchange(exchange_path, lock, force_done)
-                break
+            update_exchange(exchange_path, lock, force_done)
+            break
 
-            performer_output = get_last_message(data, "performer")
-            if performer_output:
-                prompt = concertmaster_review_prompt(refined_task, global_notes, performer, performer_output)
-            else:
-                prompt = concertmaster_initial_prompt(refined_task, global_notes, performer)
+        performer_output = get_last_message(data, "performer")
+        if performer_output:
+            context = ""
+            if runtime is not None and runtime.summarizer is not None:
+                data = summarize_exchange(exchange_path, lock, data, runtime, run_dir, label_prefix, dry_run, token_tracker)
+                history = data.get("history") or []
+                skip = 1 if history and history[-1].get("role") == "performer" else 0
+                context = runtime.summarizer.render(data, skip_last=skip)
+            prompt = concertmaster_review_prompt(refined_task, global_notes, performer, performer_output, context)
+        else:
+            prompt = concertmaster_initial_prompt(refined_task, global_notes, performer)
 
+        try:
             result = run_external(
                 concertmaster_cmd,
                 prompt,
@@ -1329,62 +2038,66 @@ def concertmaster_worker(
                 dry_run,
                 extra_vars={"instrument": performer.get("name", "")},
                 token_tracker=token_tracker,
+                runtime=runtime,
+                role="concertmaster",
+                exchange=exchange_path.stem,
             )
-            output = result["stdout"].strip()
-            action_data = parse_action_output(output)
-            action = (action_data.get("action") or "reply").strip()
-            reply = (action_data.get("reply") or "").strip()
-
-            if action == "done":
-                def apply_done(d: dict) -> dict:
-                    append_exchange_message(d, "concertmaster", action_data.get("reason", ""), "review")
-                    d["status"] = "done"
-                    d["pending"] = {}
-                    return d
+        except BudgetExhausted as exc:
+            end_exchange_over_budget(exchange_path, lock, exc)
+            break
+        output = result["stdout"].strip()
+        action_data = parse_action_output(output)
+        action = (action_data.get("action") or "reply").strip()
+        reply = (action_data.get("reply") or "").strip()
+
+        if action == "done":
+            def apply_done(d: dict) -> dict:
+                append_exchange_message(d, "concertmaster", action_data.get("reason", ""), "review")
+                d["status"] = "done"
+                d["pending"] = {}
+                return d
 
-                update_exchange(exchange_path, lock, apply_done)
-                break
-            if action == "needs_user_confirm":
-                confirm = normalize_confirm_payload(action_data)
-
-                def apply_user_wait(d: dict) -> dict:
-                    append_exchange_message(d, "concertmaster", action_data.get("reason", ""), "review")
-                    d["status"] = "waiting_for_user"
-                    d["pending"] = {
-                        "type": confirm["type"],
-                        "question": confirm["question"],
-                        "reason": confirm.get("reason", ""),
-                        "options": confirm["options"],
-                        "ok_reply": confirm["ok_reply"],
-                        "ng_reply": confirm["ng_reply"],
-                        "choice_reply_template": confirm["choice_reply_template"],
-                        "user_reply": "",
-                        "user_choice": "",
-                        "user_approved": False,
-                    }
-                    return d
+            update_exchange(exchange_path, lock, apply_done)
+            break
+        if action == "needs_user_confirm":
+            confirm = normalize_confirm_payload(action_data)
+
+            def apply_user_wait(d: dict) -> dict:
+                append_exchange_message(d, "concertmaster", action_data.get("reason", ""), "review")
+                d["status"] = "waiting_for_user"
+                d["pending"] = {
+                    "type": confirm["type"],
+                    "question": confirm["question"],
+                    "reason": confirm.get("reason", ""),
+                    "options": confirm["options"],
+                    "ok_reply": confirm["ok_reply"],
+                    "ng_reply": confirm["ng_reply"],
+                    "choice_reply_template": confirm["choice_reply_template"],
+                    "user_reply": "",
+                    "user_choice": "",
+                    "user_approved": False,
+                }
+                return d
 
-                update_exchange(exchange_path, lock, apply_user_wait)
-                continue
+            update_exchange(exchange_path, lock, apply_user_wait)
+            continue
 
-            if not reply:
-                reply = "続けてください。"
+        if not reply:
+            reply = "続けてください。"
 
-            next_status = "waiting_for_performer"
-            if ssh_reviewer_active and ssh_reviewer_pre_enabled:
-                next_status = "waiting_for_pre_review"
+        next_status = "waiting_for_performer"
+        if ssh_reviewer_active and ssh_reviewer_pre_enabled:
+            next_status = "waiting_for_pre_review"
 
-            def apply_reply(d: dict, _next=next_status) -> dict:
-                append_exchange_message(d, "concertmaster", reply, "prompt")
-                d["status"] = _next
-                d["pending"] = {}
-                d["turn"] = d.get("turn", 0) + 1
-                return d
+        def apply_reply(d: dict, _next=next_status) -> dict:
+            append_exchange_message(d, "concertmaster", reply, "prompt")
+            d["status"] = _next
+            d["pending"] = {}
+            d["turn"] = d.get("turn", 0) + 1
+            return d
 
-            update_exchange(exchange_path, lock, apply_reply)
-            turn += 1
-    finally:
-        watcher.stop()
+        update_exchange(exchange_path, lock, apply_reply)
+        turn += 1
 
 
 def performer_worker(
@@ -1401,45 +2114,60 @@ def performer_worker(
     token_tracker: TokenUsage | None = None,
     ssh_reviewer_active: bool = False,
     ssh_reviewer_post_enabled: bool = False,
+    runtime: CallRuntime | None = None,
+    racers: list[tuple[str, list[str]]] | None = None,
 ) -> None:
-    watcher = WatchHandle(exchange_path)
-    turn = 0
-    try:
-        while not stop_event.is_set():
-            data = read_exchange(exchange_path)
-            status = data.get("status")
-            if status in ("done", "error"):
-                break
-            if status != "waiting_for_performer":
-                watcher.wait(1.5)
-                continue
+    shared = SharedExchange.open(exchange_path)
+    # Only single-turn performers race: a multi-turn conversation must stay on one backend.
+    racers = racers if max_turns <= 1 else None
+    # Resume from persisted state when the supervisor restarts this worker.
+    turn = count_role(read_exchange(exchange_path), "performer")
+    while not stop_event.is_set():
+        version, data = shared.read_with_version()
+        status = data.get("status")
+        if status in TERMINAL_EXCHANGE_STATUSES:
+            break
+        if status != "waiting_for_performer":
+            shared.wait(version, HANDOFF_WAIT_SEC)
+            continue
 
-            prompt = build_performer_prompt(data, performer)
-            result = run_external(
+        summarizer = runtime.summarizer if runtime is not None else None
+        if summarizer is not None:
+            data = summarize_exchange(exchange_path, lock, data, runtime, run_dir, label_prefix, dry_run, token_tracker)
+        prompt = build_performer_prompt(data, performer, summarizer)
+        try:
+            result = race_external(
                 performer_cmd,
+                racers or [],
                 prompt,
                 run_dir,
                 f"{label_prefix}_{turn}",
                 timeout_sec,
                 dry_run,
+                lambda out: bool(out.strip()),
                 extra_vars={"instrument": performer.get("name", "")},
                 token_tracker=token_tracker,
+                runtime=runtime,
+                role="performer",
+                exchange=exchange_path.stem,
+                cancel=stop_event,
             )
-            output = result["stdout"].strip()
-            turn += 1
+        except BudgetExhausted as exc:
+            end_exchange_over_budget(exchange_path, lock, exc)
+            break
+        output = result["stdout"].strip()
+        turn += 1
 
-            next_status = "waiting_for_concertmaster"
-            if ssh_reviewer_active and ssh_reviewer_post_enabled:
-                next_status = "waiting_for_post_review"
+        next_status = "waiting_for_concertmaster"
+        if ssh_reviewer_active and ssh_reviewer_post_enabled:
+            next_status = "waiting_for_post_review"
 
-            def apply_output(d: dict, _next=next_status) -> dict:
-                append_exchange_message(d, "performer", output, "response")
-                d["status"] = _next
-                return d
+        def apply_output(d: dict, _next=next_status) -> dict:
+            append_exchange_message(d, "performer", output, "response")
+            d["status"] = _next
+            return d
 
-            update_exchange(exchange_path, lock, apply_output)
-    finally:
-        watcher.stop()
+        update_exchange(exchange_path, lock, apply_output)
 
 
 def reviewer_worker(
@@ -1457,108 +2185,191 @@ def reviewer_worker(
     post_enabled: bool,
     dry_run: bool,
     token_tracker: TokenUsage | None = None,
+    runtime: CallRuntime | None = None,
 ) -> None:
-    """Reviewer worker that watches for pre/post review states."""
-    watcher = WatchHandle(exchange_path)
+    """Reviewer worker that waits for pre/post review states."""
+    shared = SharedExchange.open(exchange_path)
     review_rounds: dict[int, int] = {}  # turn -> rounds used
-    try:
-        while not stop_event.is_set():
-            data = read_exchange(exchange_path)
-            status = data.get("status")
-            if status in ("done", "error"):
-                break
+    while not stop_event.is_set():
+        version, data = shared.read_with_version()
+        status = data.get("status")
+        if status in TERMINAL_EXCHANGE_STATUSES:
+            break
 
-            if status not in ("waiting_for_pre_review", "waiting_for_post_review"):
-                watcher.wait(1.5)
-                continue
+        if status not in ("waiting_for_pre_review", "waiting_for_post_review"):
+            shared.wait(version, HANDOFF_WAIT_SEC)
+            continue
 
-            current_turn = data.get("turn", 0)
-            rounds_used = review_rounds.get(current_turn, 0)
+        current_turn = data.get("turn", 0)
+        rounds_used = review_rounds.get(current_turn, 0)
 
-            if rounds_used >= max_review_rounds:
-                # Max rounds exceeded — fall through
-                if status == "waiting_for_pre_review":
-                    fallthrough_status = "waiting_for_performer"
-                else:
-                    fallthrough_status = "waiting_for_concertmaster"
+        if rounds_used >= max_review_rounds:
+            # Max rounds exceeded — fall through
+            if status == "waiting_for_pre_review":
+                fallthrough_status = "waiting_for_performer"
+            else:
+                fallthrough_status = "waiting_for_concertmaster"
 
-                def apply_fallthrough(d: dict, _st=fallthrough_status) -> dict:
-                    append_exchange_message(
-                        d, "system",
-                        f"Reviewer max rounds ({max_review_rounds}) exceeded, proceeding.",
-                        "system",
-                    )
-                    d["status"] = _st
-                    return d
+            def apply_fallthrough(d: dict, _st=fallthrough_status) -> dict:
+                append_exchange_message(
+                    d, "system",
+                    f"Reviewer max rounds ({max_review_rounds}) exceeded, proceeding.",
+                    "system",
+                )
+                d["status"] = _st
+                return d
 
-                update_exchange(exchange_path, lock, apply_fallthrough)
-                continue
+            update_exchange(exchange_path, lock, apply_fallthrough)
+            continue
 
-            # Build reviewer prompt
-            is_pre = status == "waiting_for_pre_review"
-            last_instruction = get_last_message(data, "concertmaster") or ""
+        # Build reviewer prompt
+        is_pre = status == "waiting_for_pre_review"
+        last_instruction = get_last_message(data, "concertmaster") or ""
 
-            if is_pre:
-                prompt = reviewer_pre_prompt(refined_task, performer, last_instruction)
-                review_label = f"{label_prefix}_pre_{current_turn}_{rounds_used}"
-            else:
-                last_output = get_last_message(data, "performer") or ""
-                prompt = reviewer_post_prompt(refined_task, performer, last_instruction, last_output)
-                review_label = f"{label_prefix}_post_{current_turn}_{rounds_used}"
+        if is_pre:
+            prompt = reviewer_pre_prompt(refined_task, performer, last_instruction)
+            review_label = f"{label_prefix}_pre_{current_turn}_{rounds_used}"
+        else:
+            last_output = get_last_message(data, "performer") or ""
+            prompt = reviewer_post_prompt(refined_task, performer, last_instruction, last_output)
+            review_label = f"{label_prefix}_post_{current_turn}_{rounds_used}"
 
-            try:
-                result = run_external(
-                    reviewer_cmd,
-                    prompt,
-                    run_dir,
-                    review_label,
-                    timeout_sec,
-                    dry_run,
-                    token_tracker=token_tracker,
-                )
-                if result["returncode"] != 0:
-                    review_result = {
-                        "verdict": "revise",
-                        "feedback": f"Reviewer exited with code {result['returncode']}: {result['stderr'][:500]}",
-                        "reason": "Non-zero exit code from reviewer",
-                    }
-                else:
-                    review_result = parse_reviewer_output(result["stdout"])
-            except Exception as exc:
+        try:
+            result = run_external(
+                reviewer_cmd,
+                prompt,
+                run_dir,
+                review_label,
+                timeout_sec,
+                dry_run,
+                token_tracker=token_tracker,
+                runtime=runtime,
+                role="reviewer",
+                exchange=exchange_path.stem,
+            )
+            if result["returncode"] != 0:
                 review_result = {
                     "verdict": "revise",
-                    "feedback": f"Reviewer error: {exc}",
-                    "reason": "Reviewer execution failed",
+                    "feedback": f"Reviewer exited with code {result['returncode']}: {result['stderr'][:500]}",
+                    "reason": "Non-zero exit code from reviewer",
                 }
+            else:
+                review_result = parse_reviewer_output(result["stdout"])
+        except BudgetExhausted as exc:
+            end_exchange_over_budget(exchange_path, lock, exc)
+            break
+        except Exception as exc:
+            review_result = {
+                "verdict": "revise",
+                "feedback": f"Reviewer error: {exc}",
+                "reason": "Reviewer execution failed",
+            }
 
-            review_rounds[current_turn] = rounds_used + 1
-            verdict = review_result["verdict"]
-            feedback = review_result.get("feedback", "")
-            reason = review_result.get("reason", "")
-            review_msg = f"[Reviewer {('pre' if is_pre else 'post')}-review] verdict={verdict}\nreason: {reason}\nfeedback: {feedback}"
-
-            if is_pre:
-                if verdict == "approved":
-                    def apply_pre_approved(d: dict) -> dict:
-                        append_exchange_message(d, "reviewer", review_msg, "review")
-                        d["status"] = "waiting_for_performer"
-                        return d
-                    update_exchange(exchange_path, lock, apply_pre_approved)
-                else:
-                    def apply_pre_revise(d: dict) -> dict:
-                        append_exchange_message(d, "reviewer", review_msg, "review")
-                        d["status"] = "waiting_for_concertmaster"
-                        return d
-                    update_exchange(exchange_path, lock, apply_pre_revise)
+        review_rounds[current_turn] = rounds_used + 1
+        verdict = review_result["verdict"]
+        feedback = review_result.get("feedback", "")
+        reason = review_result.get("reason", "")
+        review_msg = f"[Reviewer {('pre' if is_pre else 'post')}-review] verdict={verdict}\nreason: {reason}\nfeedback: {feedback}"
+
+        if is_pre:
+            if verdict == "approved":
+                def apply_pre_approved(d: dict) -> dict:
+                    append_exchange_message(d, "reviewer", review_msg, "review")
+                    d["status"] = "waiting_for_performer"
+                    return d
+                update_exchange(exchange_path, lock, apply_pre_approved)
             else:
-                # Post-review: both verdicts go back to concertmaster
-                def apply_post(d: dict) -> dict:
+                def apply_pre_revise(d: dict) -> dict:
                     append_exchange_message(d, "reviewer", review_msg, "review")
                     d["status"] = "waiting_for_concertmaster"
                     return d
-                update_exchange(exchange_path, lock, apply_post)
-    finally:
-        watcher.stop()
+                update_exchange(exchange_path, lock, apply_pre_revise)
+        else:
+            # Post-review: both verdicts go back to concertmaster
+            def apply_post(d: dict) -> dict:
+                append_exchange_message(d, "reviewer", review_msg, "review")
+                d["status"] = "waiting_for_concertmaster"
+                return d
+            update_exchange(exchange_path, lock, apply_post)
+
+
+def supervise_worker(
+    name: str,
+    target: Callable[..., None],
+    kwargs: dict,
+    exchange_path: Path,
+    lock: threading.Lock,
+    stop_event: threading.Event,
+    run_dir: Path,
+    max_restarts: int,
+    backoff_sec: float,
+    verbose: bool,
+) -> None:
+    """Run a worker, restarting it after a crash and failing the exchange when it keeps crashing.
+
+    Workers keep no state that is not in the exchange file, so a restart
+    simply resumes from whatever was persisted last.  When the restart
+    budget is spent the exchange is marked ``error`` and ``stop_event`` is
+    set so sibling workers exit and run() can fail dependents immediately.
+    """
+    restarts = 0
+    runtime = kwargs.get("runtime")
+    while not stop_event.is_set():
+        try:
+            target(**kwargs)
+            return
+        except CallCancelled:
+            return  # killed or stopped: not a crash
+        except Exception as exc:
+            if stop_event.is_set() or (runtime is not None and runtime.killed.is_set()):
+                return
+            detail = traceback.format_exc()
+            with (run_dir / f"{name}_error.txt").open("a", encoding="utf-8") as f:
+                f.write(f"[{dt.datetime.now().isoformat()}] restart={restarts}\n{detail}\n")
+            if restarts < max_restarts and not stop_event.is_set():
+                restarts += 1
+                print(
+                    f"[Supervisor] {name} が異常終了しました ({exc})。再起動します ({restarts}/{max_restarts})",
+                    file=sys.stderr,
+                )
+                stop_event.wait(backoff_sec * restarts)
+                continue
+
+            message = f"{name} が {restarts + 1} 回異常終了しました: {exc}"
+            print(f"[Supervisor] {message}。タスクをエラーにします。", file=sys.stderr)
+
+            def apply_error(d: dict, _msg=message) -> dict:
+                append_exchange_message(d, "system", _msg, "error")
+                d["status"] = "error"
+                d["error"] = _msg
+                return d
+
+            try:
+                update_exchange(exchange_path, lock, apply_error)
+            except Exception as write_exc:
+                if verbose:
+                    print(f"[Supervisor] エラー状態の書き込みに失敗: {write_exc}", file=sys.stderr)
+            # run() also treats a set stop_event as failure, so this works
+            # even when the exchange file itself cannot be written.
+            stop_event.set()
+            SharedExchange.open(exchange_path).wake()
+            return
+
+
+def dependents_of(failed_id: str, task_states: list[dict]) -> set[str]:
+    """Return ids of all tasks that transitively depend on ``failed_id``."""
+    blocked = {failed_id}
+    changed = True
+    while changed:
+        changed = False
+        for state in task_states:
+            if state["id"] in blocked:
+                continue
+            if any(dep in blocked for dep in state.get("deps") or []):
+                blocked.add(state["id"])
+                changed = True
+    blocked.discard(failed_id)
+    return blocked
 
 
 def fallback_score(task: str, instruments: list[str]) -> dict:
@@ -1577,10 +2388,52 @@ def run(
     verbose: bool,
     run_dir: Path | None,
     expert_review: bool | None = None,
+    priority: str = "auto",
 ) -> int:
     config = load_config(config_path)
     base_dir = config_path.parent
     run_dir = ensure_run_dir(base_dir, run_dir)
+    # Artifacts only the tools read may be JSON; score.yaml stays YAML for people.
+    artifact_format = str((config.get("artifacts") or {}).get("machine_format") or "yaml")
+    if artifact_format not in artifact_codec.FORMATS:
+        artifact_format = "yaml"
+    configure_rollover(config.get("exchanges") or {})
+
+    # Fair-share slots across all orchestrator processes on this host.
+    # "auto" starts interactive and drops to batch once the score is large.
+    fair_share_cfg = config.get("fair_share") or {}
+    runtime = CallRuntime(job_id=run_dir.name, priority="batch" if priority == "batch" else "interactive")
+    runtime.broker = broker_client_from_config(config, run_dir.name, runtime.priority, verbose)
+    runtime_queue_from_config(config, runtime, verbose)
+    runtime.resources = ResourcePolicy.from_config(config, run_dir.name, verbose)
+    runtime.estimator = TokenEstimator.from_config(config, run_dir.parent)
+    runtime.structured_output = bool((config.get("structured_output") or {}).get("enabled"))
+    runtime.control = ControlServer.start(run_dir, verbose)
+
+    def control_kill(msg: dict) -> dict:
+        if verbose:
+            print("[Control] 停止要求を受け付けました。", file=sys.stderr)
+        runtime.killed.set()
+        return {"ok": True}
+
+    def control_priority(msg: dict) -> dict:
+        nonlocal priority
+        # The lane also steers the pacer, so it applies without a broker too.
+        lane = msg.get("lane")
+        if lane in ("interactive", "batch"):
+            runtime.priority = lane
+            priority = lane  # an explicit choice also disables the "auto" switch
+            if runtime.broker is not None:
+                runtime.broker.lane = lane
+        if runtime.broker is not None and msg.get("weight") is not None:
+            runtime.broker.weight = max(0.01, float(msg["weight"]))
+        reply = {"ok": True, "lane": runtime.priority}
+        if runtime.broker is not None:
+            reply["weight"] = runtime.broker.weight
+        return reply
+
+    runtime.control.on("kill", control_kill)
+    runtime.control.on("priority", control_priority)
 
     # Set up SSH remote filesystem if configured
     _ssh_remote_active = False
@@ -1623,8 +2476,16 @@ def run(
             max_tokens=token_config.get("max_tokens", 200000),
             warning_threshold=token_config.get("warning_threshold", 0.75),
             compact_threshold=token_config.get("compact_threshold", 0.85),
+            ledger=TokenLedger(token_config.get("recent_calls", RECENT_CALLS)),
         )
 
+        # Threshold handling runs on a background thread (token_management.background).
+        token_service = TokenService.from_config(token_config, verbose)
+        runtime.token_service = token_service
+        runtime.pacer = QuotaPacer.from_config(config, detect_cli_type, verbose)
+        runtime.credentials = CredentialPool.from_config(config, verbose)
+        runtime.prompt_cache = PromptCache.from_config(config)
+
         # Track compact attempts to avoid infinite loops
         compact_attempts = [0]
         max_compact_attempts = token_config.get("max_compact_attempts", 3)
@@ -1654,6 +2515,16 @@ def run(
                 return
 
             compact_attempts[0] += 1
+            if runtime.summarizer is not None:
+                # Exchanges compact their own context through rolling summaries;
+                # under run-wide pressure, summarize sooner instead of /compact.
+                threshold = runtime.summarizer.tighten()
+                print(
+                    f"[TokenManager] トークン使用量がしきい値を超えました。"
+                    f" 要約のしきい値を {threshold} 文字に下げます (試行 {compact_attempts[0]}/{max_compact_attempts})",
+                    file=sys.stderr,
+                )
+                return
             print(
                 f"[TokenManager] トークン使用量がしきい値を超えました。"
                 f" /compact を実行します... (試行 {compact_attempts[0]}/{max_compact_attempts})",
@@ -1672,17 +2543,28 @@ def run(
             ]
 
             compact_results = {}
+            compacted: dict[str, bool] = {}
             for name, cmd_base in cmd_bases:
                 cli_type = detect_cli_type(cmd_base)
                 if cli_type == "unknown":
                     continue
+                if cli_type in compacted:
+                    # Roles sharing a CLI share its session state: compact it once.
+                    compact_results[name] = {"cli_type": cli_type, "success": compacted[cli_type], "shared": True}
+                    continue
 
                 if verbose:
-                    status_output = call_status_command(cmd_base, verbose=True)
+                    if token_service is not None:
+                        status_output = token_service.probe(
+                            ("status", cli_type), lambda cmd=cmd_base: call_status_command(cmd, verbose=True)
+                        )
+                    else:
+                        status_output = call_status_command(cmd_base, verbose=True)
                     if status_output:
                         print(f"[TokenManager] {name} ({cli_type}) /status 結果:\n{status_output[:500]}", file=sys.stderr)
 
                 success = call_compact_command(cmd_base, run_dir, verbose=verbose)
+                compacted[cli_type] = success
                 compact_results[name] = {"cli_type": cli_type, "success": success}
 
                 if success:
@@ -1694,9 +2576,7 @@ def run(
             any_success = any(r["success"] for r in compact_results.values())
             if any_success:
                 # Reset tracker partially after compaction (estimate 50% reduction)
-                tracker.total_combined = int(tracker.total_combined * 0.5)
-                tracker.total_input = int(tracker.total_input * 0.5)
-                tracker.total_output = int(tracker.total_output * 0.5)
+                tracker.rescale(0.5)
 
             # Save compact event to run directory
             compact_log = run_dir / "compact_events.json"
@@ -1736,6 +2616,10 @@ def run(
 
         token_tracker.on_warning = on_warning_once
         token_tracker.on_compact_needed = on_compact_once
+        if token_service is not None:
+            token_service.on("warning", on_warning_once)
+            token_service.on("compact", on_compact_once)
+            token_tracker.service = token_service
 
         instrument_pool = config.get("instrument_pool") or config.get("instruments") or []
         if not instrument_pool and verbose:
@@ -1763,6 +2647,20 @@ def run(
             performer_cfg = dict(performer_cfg)
             performer_cfg["cmd"] = apply_permission_flags(performer_cfg["cmd"], permissions)
 
+        runtime.breakers = BreakerBoard.from_config(
+            config,
+            prepare=lambda cmd: apply_permission_flags(cmd, permissions),
+            verbose=verbose,
+        )
+        runtime.summarizer = ConversationSummarizer.from_config(
+            config,
+            prepare=lambda cmd: apply_permission_flags(cmd, permissions),
+        )
+        runtime.budget = TokenBudget.from_config(
+            config,
+            prepare=lambda cmd: apply_permission_flags(cmd, permissions),
+        )
+
         # SSH Remote Execution Mode: override performer and concertmaster config
         ssh_exec_cfg = config.get("ssh_remote") or {}
         if ssh_exec_cfg.get("enabled"):
@@ -1824,18 +2722,22 @@ def run(
 
         score = None
         score_source = "fallback"
-        rewriter_result = run_external(
+        rewriter_result = race_external(
             rewriter_cfg.get("cmd", []),
+            race_entrants(config, "rewriter", permissions),
             rewriter_prompt(task, instrument_pool),
             run_dir,
             "rewriter",
             rewriter_cfg.get("timeout_sec"),
             dry_run,
+            score_output_valid,
             token_tracker=token_tracker,
+            runtime=runtime,
+            role="rewriter",
         )
         if rewriter_result["returncode"] == 0 and rewriter_result["stdout"].strip():
             try:
-                score = extract_yaml(rewriter_result["stdout"])
+                score = extract_yaml(rewriter_result["stdout"], structured_extract.SCORE)
                 score_source = "rewriter"
             except Exception as exc:
                 if verbose:
@@ -1864,6 +2766,9 @@ def run(
                 verbose,
                 dry_run,
                 token_tracker=token_tracker,
+                runtime=runtime,
+                racers=race_entrants(config, "advisor", permissions),
+                artifact_format=artifact_format,
             )
             write_status(
                 run_dir,
@@ -1880,12 +2785,35 @@ def run(
         score["instruments"] = assignments
         score["performers"] = assignments
 
+        if priority == "auto":
+            interactive_max = int(fair_share_cfg.get("interactive_max_tasks", 3))
+            if len(assignments) > interactive_max:
+                runtime.priority = "batch"
+                if runtime.broker is not None:
+                    runtime.broker.lane = "batch"
+                if verbose:
+                    print(
+                        f"[Broker] タスク数 {len(assignments)} > {interactive_max} のため batch レーンに切り替えます。",
+                        file=sys.stderr,
+                    )
+
         write_yaml(run_dir / "score.yaml", score)
         (run_dir / "score.json").write_text(
             json.dumps(score, ensure_ascii=False, indent=2), encoding="utf-8"
         )
         if score_source == "rewriter":
-            write_yaml(run_dir / "score_raw.yaml", raw_score)
+            write_artifact(run_dir, "score_raw", raw_score, artifact_format)
+        if not dry_run:
+            try:
+                estimate = estimate_run(run_dir.parent, config, score)
+                (run_dir / "estimate.json").write_text(
+                    json.dumps(estimate, ensure_ascii=False, indent=2), encoding="utf-8"
+                )
+                if verbose:
+                    print(f"[Estimate] {format_estimate(estimate)}", file=sys.stderr)
+            except Exception as exc:
+                if verbose:
+                    print(f"警告: 見積もりに失敗: {exc}", file=sys.stderr)
         mix_with_conductor = bool(config.get("mix_with_conductor"))
         total_steps = max(len(assignments), 1) + 2
         completed_steps = 1
@@ -1905,6 +2833,23 @@ def run(
         exchange_paths: list[Path | None] = [None] * len(assignments)
         exchange_locks: list[threading.Lock | None] = [None] * len(assignments)
         stop_events: list[threading.Event | None] = [None] * len(assignments)
+
+        def control_reply(msg: dict) -> dict:
+            try:
+                idx = int(msg.get("exchange")) - 1
+            except (TypeError, ValueError):
+                return {"ok": False, "error": "invalid exchange"}
+            if not 0 <= idx < len(assignments) or exchange_paths[idx] is None:
+                return {"ok": False, "error": "exchange not found"}
+            data = update_exchange(
+                exchange_paths[idx],
+                exchange_locks[idx],
+                lambda d: apply_user_reply(d, str(msg.get("reply") or ""), bool(msg.get("approved")), msg.get("choice")),
+            )
+            return {"ok": True, "status": data.get("status")}
+
+        if runtime.control is not None:
+            runtime.control.on("reply", control_reply)
         task_states = [
             {
                 "index": idx,
@@ -1915,6 +2860,22 @@ def run(
             for idx, inst in enumerate(assignments)
         ]
         done_ids: set[str] = set()
+        supervision_cfg = config.get("supervision") or {}
+        max_restarts = int(supervision_cfg.get("max_restarts", 2))
+        restart_backoff_sec = float(supervision_cfg.get("restart_backoff_sec", 2.0))
+        # SSH mode replaces the performer command, so there is nothing to race against.
+        performer_racers = [] if ssh_exec_cfg.get("enabled") else race_entrants(config, "performer", permissions)
+        router = None
+        if not ssh_exec_cfg.get("enabled"):
+            router = ModelRouter.from_config(
+                config,
+                backend_registry(config, "routing"),
+                performer_cfg.get("cmd", []),
+                performer_cfg.get("timeout_sec"),
+                backend_name(performer_cfg.get("cmd", [])),
+                run_dir.parent,
+                prepare=lambda cmd: apply_permission_flags(cmd, permissions),
+            )
 
         def deps_done(state: dict) -> bool:
             deps = state.get("deps") or []
@@ -1923,18 +2884,45 @@ def run(
         def start_task(state: dict) -> None:
             idx = state["index"]
             inst = assignments[idx]
-            exchange_path = exchanges_dir / f"exchange_{idx + 1}.yaml"
+            exchange_path = exchanges_dir / f"exchange_{idx + 1}.jsonl"
             init_exchange(exchange_path, inst)
             exchange_paths[idx] = exchange_path
             lock = threading.Lock()
             exchange_locks[idx] = lock
             stop_event = threading.Event()
             stop_events[idx] = stop_event
+            performer_cmd = performer_cfg.get("cmd", [])
+            performer_timeout = performer_cfg.get("timeout_sec")
+            if router is not None:
+                route = router.route(inst)
+                state["route"] = route
+                performer_cmd, performer_timeout = route.cmd, route.timeout_sec
+                if verbose:
+                    print(f"[Router] {state['id']} → {route.backend} ({route.reason}, timeout={route.timeout_sec})", file=sys.stderr)
+            state["started_at"] = time.monotonic()
+
+            def supervised(role_name: str, target: Callable[..., None], worker_kwargs: dict) -> threading.Thread:
+                return threading.Thread(
+                    target=supervise_worker,
+                    name=f"{role_name}-{idx + 1}",
+                    kwargs=dict(
+                        name=f"{role_name}_{idx + 1}",
+                        target=target,
+                        kwargs=worker_kwargs,
+                        exchange_path=exchange_path,
+                        lock=lock,
+                        stop_event=stop_event,
+                        run_dir=run_dir,
+                        max_restarts=max_restarts,
+                        backoff_sec=restart_backoff_sec,
+                        verbose=verbose,
+                    ),
+                )
 
-            cm_thread = threading.Thread(
-                target=concertmaster_worker,
-                name=f"concertmaster-{idx + 1}",
-                kwargs=dict(
+            cm_thread = supervised(
+                "concertmaster",
+                concertmaster_worker,
+                dict(
                     exchange_path=exchange_path,
                     performer=inst,
                     refined_task=score.get("refined_task", task),
@@ -1951,16 +2939,17 @@ def run(
                     token_tracker=token_tracker,
                     ssh_reviewer_active=ssh_reviewer_active,
                     ssh_reviewer_pre_enabled=ssh_reviewer_pre_enabled,
+                    runtime=runtime,
                 ),
             )
-            perf_thread = threading.Thread(
-                target=performer_worker,
-                name=f"performer-{idx + 1}",
-                kwargs=dict(
+            perf_thread = supervised(
+                "performer",
+                performer_worker,
+                dict(
                     exchange_path=exchange_path,
                     performer=inst,
-                    performer_cmd=performer_cfg.get("cmd", []),
-                    timeout_sec=performer_cfg.get("timeout_sec"),
+                    performer_cmd=performer_cmd,
+                    timeout_sec=performer_timeout,
                     run_dir=run_dir,
                     label_prefix=f"performer_{idx + 1}",
                     lock=lock,
@@ -1970,15 +2959,17 @@ def run(
                     token_tracker=token_tracker,
                     ssh_reviewer_active=ssh_reviewer_active,
                     ssh_reviewer_post_enabled=ssh_reviewer_post_enabled,
+                    runtime=runtime,
+                    racers=performer_racers,
                 ),
             )
             task_threads = [cm_thread, perf_thread]
 
             if ssh_reviewer_active:
-                rev_thread = threading.Thread(
-                    target=reviewer_worker,
-                    name=f"reviewer-{idx + 1}",
-                    kwargs=dict(
+                rev_thread = supervised(
+                    "reviewer",
+                    reviewer_worker,
+                    dict(
                         exchange_path=exchange_path,
                         performer=inst,
                         refined_task=score.get("refined_task", task),
@@ -1993,6 +2984,7 @@ def run(
                         post_enabled=ssh_reviewer_post_enabled,
                         dry_run=dry_run,
                         token_tracker=token_tracker,
+                        runtime=runtime,
                     ),
                 )
                 task_threads.append(rev_thread)
@@ -2002,42 +2994,91 @@ def run(
                 t.start()
             state["status"] = "running"
 
+        def fail_dependents(failed: dict) -> None:
+            blocked = dependents_of(failed["id"], task_states)
+            for other in task_states:
+                if other["id"] in blocked and other["status"] == "pending":
+                    other["status"] = "skipped"
+                    if verbose:
+                        print(
+                            f"[Supervisor] {other['id']} をスキップします（依存先 {failed['id']} が失敗）",
+                            file=sys.stderr,
+                        )
+
         # Monitor progress and schedule only ready tasks
         while True:
-            # Start ready tasks
-            for state in task_states:
-                if state["status"] == "pending" and deps_done(state):
-                    start_task(state)
-
-            # Update completion counts
-            done_count = 0
-            running_count = 0
+            if runtime.killed.is_set():
+                for idx, stop_event in enumerate(stop_events):
+                    if stop_event is not None:
+                        stop_event.set()
+                        SharedExchange.open(exchange_paths[idx]).wake()
+                break
+            # Update task states from the exchanges
             for state in task_states:
                 idx = state["index"]
                 path = exchange_paths[idx]
                 if state["status"] == "running" and path is not None:
                     data = read_exchange(path)
-                    if data.get("status") == "done":
+                    if data.get("status") in ("done", "budget_exhausted"):
+                        # Over budget: dependents continue with what was produced.
                         state["status"] = "done"
+                        state["budget_exhausted"] = data.get("status") == "budget_exhausted"
                         done_ids.add(state["id"])
-                    elif data.get("status") == "error":
+                    elif data.get("status") == "error" or stop_events[idx].is_set():
                         state["status"] = "error"
-                if state["status"] == "done":
-                    done_count += 1
-                if state["status"] == "running":
-                    running_count += 1
+                        stop_events[idx].set()
+                        SharedExchange.open(path).wake()
+                        fail_dependents(state)
+                    if state["status"] != "running" and state.get("route") is not None and not dry_run:
+                        router.record(
+                            state["route"],
+                            count_role(data, "performer"),
+                            time.monotonic() - state["started_at"],
+                            state["status"] == "done",
+                        )
+
+            # Start ready tasks (including ones unblocked just now)
+            for state in task_states:
+                if state["status"] == "pending" and deps_done(state):
+                    start_task(state)
+
+            done_count = sum(1 for state in task_states if state["status"] == "done")
+            running_count = sum(1 for state in task_states if state["status"] == "running")
+            failed_ids = [state["id"] for state in task_states if state["status"] == "error"]
+            skipped_ids = [state["id"] for state in task_states if state["status"] == "skipped"]
 
             completed_steps = 1 + done_count
-            write_status(
-                run_dir,
-                {
-                    "stage": "performer",
-                    "progress": min(completed_steps / total_steps, 0.95),
-                    "task": task,
-                    "performer_index": done_count,
-                    "performer_total": len(assignments),
-                },
-            )
+            status_payload = {
+                "stage": "performer",
+                "progress": min(completed_steps / total_steps, 0.95),
+                "task": task,
+                "performer_index": done_count,
+                "performer_total": len(assignments),
+            }
+            if failed_ids:
+                status_payload["failed_tasks"] = failed_ids
+            if skipped_ids:
+                status_payload["skipped_tasks"] = skipped_ids
+            over_budget_ids = [state["id"] for state in task_states if state.get("budget_exhausted")]
+            if over_budget_ids:
+                status_payload["budget_exhausted_tasks"] = over_budget_ids
+            if runtime.budget is not None:
+                status_payload["token_budget"] = runtime.budget.snapshot()
+            if runtime.token_state() != "ok":
+                status_payload["token_state"] = runtime.token_state()
+            if runtime.pacer is not None and runtime.pacer.busy():
+                status_payload["quota"] = runtime.pacer.snapshot()
+            if runtime.credentials is not None:
+                status_payload["credentials"] = runtime.credentials.snapshot()
+            if router is not None:
+                status_payload["routes"] = {
+                    state["id"]: state["route"].backend for state in task_states if state.get("route") is not None
+                }
+            if runtime.breakers is not None:
+                open_backends = runtime.breakers.open_backends()
+                if open_backends:
+                    status_payload["open_backends"] = open_backends
+            write_status(run_dir, status_payload)
 
             if done_count >= len(assignments):
                 break
@@ -2055,12 +3096,19 @@ def run(
 
         for t in threads:
             t.join()
+        if runtime.killed.is_set():
+            raise CallCancelled("ユーザーによって停止されました")
 
         performances: list[dict] = []
         for idx, inst in enumerate(assignments, start=1):
             exchange_path = exchange_paths[idx - 1]
             data = read_exchange(exchange_path) if exchange_path else {}
             output = get_last_message(data, "performer") or ""
+            task_status = task_states[idx - 1]["status"]
+            if task_status == "skipped":
+                output = output or "（スキップ: 依存タスクが失敗しました）"
+            elif task_status == "error":
+                output = output or f"（エラー: {data.get('error') or 'タスクが失敗しました'}）"
             performances.append({"instrument": inst.get("name") or f"Instrument-{idx}", "output": output})
 
         if mix_with_conductor:
@@ -2072,16 +3120,22 @@ def run(
                     "task": task,
                 },
             )
-            mix_result = run_external(
-                rewriter_cfg.get("cmd", []),
-                mix_prompt(score, performances),
-                run_dir,
-                "mix",
-                rewriter_cfg.get("timeout_sec"),
-                dry_run,
-                token_tracker=token_tracker,
-            )
-            final_text = mix_result["stdout"].strip()
+            try:
+                mix_result = run_external(
+                    rewriter_cfg.get("cmd", []),
+                    mix_prompt(score, performances),
+                    run_dir,
+                    "mix",
+                    rewriter_cfg.get("timeout_sec"),
+                    dry_run,
+                    token_tracker=token_tracker,
+                    runtime=runtime,
+                    role="mix",
+                )
+                final_text = mix_result["stdout"].strip()
+            except BudgetExhausted as exc:
+                print(f"[TokenBudget] {exc}。統合はローカルで行います。", file=sys.stderr)
+                final_text = local_mix(score, performances)
             completed_steps += 1
             write_status(
                 run_dir,
@@ -2097,8 +3151,13 @@ def run(
         (run_dir / "final.txt").write_text(final_text, encoding="utf-8")
 
         # Save token usage statistics
+        usage_report = token_tracker.to_dict()
+        if runtime.estimator is not None:
+            usage_report["estimator"] = runtime.estimator.snapshot()
+        if runtime.budget is not None:
+            usage_report["budget"] = runtime.budget.snapshot()
         (run_dir / "token_usage.json").write_text(
-            json.dumps(token_tracker.to_dict(), ensure_ascii=False, indent=2),
+            json.dumps(usage_report, ensure_ascii=False, indent=2),
             encoding="utf-8",
         )
         if verbose:
@@ -2142,7 +3201,7 @@ def run(
         write_status(
             run_dir,
             {
-                "stage": "error",
+                "stage": "killed" if runtime.killed.is_set() else "error",
                 "progress": 1.0,
                 "task": task,
                 "error": str(exc),
@@ -2151,6 +3210,19 @@ def run(
         print(f"エラー: {exc}", file=sys.stderr)
         return 1
     finally:
+        SharedExchange.flush_all()
+        if runtime.resources is not None:
+            runtime.resources.close()
+        if runtime.control is not None:
+            runtime.control.close()
+        if runtime.estimator is not None:
+            runtime.estimator.save()
+        if runtime.token_service is not None:
+            runtime.token_service.close()
+        if runtime.pacer is not None:
+            runtime.pacer.close()
+        if runtime.credentials is not None:
+            runtime.credentials.close()
         # Tear down SSH remote filesystem
         if _ssh_remote_active and teardown_remote is not None:
             try:
@@ -2161,6 +3233,114 @@ def run(
                 print(f"[SSHRemote] teardown error: {td_exc}", file=sys.stderr)
 
 
+def execute_claimed_turn(claimed: dict, scratch_root: Path, runtime: CallRuntime) -> dict:
+    """Run one claimed turn locally and return the result to write back."""
+    payload = claimed.get("payload") or {}
+    label = str(payload.get("label") or "turn")
+    turn_dir = scratch_root / str(claimed["id"])
+    turn_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        result = run_external(
+            list(payload.get("cmd") or []),
+            str(payload.get("prompt") or ""),
+            turn_dir,
+            label,
+            payload.get("timeout_sec"),
+            False,
+            extra_vars=payload.get("extra_vars") or {},
+            runtime=runtime,
+            role=str(claimed.get("role") or ""),
+            env=payload.get("env") or None,
+        )
+    except subprocess.TimeoutExpired as exc:
+        result = {
+            "cmd": exc.cmd if isinstance(exc.cmd, list) else [],
+            "stdout": exc.stdout if isinstance(exc.stdout, str) else "",
+            "stderr": exc.stderr if isinstance(exc.stderr, str) else "",
+            "returncode": 124,
+            "timed_out": True,
+        }
+    except Exception as exc:
+        result = {"cmd": [], "stdout": "", "stderr": f"worker error: {exc}", "returncode": 1}
+    finally:
+        shutil.rmtree(turn_dir, ignore_errors=True)
+    result["worker_host"] = socket.gethostname()
+    return result
+
+
+def run_worker(args: argparse.Namespace) -> int:
+    """Pull performer/concertmaster turns from the shared queue and execute them."""
+    queue = open_queue(args.queue)
+    roles = [r.strip() for r in (args.roles or "").split(",") if r.strip()] or None
+    worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    scratch_root = Path(args.workdir).expanduser() if args.workdir else Path(tempfile.gettempdir()) / f"orchestrator-worker-{worker_id}"
+    scratch_root.mkdir(parents=True, exist_ok=True)
+
+    runtime = CallRuntime(job_id=f"worker:{worker_id}")
+    config_path = Path(args.config).expanduser().resolve() if args.config else None
+    if config_path is not None and config_path.exists():
+        worker_config = load_config(config_path)
+        runtime.broker = broker_client_from_config(worker_config, runtime.job_id, "batch", args.verbose)
+        runtime.resources = ResourcePolicy.from_config(worker_config, f"worker-{worker_id}", args.verbose)
+
+    stop_event = threading.Event()
+
+    def loop(slot: int) -> None:
+        slot_id = f"{worker_id}-{slot}"
+        while not stop_event.is_set():
+            claimed = queue.claim(slot_id, roles, args.lease)
+            if claimed is None:
+                stop_event.wait(args.poll)
+                continue
+            if args.verbose:
+                payload = claimed.get("payload") or {}
+                print(f"[Worker {slot_id}] {payload.get('job')} {payload.get('label')} を実行", file=sys.stderr)
+            done = threading.Event()
+
+            def heartbeat() -> None:
+                while not done.wait(max(args.lease / 3, 1.0)):
+                    queue.renew(claimed["id"], slot_id, args.lease)
+
+            hb = threading.Thread(target=heartbeat, daemon=True)
+            hb.start()
+            try:
+                result = execute_claimed_turn(claimed, scratch_root, runtime)
+            finally:
+                done.set()
+            queue.complete(claimed["id"], slot_id, result)
+
+    threads = [threading.Thread(target=loop, args=(i,), daemon=True) for i in range(max(1, args.concurrency))]
+    for t in threads:
+        t.start()
+    print(f"ワーカー {worker_id} 起動: queue={args.queue} roles={roles or 'all'} concurrency={len(threads)}", file=sys.stderr)
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        if runtime.resources is not None:
+            runtime.resources.close()
+    return 0
+
+
+def parse_worker_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="orchestrator.py worker",
+        description="共有キューから演奏者/コンサートマスターのターンを取り出して実行するワーカー。",
+    )
+    parser.add_argument("--queue", required=True, help="キューのURL（sqlite:///path.db または file:///dir）")
+    parser.add_argument("--roles", default="performer,concertmaster", help="処理するロール（カンマ区切り）")
+    parser.add_argument("--concurrency", type=int, default=2, help="同時に実行するターン数")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SEC, help="リース秒数（期限切れで再キュー）")
+    parser.add_argument("--poll", type=float, default=1.0, help="キューが空のときのポーリング間隔（秒）")
+    parser.add_argument("--worker-id", default="", help="ワーカーID（既定: ホスト名-PID）")
+    parser.add_argument("--workdir", default="", help="プロンプト等の一時ディレクトリ")
+    parser.add_argument("--config", default="", help="フェアシェア/リソース制限の設定を読む config.json（任意）")
+    parser.add_argument("--verbose", action="store_true", help="詳細ログを標準エラーに出力")
+    return parser.parse_args(argv)
+
+
 def parse_args(argv: list[str]) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Claude Codeを指揮者、Codexを演奏者として協調させるCLI。",
@@ -2202,12 +3382,54 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         dest="expert_review",
         help="Codexアドバイザーによるスコアレビューを無効にする",
     )
+    parser.add_argument(
+        "--priority",
+        choices=["auto", "interactive", "batch"],
+        default="auto",
+        help="フェアシェアのレーン（auto: タスク数が少なければ interactive）",
+    )
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="実行せず、過去の実行からトークン数・所要時間・最大同時実行数を見積もる",
+    )
+    parser.add_argument(
+        "--score",
+        help="--estimate で見積もるスコア（score.json / score.yaml。未指定なら過去の実行の中央値）",
+    )
     return parser.parse_args(argv)
 
 
+def run_estimate(config_path: Path, task: str, score_path: str | None) -> int:
+    """Print the estimate as JSON (stdout) and as text (stderr); 3 when over a limit."""
+    config = load_config(config_path)
+    score = None
+    if score_path:
+        instrument_pool = config.get("instrument_pool") or config.get("instruments") or []
+        try:
+            raw = artifact_codec.load(Path(score_path).expanduser())
+        except Exception as exc:
+            print(f"エラー: スコアを読み込めません: {exc}", file=sys.stderr)
+            return 2
+        score = normalize_score(raw, task or raw.get("refined_task") or "", instrument_pool)
+        score["performers"] = normalize_assignments(score.get("instruments", []), False)
+    estimate = estimate_run(config_path.parent / "runs", config, score)
+    print(json.dumps(estimate, ensure_ascii=False, indent=2))
+    print(format_estimate(estimate), file=sys.stderr)
+    return 3 if estimate.get("blocked") else 0
+
+
 def main(argv: list[str]) -> int:
+    if argv and argv[0] == "worker":
+        return run_worker(parse_worker_args(argv[1:]))
     args = parse_args(argv)
     task = args.task
+    if args.estimate:
+        config_path = Path(args.config).expanduser().resolve()
+        if not config_path.exists():
+            print(f"エラー: 設定ファイルが見つかりません: {config_path}", file=sys.stderr)
+            return 2
+        return run_estimate(config_path, task or "", args.score)
     if not task:
         task = sys.stdin.read().strip()
     if not task:
@@ -2218,7 +3440,7 @@ def main(argv: list[str]) -> int:
         print(f"エラー: 設定ファイルが見つかりません: {config_path}", file=sys.stderr)
         return 2
     run_dir = Path(args.run_dir).expanduser().resolve() if args.run_dir else None
-    return run(task, config_path, args.dry_run, args.verbose, run_dir, args.expert_review)
+    return run(task, config_path, args.dry_run, args.verbose, run_dir, args.expert_review, args.priority)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Prompt layout for provider-side prompt caching.
+
+Providers cache the longest prefix a request shares with a recent one
+(Claude at its cache breakpoints, Codex and Gemini implicitly).  The
+concertmaster and reviewer prompts used to put the per-turn content
+(performer, output) between the instructions and the format rules, so two
+calls never shared more than a few lines.
+
+Prompt builders now assemble their blocks with ``layered``: the stable
+blocks first (instructions, output format, refined task, global notes),
+then the per-performer and per-turn ones.  The stable blocks are
+normalized, so the prefix is byte-identical across turns and performers
+of a run.  The result is a ``LayeredPrompt``, a ``str`` that remembers
+where the prefix ends; everything that treats prompts as plain strings
+keeps working, and a rewritten prompt (e.g. shrunk by the budget) simply
+loses the split.
+
+``PromptCache.apply`` adds the hint for CLIs that take one.  ``claude``
+marks its system prompt as a cache breakpoint, so the prefix is moved
+there (appended to ``--system-prompt`` / ``--append-system-prompt`` if the
+template has one, else passed with ``--append-system-prompt``) and only the
+volatile part is sent as the message.  Codex and Gemini have no such flag;
+for them the layout alone does the work.  Templates that read the prompt
+from ``{prompt_file}`` are left alone.
+
+Config (``prompt_cache`` section)::
+
+    "prompt_cache": {"hints": true, "min_prefix_chars": 0}
+
+The measured hit rate (cached / input tokens of calls that report cache
+usage) is in ``token_usage.json``: per role, task, backend and credential,
+and for the whole run under ``prompt_cache``.
+"""
+from __future__ import annotations
+
+import hashlib
+
+from cli_adapters import adapter_for
+
+BLOCK_SEPARATOR = "\n\n"
+SYSTEM_PROMPT_FLAGS = ("--system-prompt", "--append-system-prompt")
+
+
+class LayeredPrompt(str):
+    """A prompt whose first ``prefix_len`` characters are the same for every call of its kind."""
+
+    prefix_len: int
+
+    def __new__(cls, prefix: str, rest: str) -> "LayeredPrompt":
+        joined = f"{prefix}{BLOCK_SEPARATOR}{rest}" if prefix and rest else prefix or rest
+        prompt = super().__new__(cls, joined)
+        prompt.prefix_len = len(prefix)
+        return prompt
+
+    @property
+    def prefix(self) -> str:
+        return self[: self.prefix_len]
+
+    @property
+    def rest(self) -> str:
+        return self[self.prefix_len :].lstrip("\n")
+
+
+def _normalize(block: str) -> str:
+    lines = block.replace("\r\n", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+def layered(stable: list[str], volatile: list[str]) -> LayeredPrompt:
+    """Join prompt blocks: ``stable`` ones (normalized) first, then ``volatile`` ones; empty blocks are dropped."""
+    prefix = BLOCK_SEPARATOR.join(b for b in map(_normalize, stable) if b)
+    rest = BLOCK_SEPARATOR.join(b.strip("\n") for b in volatile if b and b.strip())
+    return LayeredPrompt(prefix, rest)
+
+
+def prefix_of(prompt: str) -> str:
+    return prompt.prefix if isinstance(prompt, LayeredPrompt) else ""
+
+
+def prefix_id(prompt: str) -> str:
+    """Short hash of the prompt's stable prefix ("" without one), for the usage ledger."""
+    prefix = prefix_of(prompt)
+    if not prefix:
+        return ""
+    return hashlib.sha1(prefix.encode("utf-8")).hexdigest()[:12]
+
+
+def _escape(text: str) -> str:
+    # Template parts go through str.format.
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class PromptCache:
+    """Per-CLI cache hints for layered prompts."""
+
+    def __init__(self, hints: bool = True, min_prefix_chars: int = 0):
+        self.hints = hints
+        self.min_prefix_chars = max(0, int(min_prefix_chars))
+
+    @classmethod
+    def from_config(cls, config: dict) -> "PromptCache":
+        cfg = config.get("prompt_cache") or {}
+        return cls(hints=bool(cfg.get("hints", True)), min_prefix_chars=cfg.get("min_prefix_chars", 0))
+
+    def apply(self, cmd_tmpl: list[str], prompt: str) -> tuple[list[str], str]:
+        """(template, message): the prefix moved into the CLI's cached system prompt where it has one."""
+        prefix = prefix_of(prompt)
+        if not self.hints or not prefix or not prompt.rest or len(prefix) < self.min_prefix_chars:
+            return cmd_tmpl, prompt
+        adapter = adapter_for(cmd_tmpl)
+        if adapter is None or adapter.cli != "claude":
+            return cmd_tmpl, prompt
+        if any("{prompt_file}" in part for part in cmd_tmpl):
+            return cmd_tmpl, prompt
+        tmpl = list(cmd_tmpl)
+        for i, part in enumerate(tmpl[:-1]):
+            if part in SYSTEM_PROMPT_FLAGS:
+                tmpl[i + 1] = f"{tmpl[i + 1]}{BLOCK_SEPARATOR}{_escape(prefix)}"
+                break
+        else:
+            tmpl[1:1] = ["--append-system-prompt", _escape(prefix)]
+        return tmpl, prompt.rest
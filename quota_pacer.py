@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Pace CLI calls against the providers' live quota telemetry.
+
+``quota_telemetry`` reports, per provider, how much of the 5-hour and the
+weekly window is used and when each window resets.  Without pacing a run
+starts calls at full speed until the provider refuses them, and then every
+worker fails at once.  The pacer refreshes the telemetry in the background
+(every ``poll_sec``) and, before each call:
+
+- spaces the calls to a provider once it is past ``pace_from_pct`` so that
+  the rest of the quota (up to ``target_pct``) lasts until the window
+  resets.  The quota share of one call is learned from how far the usage
+  moved between two refreshes; until then the spacing ramps up to
+  ``default_interval_sec``;
+- defers calls of batch-lane jobs while a provider is past ``defer_pct``
+  and ahead of schedule (more of the window used than has elapsed);
+  interactive jobs are only spaced;
+- moves such providers to the end of the role's fallback chain, so calls go
+  to another backend first (the chain comes from ``fallback.chains``);
+- holds every call to a provider past ``target_pct`` until the window
+  resets.
+
+No call waits longer than ``max_wait_sec`` in total; after that it runs
+anyway and the circuit breaker deals with the refusal.
+
+Config (``quota_pacing`` section)::
+
+    "quota_pacing": {
+      "enabled": true,
+      "providers": ["claude", "codex"],
+      "poll_sec": 300,
+      "pace_from_pct": 50, "defer_pct": 80, "target_pct": 95,
+      "default_interval_sec": 30,
+      "max_wait_sec": 1800
+    }
+
+Usage moved by other processes is attributed to this run's calls, which
+only makes the spacing more conservative.
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+from quota_telemetry import SHORT_TERM_WINDOW_SEC, WEEKLY_WINDOW_SEC, get_cli_token_status
+
+OK = "ok"
+PACE = "pace"
+DEFER = "defer"
+EXHAUSTED = "exhausted"
+# Chain order: providers close to their limit go last.
+RANK = {OK: 0, PACE: 0, DEFER: 1, EXHAUSTED: 2}
+# A wait is re-checked at least this often (cancellation, fresh telemetry).
+RECHECK_SEC = 5.0
+# Weight of the newest observation in the per-call quota share.
+COST_EMA = 0.3
+
+
+@dataclass
+class Window:
+    name: str
+    used_pct: float
+    resets_at: float | None
+    length_sec: float
+
+
+@dataclass
+class ProviderQuota:
+    windows: list[Window] = field(default_factory=list)
+    # Share of the 5-hour window one call uses, in percent (None until learned).
+    cost_pct: float | None = None
+    calls_since_refresh: int = 0
+    next_slot: float = 0.0
+    deferred_calls: int = 0
+    waited_sec: float = 0.0
+
+
+def windows_from_status(status: dict) -> list[Window]:
+    windows = []
+    for name, pct_key, reset_key, length in (
+        ("5h", "short_term_percentage", "short_term_resets_at", SHORT_TERM_WINDOW_SEC),
+        ("weekly", "weekly_percentage", "weekly_resets_at", WEEKLY_WINDOW_SEC),
+    ):
+        pct = status.get(pct_key)
+        if pct is not None:
+            windows.append(Window(name, float(pct), status.get(reset_key), length))
+    return windows
+
+
+class QuotaPacer:
+    """Decides, per provider, how long the next call has to wait."""
+
+    def __init__(
+        self,
+        providers: tuple[str, ...] = ("claude", "codex"),
+        poll_sec: float = 300.0,
+        pace_from_pct: float = 50.0,
+        defer_pct: float = 80.0,
+        target_pct: float = 95.0,
+        default_interval_sec: float = 30.0,
+        max_wait_sec: float = 1800.0,
+        provider_of: Callable[[list[str]], str] | None = None,
+        fetch: Callable[[tuple[str, ...]], dict] = get_cli_token_status,
+        verbose: bool = False,
+    ):
+        self.providers = tuple(providers)
+        self.poll_sec = max(10.0, float(poll_sec))
+        self.pace_from_pct = float(pace_from_pct)
+        self.defer_pct = float(defer_pct)
+        self.target_pct = float(target_pct)
+        self.default_interval_sec = float(default_interval_sec)
+        self.max_wait_sec = float(max_wait_sec)
+        self.provider_of = provider_of or (lambda cmd: "")
+        self.fetch = fetch
+        self.verbose = verbose
+        self._quotas: dict[str, ProviderQuota] = {name: ProviderQuota() for name in self.providers}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def from_config(
+        cls,
+        config: dict,
+        provider_of: Callable[[list[str]], str] | None = None,
+        verbose: bool = False,
+    ) -> "QuotaPacer | None":
+        cfg = config.get("quota_pacing") or {}
+        if not cfg.get("enabled"):
+            return None
+        return cls(
+            providers=tuple(cfg.get("providers") or ("claude", "codex")),
+            poll_sec=cfg.get("poll_sec", 300),
+            pace_from_pct=cfg.get("pace_from_pct", 50),
+            defer_pct=cfg.get("defer_pct", 80),
+            target_pct=cfg.get("target_pct", 95),
+            default_interval_sec=cfg.get("default_interval_sec", 30),
+            max_wait_sec=cfg.get("max_wait_sec", 1800),
+            provider_of=provider_of,
+            verbose=verbose,
+        ).start()
+
+    # --- telemetry ----------------------------------------------------------
+
+    def start(self) -> "QuotaPacer":
+        self._thread = threading.Thread(target=self._poll, name="quota-pacer", daemon=True)
+        self._thread.start()
+        return self
+
+    def _poll(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as exc:
+                print(f"[QuotaPacer] クォータの取得に失敗: {exc}", file=sys.stderr)
+            self._stop.wait(self.poll_sec)
+
+    def refresh(self) -> None:
+        status = self.fetch(self.providers)
+        with self._lock:
+            for name in self.providers:
+                if name in status:
+                    self._update_locked(name, windows_from_status(status[name]))
+
+    def _update_locked(self, name: str, windows: list[Window]) -> None:
+        quota = self._quotas[name]
+        old = next((w for w in quota.windows if w.name == "5h"), None)
+        new = next((w for w in windows if w.name == "5h"), None)
+        same_window = (
+            old is not None
+            and new is not None
+            and (old.resets_at is None or new.resets_at is None or abs(old.resets_at - new.resets_at) < 60)
+        )
+        if same_window and quota.calls_since_refresh and new.used_pct >= old.used_pct:
+            observed = (new.used_pct - old.used_pct) / quota.calls_since_refresh
+            quota.cost_pct = observed if quota.cost_pct is None else (1 - COST_EMA) * quota.cost_pct + COST_EMA * observed
+        quota.windows = windows
+        quota.calls_since_refresh = 0
+        if self.verbose and windows:
+            used = ", ".join(f"{w.name} {w.used_pct:.0f}%" for w in windows)
+            print(f"[QuotaPacer] {name}: {used}", file=sys.stderr)
+
+    # --- decisions ----------------------------------------------------------
+
+    def _assess_locked(self, name: str, now: float) -> tuple[str, float, float | None]:
+        """(level, spacing between call starts, epoch when an exhausted window resets)."""
+        quota = self._quotas.get(name)
+        if quota is None or not quota.windows:
+            return OK, 0.0, None
+        level, spacing, until = OK, 0.0, None
+        for w in quota.windows:
+            left = w.resets_at - now if w.resets_at is not None else None
+            if left is not None and left <= 0:
+                continue  # reset since the last refresh
+            headroom = self.target_pct - w.used_pct
+            if headroom <= 0:
+                resume = w.resets_at if w.resets_at is not None else now + self.poll_sec
+                until = resume if until is None else max(until, resume)
+                level = EXHAUSTED
+                continue
+            if w.used_pct < self.pace_from_pct:
+                continue
+            if quota.cost_pct and left is not None:
+                # Spread the calls the headroom still allows over the rest of the window.
+                gap = left / max(1.0, headroom / quota.cost_pct)
+            else:
+                ramp = (w.used_pct - self.pace_from_pct) / max(1.0, self.target_pct - self.pace_from_pct)
+                gap = self.default_interval_sec * ramp
+            spacing = max(spacing, gap)
+            elapsed = 1 - left / w.length_sec if left is not None else None
+            ahead = elapsed is None or w.used_pct / self.target_pct > elapsed
+            if w.used_pct >= self.defer_pct and ahead and level != EXHAUSTED:
+                level = DEFER
+            elif level == OK and gap > 0:
+                level = PACE
+        return level, spacing, until
+
+    def level(self, name: str) -> str:
+        with self._lock:
+            return self._assess_locked(name, time.time())[0]
+
+    def order(self, chain: list[tuple[str, list[str]]]) -> list[tuple[str, list[str]]]:
+        """The fallback chain with providers close to their limit moved to the end."""
+        if len(chain) < 2:
+            return chain
+        return sorted(chain, key=lambda entry: RANK[self.level(self.provider_of(entry[1]))])
+
+    def acquire(self, cmd_tmpl: list[str], lane: str, cancel: threading.Event) -> float | None:
+        """Wait until a call may start; seconds waited, or None when cancelled."""
+        name = self.provider_of(cmd_tmpl)
+        if name not in self._quotas:
+            return 0.0
+        started = time.monotonic()
+        deferred = False
+        while True:
+            waited = time.monotonic() - started
+            with self._lock:
+                quota = self._quotas[name]
+                level, spacing, until = self._assess_locked(name, time.time())
+                if level == EXHAUSTED:
+                    wait = until - time.time()
+                elif level == DEFER and lane == "batch":
+                    wait = RECHECK_SEC
+                    if not deferred:
+                        deferred = True
+                        quota.deferred_calls += 1
+                else:
+                    wait = quota.next_slot - time.monotonic()
+                if wait <= 0 or waited >= self.max_wait_sec:
+                    quota.next_slot = max(time.monotonic(), quota.next_slot) + spacing
+                    quota.calls_since_refresh += 1
+                    quota.waited_sec += waited
+                    return waited
+            if cancel.wait(min(wait, RECHECK_SEC, max(0.0, self.max_wait_sec - waited))):
+                return None
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self._lock:
+            result = {}
+            for name, quota in self._quotas.items():
+                level, spacing, until = self._assess_locked(name, now)
+                result[name] = {
+                    "level": level,
+                    "used_pct": {w.name: w.used_pct for w in quota.windows},
+                    "spacing_sec": round(spacing, 1),
+                    "call_cost_pct": round(quota.cost_pct, 3) if quota.cost_pct is not None else None,
+                    "deferred_calls": quota.deferred_calls,
+                    "waited_sec": round(quota.waited_sec, 1),
+                    **({"resumes_at": until} if until is not None else {}),
+                }
+            return result
+
+    def busy(self) -> bool:
+        """Whether any provider is being paced, deferred or held."""
+        return any(info["level"] != OK for info in self.snapshot().values())
+
+    def close(self) -> None:
+        self._stop.set()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""Provider quota telemetry for the Claude, Codex and Gemini CLIs.
+
+- Claude: ``ccusage`` 5-hour blocks (usage relative to the historical max
+  block) and daily totals for the week;
+- Codex: the last ``rate_limits`` event of the most recent session file
+  under ``~/.codex/sessions`` (5-hour and weekly ``used_percent``);
+- Gemini: availability only.
+
+``get_cli_token_status`` is what the web server shows.  Besides the display
+strings, each provider carries numbers for schedulers: the percentages and
+``short_term_resets_at`` / ``weekly_resets_at`` (epoch seconds, None when
+unknown).
+
+The per-provider functions take environment overrides, so the status of
+another account (``CLAUDE_CONFIG_DIR`` / ``CODEX_HOME``) can be read too.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import json
+import os
+import subprocess
+from pathlib import Path
+
+SHORT_TERM_WINDOW_SEC = 5 * 3600
+WEEKLY_WINDOW_SEC = 7 * 24 * 3600
+
+
+def _claude_defaults() -> dict:
+    return {
+        "available": False,
+        "raw_output": "",
+        "error": None,
+        "used_percentage": None,
+        "short_term_percentage": None,
+        "weekly_percentage": None,
+        "rate_limit_5h": None,
+        "weekly_token_limit": None,
+        "daily_tokens": None,
+        "weekly_tokens": None,
+        "total_tokens": None,
+        "short_term_resets_at": None,
+        "weekly_resets_at": None,
+    }
+
+
+def _codex_defaults() -> dict:
+    return {
+        "available": False,
+        "raw_output": "",
+        "error": None,
+        "used_percentage": None,
+        "short_term_percentage": None,
+        "weekly_percentage": None,
+        "rate_limit_5h": None,
+        "weekly_token_limit": None,
+        "short_term_resets_at": None,
+        "weekly_resets_at": None,
+    }
+
+
+def _env(overrides: dict | None) -> dict:
+    env = os.environ.copy()
+    env.update(overrides or {})
+    return env
+
+
+def claude_token_status(env: dict | None = None) -> dict:
+    """Claude Code usage from ccusage.
+
+    The 5-hour block percentage is calculated relative to historical max usage,
+    which provides a practical estimate of how close to the rate limit you are.
+    """
+    status = _claude_defaults()
+    try:
+        # Get all blocks to find historical max and active block
+        proc = subprocess.run(
+            ["npx", "ccusage@latest", "blocks", "--json"],
+            text=True,
+            capture_output=True,
+            timeout=30,
+            env=_env(env),
+        )
+        max_tokens = 0
+        if proc.returncode == 0 and proc.stdout:
+            blocks_data = json.loads(proc.stdout)
+            blocks = blocks_data.get("blocks", [])
+
+            if blocks:
+                status["available"] = True
+
+                # Find active block and historical max
+                active_block = None
+                for block in blocks:
+                    if block.get("isGap"):
+                        continue
+                    total = block.get("totalTokens", 0)
+                    if total > max_tokens:
+                        max_tokens = total
+                    if block.get("isActive"):
+                        active_block = block
+
+                if active_block:
+                    current_tokens = active_block.get("totalTokens", 0)
+                    status["daily_tokens"] = current_tokens
+
+                    # Calculate percentage relative to historical max
+                    if max_tokens > 0:
+                        pct = round((current_tokens / max_tokens) * 100, 1)
+                        status["short_term_percentage"] = pct
+                        status["used_percentage"] = pct
+
+                    # Get block end time for reset info
+                    end_time_str = active_block.get("endTime", "")
+                    reset_info = ""
+                    if end_time_str:
+                        try:
+                            end_time = dt.datetime.fromisoformat(end_time_str.replace("Z", "+00:00"))
+                            status["short_term_resets_at"] = end_time.timestamp()
+                            local_end = end_time.astimezone()
+                            reset_info = f" (リセット: {local_end.strftime('%H:%M')})"
+                        except (ValueError, TypeError):
+                            pass
+
+                    if max_tokens > 0:
+                        pct = round((current_tokens / max_tokens) * 100, 1)
+                        status["rate_limit_5h"] = f"{pct}%{reset_info}"
+
+                    # Build raw output
+                    lines = []
+                    lines.append(f"5時間ブロック: {current_tokens:,} トークン")
+                    if max_tokens > 0:
+                        lines.append(f"過去最大: {max_tokens:,} トークン")
+                    projection = active_block.get("projection", {})
+                    if projection.get("totalTokens"):
+                        lines.append(f"予測: {projection['totalTokens']:,} トークン")
+                    status["raw_output"] = "\n".join(lines)
+
+        # Also get weekly data from ccusage
+        proc_daily = subprocess.run(
+            ["npx", "ccusage@latest", "--json"],
+            text=True,
+            capture_output=True,
+            timeout=30,
+            env=_env(env),
+        )
+        if proc_daily.returncode == 0 and proc_daily.stdout:
+            daily_data = json.loads(proc_daily.stdout)
+            daily_entries = daily_data.get("daily", [])
+
+            # Sum tokens for last 7 days
+            week_ago = (dt.date.today() - dt.timedelta(days=7)).isoformat()
+            weekly_tokens = 0
+            for entry in daily_entries:
+                if entry.get("date", "") >= week_ago:
+                    weekly_tokens += entry.get("totalTokens", 0)
+
+            if weekly_tokens > 0:
+                status["weekly_tokens"] = weekly_tokens
+
+                # Calculate total from all daily entries
+                total_tokens = sum(e.get("totalTokens", 0) for e in daily_entries)
+                status["total_tokens"] = total_tokens
+
+                # For weekly percentage, use a rough estimate
+                # Claude Pro weekly limit is approximately 50-100M tokens based on usage patterns
+                # We'll use the sum of historical max blocks * 7 as a rough weekly limit
+                if max_tokens > 0:
+                    # Estimate: if you could hit max every 5h block, ~33 blocks/week
+                    estimated_weekly_limit = max_tokens * 33
+                    weekly_pct = round((weekly_tokens / estimated_weekly_limit) * 100, 1)
+                    status["weekly_percentage"] = weekly_pct
+                    status["weekly_token_limit"] = f"{weekly_pct}% ({weekly_tokens:,} トークン)"
+
+        if not status["available"]:
+            # Fallback: check if claude command is available
+            proc = subprocess.run(
+                ["claude", "--version"],
+                text=True,
+                capture_output=True,
+                timeout=10,
+                env=_env(env),
+            )
+            if proc.returncode == 0:
+                status["available"] = True
+                status["raw_output"] = "ccusage データなし"
+            else:
+                status["error"] = "claude コマンドが見つかりません"
+    except FileNotFoundError:
+        status["error"] = "ccusage が見つかりません (npx ccusage@latest)"
+    except json.JSONDecodeError:
+        status["error"] = "ccusage の出力を解析できませんでした"
+    except subprocess.TimeoutExpired:
+        status["error"] = "タイムアウト"
+    except Exception as e:
+        status["error"] = str(e)
+    return status
+
+
+def codex_token_status(env: dict | None = None) -> dict:
+    """Codex rate limits from the most recent session file."""
+    status = _codex_defaults()
+    try:
+        codex_home = (env or {}).get("CODEX_HOME") or os.environ.get("CODEX_HOME")
+        codex_sessions_dir = (Path(codex_home).expanduser() if codex_home else Path.home() / ".codex") / "sessions"
+        if codex_sessions_dir.exists():
+            # Find the most recent session file
+            session_files = list(codex_sessions_dir.glob("**/*.jsonl"))
+            if session_files:
+                # Sort by modification time to get the most recent
+                session_files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+                latest_session = session_files[0]
+
+                # Read the session file and find the last rate_limits info
+                rate_limits = None
+                token_usage = None
+                with open(latest_session, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            data = json.loads(line)
+                            if data.get("type") == "event_msg":
+                                payload = data.get("payload", {})
+                                if payload.get("type") == "token_count":
+                                    info = payload.get("info") or {}
+                                    if "rate_limits" in payload:
+                                        rate_limits = payload["rate_limits"]
+                                    if info and "total_token_usage" in info:
+                                        token_usage = info["total_token_usage"]
+                        except json.JSONDecodeError:
+                            continue
+
+                if rate_limits:
+                    status["available"] = True
+                    primary = rate_limits.get("primary", {})
+                    secondary = rate_limits.get("secondary", {})
+
+                    # Primary: 5-hour rate limit
+                    primary_pct = primary.get("used_percent")
+                    if primary_pct is not None:
+                        status["rate_limit_5h"] = f"{primary_pct}%"
+                        resets_at = primary.get("resets_at")
+                        if resets_at:
+                            status["short_term_resets_at"] = float(resets_at)
+                            reset_time = dt.datetime.fromtimestamp(resets_at)
+                            status["rate_limit_5h"] += f" (リセット: {reset_time.strftime('%H:%M')})"
+
+                    # Secondary: weekly rate limit
+                    secondary_pct = secondary.get("used_percent")
+                    if secondary_pct is not None:
+                        status["weekly_token_limit"] = f"{secondary_pct}%"
+                        resets_at = secondary.get("resets_at")
+                        if resets_at:
+                            status["weekly_resets_at"] = float(resets_at)
+                            reset_time = dt.datetime.fromtimestamp(resets_at)
+                            status["weekly_token_limit"] += f" (リセット: {reset_time.strftime('%m/%d %H:%M')})"
+
+                    # Set both short-term and weekly percentages
+                    if primary_pct is not None:
+                        status["used_percentage"] = primary_pct
+                        status["short_term_percentage"] = primary_pct
+                    if secondary_pct is not None:
+                        status["weekly_percentage"] = secondary_pct
+
+                    # Build raw output
+                    lines = []
+                    if primary_pct is not None:
+                        lines.append(f"5時間制限: {primary_pct}%")
+                    if secondary_pct is not None:
+                        lines.append(f"週間制限: {secondary_pct}%")
+                    if token_usage:
+                        total = token_usage.get("total_tokens", 0)
+                        lines.append(f"セッショントークン: {total:,}")
+                    status["raw_output"] = "\n".join(lines) if lines else "利用可能"
+                else:
+                    status["available"] = True
+                    status["raw_output"] = "セッションデータなし"
+            else:
+                status["available"] = True
+                status["raw_output"] = "セッション履歴なし"
+        else:
+            # Fallback: check if codex command exists
+            proc = subprocess.run(
+                ["codex", "--version"],
+                text=True,
+                capture_output=True,
+                timeout=10,
+                env=_env(env),
+            )
+            if proc.returncode == 0:
+                status["available"] = True
+                status["raw_output"] = proc.stdout.strip() if proc.stdout else "利用可能"
+            else:
+                status["error"] = proc.stderr.strip() if proc.stderr else "codex コマンドが見つかりません"
+    except FileNotFoundError:
+        status["error"] = "codex コマンドが見つかりません"
+    except subprocess.TimeoutExpired:
+        status["error"] = "タイムアウト"
+    except Exception as e:
+        status["error"] = str(e)
+    return status
+
+
+def gemini_token_status(env: dict | None = None) -> dict:
+    """Gemini CLI availability (no quota telemetry)."""
+    status = {
+        "available": False,
+        "raw_output": "",
+        "error": None,
+    }
+    try:
+        proc = subprocess.run(
+            ["gemini", "--version"],
+            text=True,
+            capture_output=True,
+            timeout=10,
+            env=_env(env),
+        )
+        if proc.returncode == 0:
+            status["available"] = True
+            status["raw_output"] = proc.stdout.strip() if proc.stdout else "利用可能"
+        else:
+            status["error"] = proc.stderr.strip() if proc.stderr else "gemini コマンドが見つかりません"
+    except FileNotFoundError:
+        status["error"] = "gemini コマンドが見つかりません"
+    except subprocess.TimeoutExpired:
+        status["error"] = "タイムアウト"
+    except Exception as e:
+        status["error"] = str(e)
+    return status
+
+
+PROVIDERS = {
+    "claude": claude_token_status,
+    "codex": codex_token_status,
+    "gemini": gemini_token_status,
+}
+
+
+def get_cli_token_status(providers: tuple[str, ...] = ("claude", "codex", "gemini")) -> dict:
+    """Token status of each provider's CLI."""
+    return {name: PROVIDERS[name]() for name in providers if name in PROVIDERS}
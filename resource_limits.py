@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Per-role resource limits for CLI child processes.
+
+``run_external`` asks this module how to launch a child for a given role
+(rewriter / concertmaster / performer / reviewer / advisor / mix):
+
+- rlimits (CPU seconds, address space, open files) and a nice level are
+  applied in the child between fork and exec; the orchestrator is
+  multi-threaded, so that hook only makes ``setrlimit``/``nice`` syscalls
+  (values are computed before the fork),
+- an I/O priority is applied by prefixing the command with ``ionice`` when
+  it is available,
+- optionally, each job gets a cgroup v2 subtree with one leaf per role so
+  that ``cpu.weight`` keeps latency-sensitive concertmaster calls ahead of
+  bulk performer work and ``memory.max`` caps runaway builds.  The child is
+  moved into its leaf by the parent right after it starts (``attach``),
+  not from the forked child.
+
+Everything is best effort: an unsupported platform or a non-writable
+cgroup hierarchy just means the limit is skipped (and not recorded).
+"""
+from __future__ import annotations
+
+import contextlib
+import os
+import shutil
+import sys
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+try:
+    import resource
+except Exception:  # not available on Windows
+    resource = None
+
+# Defaults keep the concertmaster responsive and push bulk work down.
+DEFAULT_NICE = {"concertmaster": 0, "rewriter": 0, "mix": 0, "advisor": 5, "reviewer": 5, "performer": 10}
+DEFAULT_CPU_WEIGHT = {"concertmaster": 400, "rewriter": 300, "mix": 300, "advisor": 200, "reviewer": 200, "performer": 50}
+
+
+@dataclass
+class RoleLimits:
+    cpu_sec: int | None = None
+    address_space_mb: int | None = None
+    open_files: int | None = None
+    nice: int | None = None
+    ionice_class: int | None = None  # 1: realtime, 2: best-effort, 3: idle
+    ionice_level: int | None = None  # 0 (high) .. 7 (low) for best-effort
+    cgroup_procs: str | None = None  # cgroup.procs of the role's leaf, if any
+
+    def describe(self) -> dict:
+        """Limits actually in force, for the calls ledger."""
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+    def preexec(self):
+        """Return a preexec_fn applying rlimits/nice, or None if nothing to do."""
+        rlimits = []
+        if resource is not None:
+            wanted = []
+            if self.cpu_sec:
+                wanted.append((resource.RLIMIT_CPU, int(self.cpu_sec)))
+            if self.address_space_mb:
+                wanted.append((resource.RLIMIT_AS, int(self.address_space_mb) * 1024 * 1024))
+            if self.open_files:
+                wanted.append((resource.RLIMIT_NOFILE, int(self.open_files)))
+            # Clamped here: the child inherits these hard limits.
+            for which, value in wanted:
+                with contextlib.suppress(ValueError, OSError):
+                    _, hard = resource.getrlimit(which)
+                    if hard != resource.RLIM_INFINITY:
+                        value = min(value, hard)
+                    rlimits.append((which, (value, hard)))
+        nice = self.nice or 0
+        if not rlimits and not nice:
+            return None
+
+        # Runs in the forked child of a threaded process: setrlimit/nice only,
+        # no file I/O, allocation-heavy work or locks.
+        def apply() -> None:
+            for which, limits in rlimits:
+                try:
+                    resource.setrlimit(which, limits)
+                except (ValueError, OSError):
+                    pass
+            if nice:
+                try:
+                    os.nice(nice)
+                except OSError:
+                    pass
+
+        return apply
+
+    def attach(self, pid: int) -> None:
+        """Move a started child into the role's cgroup leaf (from the parent)."""
+        if not self.cgroup_procs:
+            return
+        with contextlib.suppress(OSError):
+            with open(self.cgroup_procs, "w") as f:
+                f.write(str(pid))
+
+    def wrap_command(self, cmd: list[str]) -> list[str]:
+        if self.ionice_class is None or not sys.platform.startswith("linux"):
+            return cmd
+        ionice = shutil.which("ionice")
+        if not ionice:
+            return cmd
+        prefix = [ionice, "-c", str(self.ionice_class)]
+        if self.ionice_level is not None and self.ionice_class in (1, 2):
+            prefix.extend(["-n", str(self.ionice_level)])
+        return prefix + list(cmd)
+
+
+class JobCgroup:
+    """cgroup v2 subtree ``<parent>/<job>/<role>`` created on demand and removed at the end."""
+
+    def __init__(self, parent: Path, job_id: str, cpu_weight: dict, memory_max_mb: dict):
+        self.root = parent / job_id
+        self.cpu_weight = cpu_weight
+        self.memory_max_mb = memory_max_mb
+        self._leaves: dict[str, Path | None] = {}
+
+    @classmethod
+    def create(cls, cfg: dict, job_id: str, verbose: bool = False) -> "JobCgroup | None":
+        parent = Path(str(cfg.get("parent") or "/sys/fs/cgroup/orchestrator.slice")).expanduser()
+        try:
+            (parent / job_id).mkdir(parents=True, exist_ok=True)
+            # Let the role leaves use the controllers we set below.
+            with (parent / job_id / "cgroup.subtree_control").open("w") as f:
+                f.write("+cpu +memory")
+        except OSError as exc:
+            if verbose:
+                print(f"[Limits] cgroup を作成できません ({parent / job_id}): {exc}", file=sys.stderr)
+            return None
+        cpu_weight = dict(DEFAULT_CPU_WEIGHT)
+        cpu_weight.update(cfg.get("cpu_weight") or {})
+        return cls(parent, job_id, cpu_weight, dict(cfg.get("memory_max_mb") or {}))
+
+    def procs_file(self, role: str) -> str | None:
+        if role not in self._leaves:
+            leaf = self.root / (role or "other")
+            try:
+                leaf.mkdir(exist_ok=True)
+                weight = self.cpu_weight.get(role)
+                if weight:
+                    (leaf / "cpu.weight").write_text(str(int(weight)))
+                mem = self.memory_max_mb.get(role)
+                if mem:
+                    (leaf / "memory.max").write_text(str(int(mem) * 1024 * 1024))
+                self._leaves[role] = leaf
+            except OSError:
+                self._leaves[role] = None
+        leaf = self._leaves[role]
+        return str(leaf / "cgroup.procs") if leaf else None
+
+    def cleanup(self) -> None:
+        for leaf in self._leaves.values():
+            if leaf is not None:
+                with contextlib.suppress(OSError):
+                    leaf.rmdir()
+        with contextlib.suppress(OSError):
+            self.root.rmdir()
+
+
+class ResourcePolicy:
+    """Resolves RoleLimits per role from the ``resource_limits`` config section."""
+
+    def __init__(self, cfg: dict, cgroup: JobCgroup | None = None):
+        self.cfg = cfg
+        self.cgroup = cgroup
+        self._cache: dict[str, RoleLimits] = {}
+
+    @classmethod
+    def from_config(cls, config: dict, job_id: str, verbose: bool = False) -> "ResourcePolicy | None":
+        cfg = config.get("resource_limits") or {}
+        if not cfg.get("enabled"):
+            return None
+        cgroup = None
+        cgroup_cfg = cfg.get("cgroup") or {}
+        if cgroup_cfg.get("enabled"):
+            cgroup = JobCgroup.create(cgroup_cfg, job_id, verbose)
+        return cls(cfg, cgroup)
+
+    def for_role(self, role: str) -> RoleLimits:
+        if role not in self._cache:
+            role_cfg = (self.cfg.get("roles") or {}).get(role) or {}
+            nice = role_cfg.get("nice", DEFAULT_NICE.get(role))
+            self._cache[role] = RoleLimits(
+                cpu_sec=role_cfg.get("cpu_sec"),
+                address_space_mb=role_cfg.get("address_space_mb"),
+                open_files=role_cfg.get("open_files"),
+                nice=int(nice) if nice else None,
+                ionice_class=role_cfg.get("ionice_class"),
+                ionice_level=role_cfg.get("ionice_level"),
+                cgroup_procs=self.cgroup.procs_file(role) if self.cgroup else None,
+            )
+        return self._cache[role]
+
+    def close(self) -> None:
+        if self.cgroup is not None:
+            self.cgroup.cleanup()
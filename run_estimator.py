@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""Pre-run estimates of tokens, wall time and peak concurrency.
+
+Statistics come from earlier runs under ``runs/``:
+
+- ``token_usage.json``: tokens per exchange (``by_task``) and per run;
+- ``score.json``: the performer tasks of the run, their size and deps;
+- ``metadata.json`` and the logs: the run ends at the metadata timestamp
+  and starts when its first prompt file was written; each exchange runs
+  from its ``init`` event to the last update of its log.
+
+For a normalized score (``normalize_score``), tokens and duration of each
+performer task are predicted from its text length (least squares over past
+tasks, or their median when there are too few), plus the per-run overhead
+(rewriter, advisor, mix).  Tasks are then scheduled by their deps, as the
+orchestrator starts them, which gives the wall time and the peak number of
+concurrent exchanges.  Past runs are predicted the same way; the estimate
+is then scaled by the median of actual/predicted, and its range by the
+10th and 90th percentiles.
+
+Without a score (before the rewriter has run), the estimate is the median
+of past runs.
+
+Config (``estimate`` section)::
+
+    "estimate": {
+      "history_runs": 50,
+      "max_tokens": 0, "max_wall_sec": 0,
+      "usd_per_million_tokens": 0
+    }
+
+``max_tokens`` / ``max_wall_sec`` (0 = no limit) mark a score-based
+estimate as ``blocked`` (``--estimate --score`` exits with 3).  The
+median of past runs says little about the job at hand, so a history
+estimate that exceeds them is only reported, under ``warnings``.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import heapq
+import json
+import statistics
+import sys
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from exchange_log import read_summary
+
+HISTORY_RUNS = 50
+MIN_FIT_SAMPLES = 3
+RANGE_QUANTILES = (0.1, 0.9)
+
+
+def task_chars(inst: dict) -> int:
+    return len(f"{inst.get('task') or ''}\n{inst.get('notes') or ''}".strip())
+
+
+def _timestamp(value) -> float | None:
+    try:
+        return dt.datetime.fromisoformat(str(value)).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_json(path: Path) -> dict:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _quantile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    pos = q * (len(ordered) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+@dataclass
+class TaskSample:
+    id: str
+    deps: list[str]
+    chars: int
+    tokens: int
+    duration_sec: float | None
+
+
+@dataclass
+class RunSample:
+    run_id: str
+    tokens: int
+    wall_sec: float | None
+    peak: int
+    tasks: list[TaskSample] = field(default_factory=list)
+    overhead_tokens: int = 0
+    overhead_sec: float | None = None
+
+
+def _exchange_interval(path: Path) -> tuple[float, float] | None:
+    """(start, end) of an exchange from its log: the init event to the last update."""
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            first = json.loads(f.readline() or "{}")
+    except (OSError, ValueError):
+        return None
+    if first.get("op") != "init":
+        return None  # rewritten by a rollover; the start is gone
+    start = _timestamp((first.get("state") or {}).get("updated_at"))
+    end = _timestamp(read_summary(path).get("updated_at"))
+    if start is None or end is None or end < start:
+        return None
+    return start, end
+
+
+def _peak(intervals: list[tuple[float, float]]) -> int:
+    events = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    peak = running = 0
+    for _, delta in events:
+        running += delta
+        peak = max(peak, running)
+    return peak
+
+
+def load_run(run_dir: Path) -> RunSample | None:
+    """A finished, non-dry run as a sample; None if it lacks what the estimate needs."""
+    meta = _read_json(run_dir / "metadata.json")
+    usage = _read_json(run_dir / "token_usage.json")
+    score = _read_json(run_dir / "score.json")
+    if not meta or meta.get("dry_run") or not usage.get("call_count"):
+        return None
+    performers = score.get("performers") or score.get("instruments") or []
+    by_task = usage.get("by_task") or {}
+    tasks: list[TaskSample] = []
+    intervals: list[tuple[float, float]] = []
+    for idx, inst in enumerate(performers):
+        name = f"exchange_{idx + 1}"
+        agg = by_task.get(name)
+        if not agg:
+            continue
+        interval = _exchange_interval(run_dir / "exchanges" / f"{name}.jsonl")
+        if interval is not None:
+            intervals.append(interval)
+            duration = interval[1] - interval[0]
+        else:
+            # Serial calls of one exchange: their latencies add up.
+            latency = agg.get("latency_sec") or {}
+            duration = (latency.get("mean") or 0) * agg.get("calls", 0) or None
+        tasks.append(
+            TaskSample(
+                id=str(inst.get("id") or name),
+                deps=list(inst.get("deps") or []),
+                chars=task_chars(inst),
+                tokens=int(agg.get("input", 0)) + int(agg.get("output", 0)),
+                duration_sec=duration,
+            )
+        )
+    tokens = int(usage.get("total_combined", 0))
+    end = _timestamp(meta.get("timestamp"))
+    prompts = [p.stat().st_mtime for p in run_dir.glob("*_prompt.txt")]
+    wall = end - min(prompts) if end is not None and prompts and end >= min(prompts) else None
+    sample = RunSample(
+        run_id=run_dir.name,
+        tokens=tokens,
+        wall_sec=wall,
+        peak=_peak(intervals) if intervals else min(len(tasks), 1),
+        tasks=tasks,
+        overhead_tokens=max(0, tokens - sum(t.tokens for t in tasks)),
+    )
+    if wall is not None and intervals:
+        sample.overhead_sec = max(0.0, wall - (max(e for _, e in intervals) - min(s for s, _ in intervals)))
+    return sample
+
+
+class LinearFit:
+    """y = intercept + slope * x, never negative; the median when x does not vary."""
+
+    def __init__(self, xs: list[float], ys: list[float]):
+        self.intercept = statistics.median(ys) if ys else 0.0
+        self.slope = 0.0
+        if len(xs) >= MIN_FIT_SAMPLES and len(set(xs)) > 1:
+            mx, my = statistics.fmean(xs), statistics.fmean(ys)
+            var = sum((x - mx) ** 2 for x in xs)
+            slope = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var
+            # A negative slope is noise on this little data; keep the median.
+            if slope > 0:
+                self.slope = slope
+                self.intercept = my - slope * mx
+
+    def __call__(self, x: float) -> float:
+        return max(0.0, self.intercept + self.slope * x)
+
+
+def schedule(tasks: list[dict], durations: list[float], limit: int = 0) -> tuple[float, int]:
+    """(makespan, peak) when every task starts once its deps are done, ``limit`` at a time (0 = no limit)."""
+    ids = [str(t.get("id") or i) for i, t in enumerate(tasks)]
+    known = set(ids)
+    waiting = {i: {d for d in tasks[i].get("deps") or [] if d in known and d != ids[i]} for i in range(len(tasks))}
+    done: set[str] = set()
+    running: list[tuple[float, int]] = []
+    now = makespan = 0.0
+    peak = 0
+    while waiting or running:
+        ready = [i for i, deps in waiting.items() if deps <= done]
+        for i in ready:
+            if limit and len(running) >= limit:
+                break
+            del waiting[i]
+            heapq.heappush(running, (now + durations[i], i))
+        peak = max(peak, len(running))
+        if not running:
+            break  # dependency cycle; normalize_assignments should have prevented it
+        now, i = heapq.heappop(running)
+        done.add(ids[i])
+        makespan = max(makespan, now)
+    return makespan, peak
+
+
+class RunEstimator:
+    """Fits per-task models on past runs and estimates a score before it runs."""
+
+    def __init__(self, samples: list[RunSample], config: dict | None = None):
+        cfg = (config or {}).get("estimate") or {}
+        self.samples = samples
+        self.max_tokens = int(cfg.get("max_tokens") or 0)
+        self.max_wall_sec = int(cfg.get("max_wall_sec") or 0)
+        self.usd_per_million = float(cfg.get("usd_per_million_tokens") or 0)
+        fair_share = (config or {}).get("fair_share") or {}
+        # Only the fair-share broker caps how many exchanges call at once.
+        self.limit = int(fair_share.get("max_concurrent") or 0) if fair_share.get("enabled") else 0
+        tasks = [t for s in samples for t in s.tasks]
+        self.task_tokens = LinearFit([t.chars for t in tasks], [t.tokens for t in tasks])
+        timed = [t for t in tasks if t.duration_sec is not None]
+        self.task_sec = LinearFit([t.chars for t in timed], [t.duration_sec for t in timed])
+        self.overhead_tokens = statistics.median([s.overhead_tokens for s in samples]) if samples else 0
+        overhead = [s.overhead_sec for s in samples if s.overhead_sec is not None]
+        self.overhead_sec = statistics.median(overhead) if overhead else 0.0
+
+    @classmethod
+    def from_runs(cls, runs_dir: Path, config: dict | None = None) -> "RunEstimator":
+        limit = int(((config or {}).get("estimate") or {}).get("history_runs") or HISTORY_RUNS)
+        samples: list[RunSample] = []
+        try:
+            run_dirs = sorted((p for p in Path(runs_dir).iterdir() if p.is_dir()), reverse=True)
+        except OSError:
+            run_dirs = []
+        for run_dir in run_dirs:
+            sample = _cached_sample(run_dir)
+            if sample is not None:
+                samples.append(sample)
+                if len(samples) >= limit:
+                    break
+        return cls(samples, config)
+
+    def _predict(self, tasks: list[dict]) -> tuple[float, float, int]:
+        chars = [task_chars(t) for t in tasks]
+        tokens = self.overhead_tokens + sum(self.task_tokens(c) for c in chars)
+        makespan, peak = schedule(tasks, [self.task_sec(c) for c in chars], self.limit)
+        return tokens, self.overhead_sec + makespan, peak
+
+    def _calibrate(self, point: float, ratios: list[float]) -> tuple[int, list[int] | None]:
+        """Point scaled by the median actual/predicted ratio, and its range."""
+        if len(ratios) < MIN_FIT_SAMPLES:
+            return round(point), None
+        return round(point * statistics.median(ratios)), [round(point * _quantile(ratios, q)) for q in RANGE_QUANTILES]
+
+    def estimate(self, score: dict | None = None) -> dict:
+        result: dict = {"samples": len(self.samples)}
+        if not self.samples:
+            result.update(tokens=None, wall_sec=None, peak_concurrency=None, basis="none")
+            return self._judge(result)
+        if score is None:
+            tokens = [s.tokens for s in self.samples]
+            walls = [s.wall_sec for s in self.samples if s.wall_sec is not None]
+            result.update(
+                basis="history",
+                tasks=round(statistics.median([len(s.tasks) for s in self.samples])),
+                tokens=round(statistics.median(tokens)),
+                tokens_range=[round(_quantile(tokens, q)) for q in RANGE_QUANTILES],
+                wall_sec=round(statistics.median(walls)) if walls else None,
+                wall_sec_range=[round(_quantile(walls, q)) for q in RANGE_QUANTILES] if walls else None,
+                peak_concurrency=max(1, round(statistics.median([s.peak for s in self.samples]))),
+            )
+            return self._judge(result)
+        tasks = score.get("performers") or score.get("instruments") or []
+        tokens, wall, peak = self._predict(tasks)
+        token_ratios, wall_ratios = [], []
+        for s in self.samples:
+            past = [{"id": t.id, "deps": t.deps, "task": "x" * t.chars} for t in s.tasks]
+            p_tokens, p_wall, _ = self._predict(past)
+            if p_tokens > 0:
+                token_ratios.append(s.tokens / p_tokens)
+            if p_wall > 0 and s.wall_sec is not None:
+                wall_ratios.append(s.wall_sec / p_wall)
+        tokens, tokens_range = self._calibrate(tokens, token_ratios)
+        wall, wall_range = self._calibrate(wall, wall_ratios)
+        result.update(
+            basis="score",
+            tasks=len(tasks),
+            tokens=tokens,
+            tokens_range=tokens_range,
+            wall_sec=wall,
+            wall_sec_range=wall_range,
+            peak_concurrency=peak,
+        )
+        return self._judge(result)
+
+    def _judge(self, result: dict) -> dict:
+        if self.usd_per_million and result.get("tokens") is not None:
+            result["cost_usd"] = round(result["tokens"] * self.usd_per_million / 1_000_000, 4)
+        over = []
+        if self.max_tokens and (result.get("tokens") or 0) > self.max_tokens:
+            over.append(f"推定トークン数 {result['tokens']:,} が上限 {self.max_tokens:,} を超えます")
+        if self.max_wall_sec and (result.get("wall_sec") or 0) > self.max_wall_sec:
+            over.append(f"推定所要時間 {result['wall_sec']:,} 秒が上限 {self.max_wall_sec:,} 秒を超えます")
+        result["limits"] = {"max_tokens": self.max_tokens, "max_wall_sec": self.max_wall_sec}
+        # Only an estimate of this job's own score is firm enough to refuse it.
+        by_score = result.get("basis") == "score"
+        result["blocked"] = over if by_score else []
+        result["warnings"] = [] if by_score else over
+        return result
+
+
+# Samples of finished runs never change; re-read only when metadata.json does.
+_sample_cache: dict[str, tuple[int, RunSample | None]] = {}
+_sample_lock = threading.Lock()
+
+
+def _cached_sample(run_dir: Path) -> RunSample | None:
+    try:
+        mtime = (run_dir / "metadata.json").stat().st_mtime_ns
+    except OSError:
+        return None
+    key = str(run_dir)
+    with _sample_lock:
+        hit = _sample_cache.get(key)
+    if hit is not None and hit[0] == mtime:
+        return hit[1]
+    sample = load_run(run_dir)
+    with _sample_lock:
+        _sample_cache[key] = (mtime, sample)
+    return sample
+
+
+def estimate_run(runs_dir: Path, config: dict, score: dict | None = None) -> dict:
+    return RunEstimator.from_runs(runs_dir, config).estimate(score)
+
+
+def format_estimate(est: dict) -> str:
+    if not est.get("samples"):
+        return "過去の実行がないため見積もれません。"
+
+    def span(value, rng, unit):
+        text = f"{value:,}{unit}" if value is not None else "不明"
+        return f"{text}（{rng[0]:,}〜{rng[1]:,}{unit}）" if rng else text
+
+    lines = [
+        f"見積もり（過去 {est['samples']} 回の実行から、{'スコア' if est.get('basis') == 'score' else '実行全体の中央値'}）",
+        f"  タスク数: {est.get('tasks')}",
+        f"  トークン: {span(est.get('tokens'), est.get('tokens_range'), '')}",
+        f"  所要時間: {span(est.get('wall_sec'), est.get('wall_sec_range'), ' 秒')}",
+        f"  最大同時実行数: {est.get('peak_concurrency')}",
+    ]
+    if "cost_usd" in est:
+        lines.append(f"  費用: ${est['cost_usd']:,.2f}")
+    lines += [f"  上限超過: {reason}" for reason in est.get("blocked") or []]
+    lines += [f"  上限超過の可能性: {reason}" for reason in est.get("warnings") or []]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    root = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).resolve().parent / "runs"
+    print(json.dumps(estimate_run(root, {}), ensure_ascii=False, indent=2))
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""Find the YAML/JSON document in a CLI reply, in one pass.
+
+CLI replies wrap the document the orchestrator asked for in prose, code
+fences, or both.  The regex extractors tried one fenced block, then parsed
+the whole reply; a chatty reply therefore failed to parse and the
+concertmaster's answer was taken as a plain reply, costing a turn.  The
+greedy ``\\{.*\\}`` search for JSON also backtracks badly on long text.
+
+``candidates`` walks the reply line by line once and yields, in order:
+
+- fenced blocks (any info string; a closing fence must not be indented
+  deeper than its opening one, so fences inside YAML block scalars stay
+  in the document);
+- unfenced YAML: runs of top-level ``key:`` lines with their indented
+  lines and list items, ended by the first prose line;
+- unfenced JSON: brace-matched objects starting a line (string-aware);
+- the whole reply, last.
+
+``extract`` parses them in that order and returns the first dict that
+passes the schema (``ACTION``, ``SCORE``, ``REVIEW`` or ``ANY``).  A YAML
+run that fails is retried once from its first schema key, which drops
+prose lines such as ``Note: ...`` in front of the document.  Every line
+is scanned once and each candidate is parsed at most twice, so the cost
+is linear in the reply.
+
+Benchmark against the regex extractors on real replies::
+
+    python structured_extract.py bench runs/<run_id> [...] [--pad 200]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator
+
+from artifact_codec import yaml_load
+
+FENCE_MARKERS = ("```", "~~~")
+KEY_LINE = re.compile(r"""^["']?[A-Za-z_][\w\- ]*["']?:(?:\s|$)""")
+
+
+@dataclass(frozen=True)
+class Schema:
+    name: str
+    # Top-level keys a document of this kind starts with.
+    anchors: tuple[str, ...]
+    check: Callable[[dict], bool]
+
+    def valid(self, data) -> bool:
+        return isinstance(data, dict) and bool(data) and self.check(data)
+
+
+def _has_list(data: dict, *keys: str) -> bool:
+    return any(isinstance(data.get(key), list) for key in keys)
+
+
+ANY = Schema("any", (), lambda d: True)
+ACTION = Schema("action", ("action", "reply"), lambda d: isinstance(d.get("action"), str) or isinstance(d.get("reply"), str))
+# Every task list normalize_tasks understands.
+SCORE_LISTS = ("dag", "bag", "tasks", "performers", "instruments")
+SCORE = Schema("score", ("title", "refined_task", *SCORE_LISTS), lambda d: _has_list(d, *SCORE_LISTS))
+REVIEW = Schema("review", ("verdict",), lambda d: isinstance(d.get("verdict"), str))
+
+
+@dataclass
+class Candidate:
+    kind: str  # "fenced" / "yaml" / "json" / "text"
+    body: str
+    lang: str = ""
+    # Body lines, for the anchored retry of unfenced YAML.
+    lines: list[str] | None = None
+
+
+def _fence(stripped: str) -> str:
+    for marker in FENCE_MARKERS:
+        if stripped.startswith(marker):
+            return marker
+    return ""
+
+
+def _match_object(lines: list[str], start: int, col: int) -> tuple[int, int] | None:
+    """(line, column) of the brace closing the object at ``lines[start][col]``; None if unclosed."""
+    depth = 0
+    in_string = escaped = False
+    for i in range(start, len(lines)):
+        line = lines[i]
+        for j in range(col if i == start else 0, len(line)):
+            ch = line[j]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    return i, j
+    return None
+
+
+def candidates(text: str) -> Iterator[Candidate]:
+    lines = text.splitlines()
+    n = len(lines)
+    i = 0
+    yaml_start = None
+    # After an unclosed object the rest of the reply is inside it: stop matching.
+    json_open = True
+
+    def yaml_run(end: int) -> Candidate:
+        run = lines[yaml_start:end]
+        while run and not run[-1].strip():
+            run.pop()
+        return Candidate("yaml", "\n".join(run), lines=run)
+
+    while i < n:
+        line = lines[i]
+        stripped = line.lstrip()
+        indent = len(line) - len(stripped)
+        if yaml_start is not None and indent > 0:
+            i += 1  # inside the run, fences included (block scalars)
+            continue
+        marker = _fence(stripped) if indent <= 3 else ""
+        if marker:
+            if yaml_start is not None:
+                yield yaml_run(i)
+                yaml_start = None
+            j = i + 1
+            while j < n:
+                closing = lines[j].lstrip()
+                if closing.rstrip() == marker and len(lines[j]) - len(closing) <= indent:
+                    break
+                j += 1
+            yield Candidate("fenced", "\n".join(lines[i + 1 : j]), stripped[len(marker) :].strip().lower())
+            i = j + 1
+            continue
+        if yaml_start is not None:
+            if not stripped or stripped.startswith("-") or KEY_LINE.match(line):
+                i += 1
+                continue
+            yield yaml_run(i)
+            yaml_start = None
+        if KEY_LINE.match(line):
+            yaml_start = i
+        elif json_open and stripped.startswith("{"):
+            end = _match_object(lines, i, indent)
+            if end is not None:
+                end_line, end_col = end
+                if end_line == i:
+                    body = line[indent : end_col + 1]
+                else:
+                    body = "\n".join([line[indent:], *lines[i + 1 : end_line], lines[end_line][: end_col + 1]])
+                yield Candidate("json", body)
+                i = end_line + 1
+                continue
+            json_open = False
+        i += 1
+    if yaml_start is not None:
+        yield yaml_run(n)
+    yield Candidate("text", text.strip())
+
+
+def _parse(body: str, as_json: bool, strict: bool = False):
+    if not body.strip():
+        return None
+    if as_json:
+        try:
+            return json.loads(body)
+        except ValueError:
+            if strict:
+                return None
+    try:
+        return yaml_load(body)
+    except Exception:
+        return None
+
+
+def _anchored(candidate: Candidate, schema: Schema) -> str | None:
+    """The YAML run from its first schema key on, if that is not its first line."""
+    for k, line in enumerate(candidate.lines or []):
+        match = KEY_LINE.match(line)
+        if match and match.group(0).strip().strip("\"'").rstrip(":").strip("\"'") in schema.anchors:
+            return "\n".join(candidate.lines[k:]) if k else None
+    return None
+
+
+def extract(text: str, schema: Schema = ANY, json_only: bool = False) -> dict | None:
+    """First candidate document of ``text`` that passes ``schema``; None if there is none."""
+    seen: set[str] = set()
+    for candidate in candidates(text or ""):
+        if json_only and candidate.kind not in ("json", "fenced"):
+            continue
+        if candidate.body in seen:
+            continue
+        seen.add(candidate.body)
+        as_json = json_only or candidate.kind == "json" or candidate.lang == "json"
+        data = _parse(candidate.body, as_json, strict=json_only)
+        if schema.valid(data):
+            return data
+        if candidate.kind == "yaml" and schema.anchors:
+            retry = _anchored(candidate, schema)
+            if retry is not None:
+                data = _parse(retry, False)
+                if schema.valid(data):
+                    return data
+    return None
+
+
+# --- benchmark -------------------------------------------------------------
+
+# Filler of a chatty reply, with the stray braces and colons of real prose.
+FILLER = (
+    "Let me walk through the change. The function {name} maps keys to values: see the notes below.\n"
+    "Result: the tests pass; coverage is unchanged.\n"
+    "\n"
+)
+
+
+def _legacy_extract_yaml(text: str) -> dict:
+    fenced = re.search(r"```(?:yaml|yml)?\s*(.*?)\s*```", text, re.S)
+    if fenced:
+        data = yaml_load(fenced.group(1))
+        if isinstance(data, dict):
+            return data
+    data = yaml_load(text.strip())
+    if not isinstance(data, dict):
+        raise ValueError("not a dict")
+    return data
+
+
+def _legacy_extract_json(text: str) -> dict:
+    fenced = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", text, re.S)
+    if fenced:
+        return json.loads(fenced.group(1))
+    raw = re.search(r"\{.*\}", text, re.S)
+    if not raw:
+        raise ValueError("no json")
+    return json.loads(raw.group(0))
+
+
+def schema_for(label: str) -> Schema:
+    if label.startswith("concertmaster"):
+        return ACTION
+    if label.startswith(("rewriter", "advisor")):
+        return SCORE
+    if label.startswith("reviewer"):
+        return REVIEW
+    return ANY
+
+
+def _sample_replies(paths: list[Path], pad_kb: int) -> list[tuple[Schema, str]]:
+    files: list[Path] = []
+    for root in paths:
+        files.extend([root] if root.is_file() else sorted(root.glob("**/*_stdout.txt")))
+    filler = FILLER * max(0, pad_kb * 1024 // len(FILLER))
+    replies = []
+    for path in files:
+        schema = schema_for(path.name)
+        if schema is ANY:
+            continue  # performer output is free text
+        try:
+            text = path.read_text(encoding="utf-8")
+        except OSError:
+            continue
+        if text.strip():
+            replies.append((schema, f"{filler}{text}\n{filler}" if filler else text))
+    return replies
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench(paths: list[Path], pad_kb: int = 0, repeat: int = 3) -> list[dict]:
+    """Time and valid-document count of the regex extractors and ``extract`` over real replies."""
+    replies = _sample_replies(paths, pad_kb)
+    if not replies:
+        return []
+
+    def legacy_yaml() -> int:
+        ok = 0
+        for schema, text in replies:
+            try:
+                ok += schema.valid(_legacy_extract_yaml(text))
+            except Exception:
+                pass
+        return ok
+
+    def legacy_json() -> int:
+        ok = 0
+        for schema, text in replies:
+            try:
+                ok += schema.valid(_legacy_extract_json(text))
+            except Exception:
+                pass
+        return ok
+
+    def single_pass() -> int:
+        return sum(extract(text, schema) is not None for schema, text in replies)
+
+    rows = []
+    for name, fn in (("regex yaml", legacy_yaml), ("regex json", legacy_json), ("single pass", single_pass)):
+        rows.append({"extractor": name, "valid": fn(), "ms": _time(fn, repeat) * 1000})
+    return rows
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="CLI の返答から YAML/JSON を取り出す処理のベンチマーク")
+    parser.add_argument("command", choices=["bench"], help="bench: 実際の実行ディレクトリの返答で計測")
+    parser.add_argument("paths", nargs="+", help="実行ディレクトリまたは *_stdout.txt")
+    parser.add_argument("--pad", type=int, default=0, help="各返答の前後に足す文章の量（KB、長い返答の再現）")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最良値を表示）")
+    args = parser.parse_args(argv)
+    paths = [Path(p).expanduser() for p in args.paths]
+    replies = _sample_replies(paths, args.pad)
+    rows = bench(paths, args.pad, max(1, args.repeat))
+    if not rows:
+        print("計測対象の返答が見つかりません。", file=sys.stderr)
+        return 1
+    size = sum(len(text.encode("utf-8")) for _, text in replies)
+    print(f"対象: {len(replies)} 件 / {size:,} バイト")
+    print(f"{'extractor':<14}{'valid':>8}{'ms':>12}")
+    for row in rows:
+        print(f"{row['extractor']:<14}{row['valid']:>8}{row['ms']:>12.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,56 @@
+import json
+
+import exchange_log
+from exchange_log import ExchangeLog, SharedExchange, snapshot_path
+
+
+def _replay(path):
+    return ExchangeLog(path).read()
+
+
+def test_foreign_write_between_pending_update_and_flush(tmp_path):
+    path = tmp_path / "exchange_1.jsonl"
+    shared = SharedExchange.open(path)
+    try:
+        SharedExchange.create(path, {"status": "running", "pending": None, "history": []})
+        # Not a durability point: stays pending in memory.
+        shared.update(lambda d: {**d, "status": "performer_turn", "pending": "performer",
+                                 "history": [*d["history"], {"role": "concertmaster", "text": "go"}]})
+        assert shared._pending
+        # Another process (the web server) writes the same fields meanwhile.
+        ExchangeLog(path).update(lambda d: {**d, "status": "user_replied", "pending": "user",
+                                            "history": [*d["history"], {"role": "user", "text": "hi"}]})
+        shared.flush()
+        assert not shared._pending
+        state = shared.read()
+        assert _replay(path) == state
+        snap = json.loads(snapshot_path(path).read_text(encoding="utf-8"))
+        assert snap["log_offset"] == path.stat().st_size
+        assert {k: snap[k] for k in ("status", "pending", "history_count")} == {
+            "status": state["status"],
+            "pending": state["pending"],
+            "history_count": len(state["history"]),
+        }
+    finally:
+        SharedExchange.release(path)
+
+
+def test_foreign_write_without_pending_is_applied(tmp_path):
+    path = tmp_path / "exchange_2.jsonl"
+    shared = SharedExchange.open(path)
+    try:
+        SharedExchange.create(path, {"status": "waiting_for_user", "history": []})
+        ExchangeLog(path).update(lambda d: {**d, "status": "user_replied"})
+        assert shared.read()["status"] == "user_replied"
+        assert _replay(path) == shared.read()
+    finally:
+        SharedExchange.release(path)
+
+
+def test_diff_events_compares_history_by_value():
+    history = [{"role": "a", "text": str(i)} for i in range(3)]
+    grown = [dict(e) for e in history] + [{"role": "b", "text": "new"}]
+    assert [e["op"] for e in exchange_log.diff_events({}, history, {"history": grown})] == ["append"]
+    edited = list(history)
+    edited[0] = {"role": "a", "text": "edited"}
+    assert [e["op"] for e in exchange_log.diff_events({}, history, {"history": edited})] == ["history"]
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""Token budgets per run, per exchange and per role, enforced before each call.
+
+``TokenUsage`` only reports after the fact.  A budget is checked before
+``run_external`` starts a CLI: the prompt is estimated for the backend
+that would run it, plus ``output_reserve`` for the answer, and that amount
+is reserved against every scope the call belongs to: the run, its exchange
+(one performer task) and its role.  Concurrent workers therefore cannot
+all be admitted against the same headroom.  When the call finishes, the
+reservation is replaced by the tokens it actually used.
+
+Budgets are in cost-weighted tokens: tokens times ``cost_weights[backend]``
+(1.0 when unset), so a call on a cheaper backend uses less of the budget.
+A call that does not fit is adjusted, in order:
+
+1. shrink: the middle of the prompt is cut (beginning and end are kept)
+   if at least ``shrink_floor`` of it still fits;
+2. downgrade: the call moves to a cheaper backend from ``downgrade``
+   (full prompt first, then shrunk);
+3. otherwise ``BudgetExhausted`` is raised.  Exchange workers then end
+   the exchange with status ``budget_exhausted``.
+
+Config (``token_budget`` section)::
+
+    "token_budget": {
+      "enabled": true,
+      "run": 400000, "exchange": 60000,
+      "roles": {"performer": 200000, "concertmaster": 80000},
+      "output_reserve": 1024, "shrink_floor": 0.5,
+      "cost_weights": {"claude": 1.0, "codex": 1.0, "gemini": 0.4},
+      "downgrade": {"claude": ["gemini"], "codex": ["gemini"]},
+      "backends": {"gemini": {"cmd": ["gemini", "-p"]}}
+    }
+
+Limits of 0 (or missing) are unlimited.  Downgrade targets take their
+command from ``token_budget.backends``, then ``fallback.backends``.
+"""
+from __future__ import annotations
+
+import math
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+SHRINK_MARKER = "\n\n...(トークン予算のため {omitted} 文字を省略)...\n\n"
+# Share of the kept text taken from the start of the prompt; the rest comes
+# from the end, where the latest output and the answer format live.
+SHRINK_HEAD = 1 / 3
+SHRINK_ATTEMPTS = 3
+
+
+class BudgetExhausted(Exception):
+    """A call does not fit its token budget even after shrinking and downgrading."""
+
+    def __init__(self, scope: str, needed: float, remaining: float):
+        self.scope = scope
+        self.needed = needed
+        self.remaining = remaining
+        super().__init__(f"トークン予算を超えます（{scope}: 必要 {needed:,.0f} / 残り {max(remaining, 0):,.0f}）")
+
+
+@dataclass
+class Admission:
+    """What a call was admitted as; hand it back to ``settle`` or ``release``."""
+    prompt: str
+    cmd_tmpl: list[str]
+    backend: str
+    scopes: list[str]
+    reserved: float = 0.0
+    shrunk_from: int = 0
+    downgraded_from: str = ""
+
+    def describe(self) -> dict:
+        info = {}
+        if self.shrunk_from:
+            info["shrunk_from_chars"] = self.shrunk_from
+            info["shrunk_to_chars"] = len(self.prompt)
+        if self.downgraded_from:
+            info["downgraded_from"] = self.downgraded_from
+            info["backend"] = self.backend
+        return info
+
+
+def shrink_text(text: str, max_chars: int) -> str:
+    """Cut the middle of ``text`` so that at most ``max_chars`` characters remain."""
+    if len(text) <= max_chars:
+        return text
+    omitted = len(text) - max_chars
+    marker = SHRINK_MARKER.format(omitted=omitted)
+    keep = max(0, max_chars - len(marker))
+    head = int(keep * SHRINK_HEAD)
+    tail = keep - head
+    return text[:head] + marker + (text[-tail:] if tail else "")
+
+
+class TokenBudget:
+    """Thread-safe run/exchange/role budgets with reservations."""
+
+    def __init__(
+        self,
+        run: int = 0,
+        exchange: int = 0,
+        roles: dict[str, int] | None = None,
+        output_reserve: int = 1024,
+        shrink_floor: float = 0.5,
+        cost_weights: dict[str, float] | None = None,
+        downgrade: dict[str, list[tuple[str, list[str]]]] | None = None,
+    ):
+        self.run_limit = int(run or 0)
+        self.exchange_limit = int(exchange or 0)
+        self.role_limits = {k: int(v) for k, v in (roles or {}).items() if v}
+        self.output_reserve = max(0, int(output_reserve))
+        self.shrink_floor = min(max(float(shrink_floor), 0.0), 1.0)
+        self.cost_weights = {k: float(v) for k, v in (cost_weights or {}).items()}
+        self.downgrade = downgrade or {}
+        self._used: dict[str, float] = {}
+        self._reserved: dict[str, float] = {}
+        self._exhausted: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(
+        cls,
+        config: dict,
+        prepare: Callable[[list[str]], list[str]] | None = None,
+    ) -> "TokenBudget | None":
+        cfg = config.get("token_budget") or {}
+        if not cfg.get("enabled"):
+            return None
+        prepare = prepare or (lambda cmd: list(cmd))
+        registry = dict((config.get("fallback") or {}).get("backends") or {})
+        registry.update(cfg.get("backends") or {})
+        downgrade: dict[str, list[tuple[str, list[str]]]] = {}
+        for backend, targets in (cfg.get("downgrade") or {}).items():
+            if isinstance(targets, str):
+                targets = [targets]
+            chain = []
+            for name in targets or []:
+                cmd = (registry.get(name) or {}).get("cmd")
+                if cmd:
+                    chain.append((str(name), prepare(list(cmd))))
+            if chain:
+                downgrade[backend] = chain
+        return cls(
+            run=cfg.get("run", 0),
+            exchange=cfg.get("exchange", 0),
+            roles=cfg.get("roles") or {},
+            output_reserve=cfg.get("output_reserve", 1024),
+            shrink_floor=cfg.get("shrink_floor", 0.5),
+            cost_weights=cfg.get("cost_weights") or {},
+            downgrade=downgrade,
+        )
+
+    # --- accounting ---------------------------------------------------------
+
+    def weight(self, backend: str) -> float:
+        return self.cost_weights.get(backend, 1.0)
+
+    def _scopes(self, role: str, exchange: str) -> list[tuple[str, int]]:
+        scopes = []
+        if self.run_limit:
+            scopes.append(("run", self.run_limit))
+        if exchange and self.exchange_limit:
+            scopes.append((f"exchange:{exchange}", self.exchange_limit))
+        if role in self.role_limits:
+            scopes.append((f"role:{role}", self.role_limits[role]))
+        return scopes
+
+    def _headroom_locked(self, scopes: list[tuple[str, int]]) -> tuple[str, float]:
+        tightest, room = "", math.inf
+        for scope, limit in scopes:
+            left = limit - self._used.get(scope, 0.0) - self._reserved.get(scope, 0.0)
+            if left < room:
+                tightest, room = scope, left
+        return tightest, room
+
+    def exhausted(self, role: str = "", exchange: str = "") -> str:
+        """Scope that already refused a call for this role/exchange ("" if none)."""
+        with self._lock:
+            for scope, _ in self._scopes(role, exchange):
+                if scope in self._exhausted:
+                    return scope
+        return ""
+
+    # --- admission ----------------------------------------------------------
+
+    def admit(
+        self,
+        role: str,
+        exchange: str,
+        prompt: str,
+        cmd_tmpl: list[str],
+        backend: str,
+        count: Callable[[str, str], int],
+    ) -> Admission:
+        """Reserve budget for a call, shrinking or downgrading it to fit.
+
+        ``count(text, backend)`` estimates the input tokens of a prompt.
+        Raises ``BudgetExhausted`` when nothing fits.
+        """
+        scope_limits = self._scopes(role, exchange)
+        scopes = [s for s, _ in scope_limits]
+        if not scopes:
+            return Admission(prompt, cmd_tmpl, backend, scopes)
+        candidates = [(backend, cmd_tmpl)] + list(self.downgrade.get(backend) or [])
+        full = {name: count(prompt, name) for name, _ in candidates}
+        with self._lock:
+            tightest, room = self._headroom_locked(scope_limits)
+            needed = math.inf
+            for name, tmpl in candidates:
+                weight = self.weight(name)
+                cost = (full[name] + self.output_reserve) * weight
+                needed = min(needed, cost)
+                if cost <= room:
+                    admission = Admission(prompt, tmpl, name, scopes, cost)
+                else:
+                    admission = self._shrunk(prompt, tmpl, name, scopes, room, full[name], count)
+                if admission is None:
+                    continue
+                if name != backend:
+                    admission.downgraded_from = backend
+                for scope in scopes:
+                    self._reserved[scope] = self._reserved.get(scope, 0.0) + admission.reserved
+                return admission
+            self._exhausted[tightest] = role
+        raise BudgetExhausted(tightest, needed, room)
+
+    def _shrunk(
+        self,
+        prompt: str,
+        tmpl: list[str],
+        backend: str,
+        scopes: list[str],
+        room: float,
+        full: int,
+        count: Callable[[str, str], int],
+    ) -> Admission | None:
+        weight = self.weight(backend)
+        allowed = room / weight - self.output_reserve
+        if full <= 0 or allowed < full * self.shrink_floor:
+            return None
+        max_chars = int(len(prompt) * allowed / full)
+        for _ in range(SHRINK_ATTEMPTS):
+            shrunk = shrink_text(prompt, max_chars)
+            tokens = count(shrunk, backend)
+            if tokens <= allowed:
+                cost = (tokens + self.output_reserve) * weight
+                return Admission(shrunk, tmpl, backend, scopes, cost, shrunk_from=len(prompt))
+            # Fixed overhead does not shrink with the text; aim lower.
+            max_chars = int(max_chars * allowed / tokens * 0.95)
+            if max_chars < len(prompt) * self.shrink_floor:
+                break
+        return None
+
+    def settle(self, admission: Admission, tokens: int, backend: str = "") -> None:
+        """Replace the reservation by what the call actually used."""
+        cost = tokens * self.weight(backend or admission.backend)
+        with self._lock:
+            for scope in admission.scopes:
+                self._reserved[scope] = max(0.0, self._reserved.get(scope, 0.0) - admission.reserved)
+                self._used[scope] = self._used.get(scope, 0.0) + cost
+        admission.reserved = 0.0
+
+    def release(self, admission: Admission) -> None:
+        """Drop the reservation of a call that never produced usage."""
+        self.settle(admission, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            scopes = sorted(set(self._used) | set(self._reserved))
+            limits = {}
+            if self.run_limit:
+                limits["run"] = self.run_limit
+            for scope in scopes:
+                if scope.startswith("exchange:"):
+                    limits[scope] = self.exchange_limit
+                elif scope.startswith("role:"):
+                    limits[scope] = self.role_limits.get(scope[5:], 0)
+            return {
+                scope: {
+                    "limit": limit,
+                    "used": round(self._used.get(scope, 0.0)),
+                    "reserved": round(self._reserved.get(scope, 0.0)),
+                    **({"exhausted": True} if scope in self._exhausted else {}),
+                }
+                for scope, limit in limits.items()
+            }
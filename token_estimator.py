@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Token estimates for prompts and outputs, calibrated against real usage.
+
+Text is reduced to three character classes in one scan over runs of
+non-ASCII characters (no per-character lists): ASCII, CJK (kana, kanji,
+full-width forms) and other non-ASCII.  An estimate is the dot product of
+those counts with per-backend tokens-per-character ratios, plus a learned
+per-backend overhead (system prompt, tool definitions) for inputs.
+
+Whenever a CLI reports exact usage, ``observe`` nudges that backend's
+ratios with a normalized LMS step and its overhead with an EMA, so the
+estimates used for the ``TokenUsage`` thresholds converge on what the
+backend actually bills.  Calibration is kept in
+``runs/token_calibration.json`` across runs.
+
+Counts of long texts are cached per paragraph, so the fragments prompts
+are built from (system prompts, the refined task, earlier outputs) are
+scanned once.  With ``kind: "tiktoken"`` the base count comes from tiktoken
+(when installed) and calibration learns a per-backend scale on top.
+"""
+from __future__ import annotations
+
+import json
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None
+
+SCRIPTS = ("ascii", "cjk", "other")
+# Tokens per character before any calibration (~4 chars/token for English,
+# ~1.5 for Japanese), matching the old fixed estimate.
+DEFAULT_RATIOS = {"ascii": 0.25, "cjk": 1 / 1.5, "other": 0.5}
+RATIO_BOUNDS = (0.02, 3.0)
+LEARNING_RATE = 0.3
+OVERHEAD_ALPHA = 0.2
+# Texts longer than this are counted per paragraph so fragments are cached.
+FRAGMENT_MIN_CHARS = 2048
+
+_NON_ASCII_RUN = re.compile(r"([\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]+)|([^\x00-\x7f]+)")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def script_counts(text: str) -> tuple[int, int, int]:
+    """(ascii, cjk, other) character counts in a single scan."""
+    if text.isascii():
+        return len(text), 0, 0
+    cjk = other = 0
+    for match in _NON_ASCII_RUN.finditer(text):
+        if match.group(1):
+            cjk += match.end() - match.start()
+        else:
+            other += match.end() - match.start()
+    return len(text) - cjk - other, cjk, other
+
+
+class TokenEstimator:
+    """Calibrated, cached token estimates; safe to share between threads."""
+
+    def __init__(
+        self,
+        kind: str = "heuristic",
+        calibrate: bool = True,
+        cache_size: int = 1024,
+        state_path: Path | None = None,
+    ):
+        self.kind = kind if kind == "heuristic" or tiktoken is not None else "heuristic"
+        self.calibrate = calibrate
+        self.cache_size = max(0, int(cache_size))
+        self.state_path = state_path
+        self._encoding = tiktoken.get_encoding("cl100k_base") if self.kind == "tiktoken" else None
+        self._ratios: dict[str, dict[str, float]] = {}
+        self._overhead: dict[str, float] = {}
+        self._samples: dict[str, int] = {}
+        self._cache: OrderedDict[str, tuple[int, int, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def from_config(cls, config: dict, runs_dir: Path | None = None) -> "TokenEstimator":
+        cfg = config.get("token_estimator") or {}
+        state = cfg.get("state_file") or (runs_dir / "token_calibration.json" if runs_dir else None)
+        return cls(
+            kind=str(cfg.get("kind") or "heuristic"),
+            calibrate=bool(cfg.get("calibrate", True)),
+            cache_size=int(cfg.get("cache_size", 1024)),
+            state_path=Path(str(state)).expanduser() if state else None,
+        )
+
+    # --- counting -----------------------------------------------------------
+
+    def _fragment_features(self, fragment: str) -> tuple[int, int, int]:
+        if self.cache_size:
+            with self._lock:
+                hit = self._cache.get(fragment)
+                if hit is not None:
+                    self._cache.move_to_end(fragment)
+                    return hit
+        if self._encoding is not None:
+            # Base tokens go in the "ascii" slot; calibration scales them.
+            features = (len(self._encoding.encode(fragment, disallowed_special=())), 0, 0)
+        else:
+            features = script_counts(fragment)
+        if self.cache_size:
+            with self._lock:
+                self._cache[fragment] = features
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return features
+
+    def features(self, text: str) -> tuple[int, int, int]:
+        if len(text) < FRAGMENT_MIN_CHARS:
+            return self._fragment_features(text)
+        ascii_n = cjk = other = 0
+        start = 0
+        for match in _PARAGRAPH_BREAK.finditer(text):
+            a, c, o = self._fragment_features(text[start : match.end()])
+            ascii_n, cjk, other = ascii_n + a, cjk + c, other + o
+            start = match.end()
+        a, c, o = self._fragment_features(text[start:])
+        return ascii_n + a, cjk + c, other + o
+
+    def _ratios_for(self, backend: str) -> dict[str, float]:
+        if self._encoding is not None:
+            return self._ratios.get(backend) or {"ascii": 1.0, "cjk": 0.0, "other": 0.0}
+        return self._ratios.get(backend) or DEFAULT_RATIOS
+
+    def count(self, text: str, backend: str = "", with_overhead: bool = False) -> int:
+        """Estimated tokens of ``text`` for ``backend`` (plus its per-call overhead for inputs)."""
+        if not text:
+            return 0
+        x = self.features(text)
+        with self._lock:
+            ratios = self._ratios_for(backend)
+            estimate = sum(n * ratios[s] for s, n in zip(SCRIPTS, x))
+            if with_overhead:
+                estimate += self._overhead.get(backend, 0.0)
+        return int(estimate)
+
+    # --- calibration --------------------------------------------------------
+
+    def observe(self, backend: str, text: str, exact_tokens: int, with_overhead: bool = False) -> None:
+        """Learn from a call whose exact token count the CLI reported."""
+        if not self.calibrate or not backend or not text or exact_tokens <= 0:
+            return
+        x = self.features(text)
+        norm = sum(n * n for n in x)
+        if not norm:
+            return
+        with self._lock:
+            ratios = dict(self._ratios_for(backend))
+            text_estimate = sum(n * ratios[s] for s, n in zip(SCRIPTS, x))
+            target = float(exact_tokens)
+            if with_overhead:
+                overhead = self._overhead.get(backend, 0.0)
+                residual = max(0.0, target - text_estimate)
+                self._overhead[backend] = (1 - OVERHEAD_ALPHA) * overhead + OVERHEAD_ALPHA * residual
+                target = max(target - self._overhead[backend], 0.0)
+            error = target - text_estimate
+            low, high = RATIO_BOUNDS
+            for s, n in zip(SCRIPTS, x):
+                if n:
+                    ratios[s] = min(high, max(low, ratios[s] + LEARNING_RATE * error * n / norm))
+            self._ratios[backend] = ratios
+            self._samples[backend] = self._samples.get(backend, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "backends": {
+                    backend: {
+                        "ratios": {s: round(v, 4) for s, v in self._ratios[backend].items()},
+                        "overhead": round(self._overhead.get(backend, 0.0), 1),
+                        "samples": self._samples.get(backend, 0),
+                    }
+                    for backend in self._ratios
+                },
+            }
+
+    def _load(self) -> None:
+        if self.state_path is None:
+            return
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if state.get("kind") != self.kind:
+            return  # ratios of another base counter do not transfer
+        for backend, item in (state.get("backends") or {}).items():
+            ratios = item.get("ratios") or {}
+            if all(isinstance(ratios.get(s), (int, float)) for s in SCRIPTS):
+                self._ratios[backend] = {s: float(ratios[s]) for s in SCRIPTS}
+                self._overhead[backend] = float(item.get("overhead") or 0.0)
+                self._samples[backend] = int(item.get("samples") or 0)
+
+    def save(self) -> None:
+        if self.state_path is None or not self.calibrate or not self._samples:
+            return
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+            tmp.write_text(json.dumps(self.snapshot(), ensure_ascii=False, indent=2), encoding="utf-8")
+            tmp.replace(self.state_path)
+        except OSError:
+            pass
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Bounded record of CLI calls with running aggregates.
+
+``TokenUsage`` used to keep every call in a list and dump all of it into
+``token_usage.json`` and each ``token_warning`` status write.  The ledger
+keeps only the most recent ``recent`` calls in a ring buffer; everything
+else lives in fixed-size aggregates per role, per task (exchange), per
+backend and per credential profile: call, error and token counts, plus latency and token histograms
+with fixed buckets.  Serializing a ledger therefore costs the same after
+ten calls as after ten thousand.
+
+Calls that report prompt-cache usage (structured output) also count
+towards the cache hit rate: cached input tokens over the input tokens of
+those calls.  It is kept per group and for the whole run
+(``prompt_cache``), next to the number of distinct stable prompt prefixes.
+
+The ledger has no lock of its own; ``TokenUsage`` records into it and
+serializes it under its lock.
+"""
+from __future__ import annotations
+
+import bisect
+from collections import deque
+
+RECENT_CALLS = 200
+# Upper bucket bounds; the last bucket counts everything above.
+LATENCY_BUCKETS_SEC = (1, 2, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144)
+
+
+class Histogram:
+    """Fixed-bucket counts with sum and max."""
+
+    __slots__ = ("bounds", "counts", "total", "peak")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.peak = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.peak = max(self.peak, value)
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-quantile, capped at the max seen."""
+        n = sum(self.counts)
+        if not n:
+            return None
+        rank = q * n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(float(self.bounds[i]), self.peak) if i < len(self.bounds) else self.peak
+        return self.peak
+
+    def to_dict(self) -> dict:
+        n = sum(self.counts)
+        return {
+            "le": list(self.bounds),
+            "counts": list(self.counts),
+            "mean": round(self.total / n, 2) if n else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.peak, 2),
+        }
+
+
+class Aggregate:
+    """Running totals of one role, task or backend."""
+
+    __slots__ = ("calls", "errors", "exact", "cancelled", "input", "output", "cache_read", "cache_write", "cache_input", "latency", "tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.exact = 0
+        # Calls killed mid-run (race losers); their usage is counted too.
+        self.cancelled = 0
+        self.input = 0
+        self.output = 0
+        self.cache_read = 0
+        self.cache_write = 0
+        # Input tokens of the calls that report cache usage.
+        self.cache_input = 0
+        self.latency = Histogram(LATENCY_BUCKETS_SEC)
+        self.tokens = Histogram(TOKEN_BUCKETS)
+
+    def add(self, entry: dict) -> None:
+        self.calls += 1
+        self.input += entry.get("input", 0)
+        self.output += entry.get("output", 0)
+        self.cache_read += entry.get("cache_read_tokens", 0)
+        self.cache_write += entry.get("cache_write_tokens", 0)
+        if "cache_read_tokens" in entry:
+            self.cache_input += entry.get("input", 0)
+        if entry.get("tokens_exact"):
+            self.exact += 1
+        if entry.get("cancelled"):
+            self.cancelled += 1
+        if entry.get("returncode"):
+            self.errors += 1
+        self.tokens.observe(entry.get("combined", 0))
+        if entry.get("latency_sec") is not None:
+            self.latency.observe(entry["latency_sec"])
+
+    def cache_hit_rate(self) -> float | None:
+        return round(self.cache_read / self.cache_input, 4) if self.cache_input else None
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "exact_calls": self.exact,
+            "cancelled_calls": self.cancelled,
+            "input": self.input,
+            "output": self.output,
+            "cache_read": self.cache_read,
+            "cache_write": self.cache_write,
+            "cache_hit_rate": self.cache_hit_rate(),
+            "latency_sec": self.latency.to_dict(),
+            "tokens": self.tokens.to_dict(),
+        }
+
+
+class TokenLedger:
+    """Ring buffer of recent calls plus per-role / per-task / per-backend aggregates."""
+
+    DIMENSIONS = (
+        ("role", "by_role"),
+        ("exchange", "by_task"),
+        ("backend", "by_backend"),
+        ("credential", "by_credential"),
+    )
+
+    def __init__(self, recent: int = RECENT_CALLS):
+        self.recent: deque[dict] = deque(maxlen=max(1, int(recent)))
+        self.groups: dict[str, dict[str, Aggregate]] = {name: {} for _, name in self.DIMENSIONS}
+        self.overall = Aggregate()
+        # Stable prompt prefixes seen (prompt_layout.prefix_id), bounded like the ring.
+        self.prefixes: dict[str, int] = {}
+
+    def record(self, entry: dict) -> None:
+        self.recent.append(entry)
+        self.overall.add(entry)
+        prefix = entry.get("prompt_prefix")
+        if prefix and (prefix in self.prefixes or len(self.prefixes) < self.recent.maxlen):
+            self.prefixes[prefix] = self.prefixes.get(prefix, 0) + 1
+        for key, name in self.DIMENSIONS:
+            value = entry.get(key)
+            if not value:
+                continue
+            group = self.groups[name]
+            if value not in group:
+                group[value] = Aggregate()
+            group[value].add(entry)
+
+    def to_dict(self) -> dict:
+        shared = sum(count for count in self.prefixes.values() if count > 1)
+        return {
+            **{
+                name: {value: agg.to_dict() for value, agg in group.items()}
+                for name, group in self.groups.items()
+            },
+            "prompt_cache": {
+                "hit_rate": self.overall.cache_hit_rate(),
+                "cache_read": self.overall.cache_read,
+                "cache_write": self.overall.cache_write,
+                "reporting_input": self.overall.cache_input,
+                "prefixes": len(self.prefixes),
+                "calls_on_shared_prefix": shared,
+            },
+        }
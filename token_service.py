@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Token threshold handling off the worker threads.
+
+``TokenUsage.add_usage`` runs in whichever worker thread finished a call.
+Threshold handling used to run right there: the compact handler probes
+and compacts every configured CLI, which is several 30-second
+subprocesses, so a performer could stall for minutes.  With a
+``TokenService`` the worker only submits the level it crossed and goes on:
+
+- events are coalesced: a handler runs once for any number of submits that
+  arrive while it is busy or rate-limited (``min_interval_sec`` per level);
+- handlers run on the service thread, one at a time;
+- ``state`` is a plain attribute ("ok" / "warning" / "compact") that
+  workers can read for free;
+- ``ProbeCache`` memoizes status probes for ``probe_ttl_sec``, and
+  concurrent callers of the same probe share a single call.  The web
+  server uses it for ``/api/token-status`` too.
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from typing import Callable
+
+OK = "ok"
+WARNING = "warning"
+COMPACT = "compact"
+LEVELS = (OK, WARNING, COMPACT)
+
+
+class ProbeCache:
+    """TTL cache with one call in flight per key."""
+
+    def __init__(self, ttl_sec: float = 300.0):
+        self.ttl_sec = float(ttl_sec)
+        self._values: dict[object, tuple[float, object]] = {}
+        self._inflight: dict[object, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, fn: Callable[[], object], ttl_sec: float | None = None):
+        """Cached ``fn()`` for ``key``; callers arriving mid-call wait for its result."""
+        with self._lock:
+            hit = self._values.get(key)
+            if hit is not None and hit[0] > time.monotonic():
+                return hit[1]
+            gate = self._inflight.setdefault(key, threading.Lock())
+        with gate:
+            with self._lock:
+                hit = self._values.get(key)
+                if hit is not None and hit[0] > time.monotonic():
+                    return hit[1]
+            value = fn()
+            ttl = self.ttl_sec if ttl_sec is None else ttl_sec
+            with self._lock:
+                self._values[key] = (time.monotonic() + ttl, value)
+            return value
+
+    def invalidate(self, key=None) -> None:
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+
+class TokenService:
+    """Runs token threshold handlers on one background thread."""
+
+    def __init__(self, min_interval_sec: float = 10.0, probe_ttl_sec: float = 300.0, verbose: bool = False):
+        self.min_interval_sec = float(min_interval_sec)
+        self.probes = ProbeCache(probe_ttl_sec)
+        self.verbose = verbose
+        # Read by workers without locking; only the string reference changes.
+        self.state = OK
+        self._handlers: dict[str, Callable] = {}
+        self._pending: dict[str, object] = {}
+        self._last_run: dict[str, float] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def from_config(cls, token_config: dict, verbose: bool = False) -> "TokenService | None":
+        if not token_config.get("background", True):
+            return None
+        return cls(
+            min_interval_sec=token_config.get("min_interval_sec", 10.0),
+            probe_ttl_sec=token_config.get("probe_ttl_sec", 300.0),
+            verbose=verbose,
+        ).start()
+
+    def start(self) -> "TokenService":
+        self._thread = threading.Thread(target=self._run, name="token-service", daemon=True)
+        self._thread.start()
+        return self
+
+    def on(self, level: str, handler: Callable) -> None:
+        with self._cond:
+            self._handlers[level] = handler
+
+    def submit(self, level: str, payload=None) -> None:
+        """Record the level just crossed; never blocks on a handler."""
+        self.state = level
+        if level == OK:
+            return
+        with self._cond:
+            if level in self._handlers:
+                self._pending[level] = payload
+                self._cond.notify()
+
+    def probe(self, key, fn: Callable[[], object]):
+        return self.probes.get(key, fn)
+
+    def _next_due(self) -> tuple[str | None, float]:
+        """Most severe pending level whose interval has passed, else the wait until one is."""
+        now = time.monotonic()
+        wait = None
+        for level in (COMPACT, WARNING):
+            if level not in self._pending:
+                continue
+            ready_at = self._last_run.get(level, float("-inf")) + self.min_interval_sec
+            if ready_at <= now:
+                return level, 0.0
+            wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        return None, wait if wait is not None else -1.0
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    level, wait = self._next_due()
+                    if level is not None:
+                        break
+                    self._cond.wait(None if wait < 0 else wait)
+                payload = self._pending.pop(level)
+                handler = self._handlers.get(level)
+                self._last_run[level] = time.monotonic()
+            try:
+                handler(payload)
+            except Exception as exc:
+                print(f"[TokenService] {level} ハンドラでエラー: {exc}", file=sys.stderr)
+
+    def close(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
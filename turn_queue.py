@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""Durable turn queue shared between a coordinating run and remote workers.
+
+In distributed mode the coordinating ``run()`` does not spawn performer /
+concertmaster CLIs itself.  ``run_external`` submits each turn to a queue on
+shared storage and waits for the result, while ``orchestrator.py worker``
+processes on other hosts claim turns, run the CLI locally and write the
+result back.
+
+Two backends are provided; both only need a filesystem visible to every
+host:
+
+- ``sqlite:///path/to/queue.db``  single SQLite file (needs working POSIX
+  locks on the shared filesystem)
+- ``file:///path/to/queue_dir``   one JSON file per turn, claimed with an
+  atomic ``rename`` (safe on NFS/SMB without lock support)
+
+Claims carry a lease.  A worker renews it while the CLI is running; if the
+worker dies the lease expires and the turn goes back to the queue.
+
+A turn cancelled while still queued is deleted outright.  One a worker has
+already claimed is only marked, so its result is thrown away; the worker's
+``complete`` acknowledges the mark and removes it.  ``cleanup`` (run on
+every ``claim``) removes the marks of cancelled turns whose worker died.
+"""
+from __future__ import annotations
+
+import abc
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+DEFAULT_LEASE_SEC = 900
+# A cancel mark with no turn left is kept this long (covers a claim in flight).
+CANCEL_MARK_GRACE_SEC = 60
+
+
+class TurnQueue(abc.ABC):
+    """Interface shared by the queue backends."""
+
+    @abc.abstractmethod
+    def submit(self, role: str, payload: dict) -> str: ...
+
+    @abc.abstractmethod
+    def claim(self, worker_id: str, roles: list[str] | None = None, lease_sec: float = DEFAULT_LEASE_SEC) -> dict | None:
+        """Claim the oldest queued turn. Returns {"id", "role", "payload"} or None."""
+
+    @abc.abstractmethod
+    def renew(self, turn_id: str, worker_id: str, lease_sec: float = DEFAULT_LEASE_SEC) -> bool: ...
+
+    @abc.abstractmethod
+    def complete(self, turn_id: str, worker_id: str, result: dict) -> None:
+        """Store the result, or acknowledge the cancel mark of a cancelled turn."""
+
+    @abc.abstractmethod
+    def fetch_result(self, turn_id: str) -> dict | None: ...
+
+    def wait_result(self, turn_id: str, timeout: float | None = None, poll_sec: float = 0.5) -> dict | None:
+        """Poll until the turn has a result. Returns None on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            result = self.fetch_result(turn_id)
+            if result is not None:
+                return result
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_sec)
+
+    @abc.abstractmethod
+    def cancel(self, turn_id: str) -> None: ...
+
+    @abc.abstractmethod
+    def discard(self, turn_id: str) -> None:
+        """Drop a turn once the coordinator has consumed its result."""
+
+    @abc.abstractmethod
+    def cleanup(self) -> None:
+        """Drop cancelled turns that no live worker will acknowledge."""
+
+
+class SqliteTurnQueue(TurnQueue):
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._tx() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " id TEXT PRIMARY KEY, role TEXT, payload TEXT, status TEXT,"
+                " worker TEXT, lease_until REAL, result TEXT, created_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS turns_status ON turns(status, created_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _tx(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def submit(self, role: str, payload: dict) -> str:
+        turn_id = uuid.uuid4().hex
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT INTO turns (id, role, payload, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (turn_id, role, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+        return turn_id
+
+    def claim(self, worker_id: str, roles: list[str] | None = None, lease_sec: float = DEFAULT_LEASE_SEC) -> dict | None:
+        now = time.time()
+        with self._tx() as conn:
+            self._cleanup(conn, now)
+            # Expired leases go back to the queue first.
+            conn.execute(
+                "UPDATE turns SET status = 'queued', worker = NULL WHERE status = 'claimed' AND lease_until < ?",
+                (now,),
+            )
+            query = "SELECT id, role, payload FROM turns WHERE status = 'queued'"
+            params: list = []
+            if roles:
+                query += " AND role IN (%s)" % ",".join("?" * len(roles))
+                params.extend(roles)
+            row = conn.execute(query + " ORDER BY created_at LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE turns SET status = 'claimed', worker = ?, lease_until = ? WHERE id = ?",
+                (worker_id, now + lease_sec, row[0]),
+            )
+        return {"id": row[0], "role": row[1], "payload": json.loads(row[2])}
+
+    def renew(self, turn_id: str, worker_id: str, lease_sec: float = DEFAULT_LEASE_SEC) -> bool:
+        with self._tx() as conn:
+            cur = conn.execute(
+                "UPDATE turns SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'claimed'",
+                (time.time() + lease_sec, turn_id, worker_id),
+            )
+            return cur.rowcount > 0
+
+    def complete(self, turn_id: str, worker_id: str, result: dict) -> None:
+        with self._tx() as conn:
+            conn.execute("DELETE FROM turns WHERE id = ? AND status = 'cancelled'", (turn_id,))
+            conn.execute(
+                "UPDATE turns SET status = 'done', result = ? WHERE id = ?",
+                (json.dumps(result, ensure_ascii=False), turn_id),
+            )
+
+    def fetch_result(self, turn_id: str) -> dict | None:
+        # fetchall() finalizes the statement so no read lock outlives the poll.
+        rows = self._conn().execute("SELECT status, result FROM turns WHERE id = ?", (turn_id,)).fetchall()
+        if not rows or rows[0][0] != "done" or rows[0][1] is None:
+            return None
+        return json.loads(rows[0][1])
+
+    def cancel(self, turn_id: str) -> None:
+        with self._tx() as conn:
+            # Nobody will ask for the result; only a running worker still needs to see the mark.
+            conn.execute("DELETE FROM turns WHERE id = ? AND status IN ('queued', 'done')", (turn_id,))
+            conn.execute("UPDATE turns SET status = 'cancelled' WHERE id = ? AND status = 'claimed'", (turn_id,))
+
+    def discard(self, turn_id: str) -> None:
+        with self._tx() as conn:
+            conn.execute("DELETE FROM turns WHERE id = ?", (turn_id,))
+
+    @staticmethod
+    def _cleanup(conn: sqlite3.Connection, now: float) -> None:
+        # A cancelled turn's lease is no longer renewed; once it lapses the worker is gone or done.
+        conn.execute("DELETE FROM turns WHERE status = 'cancelled' AND lease_until < ?", (now,))
+
+    def cleanup(self) -> None:
+        with self._tx() as conn:
+            self._cleanup(conn, time.time())
+
+
+class FileTurnQueue(TurnQueue):
+    """Directory queue: queued/, claimed/, results/ with one JSON file per turn."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.queued = self.root / "queued"
+        self.claimed = self.root / "claimed"
+        self.results = self.root / "results"
+        for d in (self.queued, self.claimed, self.results):
+            d.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _write_atomic(path: Path, data: dict) -> None:
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:6]}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    def submit(self, role: str, payload: dict) -> str:
+        # Time-prefixed ids keep directory listings in FIFO order.
+        turn_id = f"{time.time():017.6f}_{uuid.uuid4().hex[:8]}"
+        self._write_atomic(self.queued / f"{turn_id}.json", {"id": turn_id, "role": role, "payload": payload})
+        return turn_id
+
+    def _requeue_expired(self) -> None:
+        now = time.time()
+        for path in self.claimed.glob("*.json"):
+            try:
+                if path.stat().st_mtime < now:
+                    turn_id = path.name.split("@", 1)[0]
+                    path.rename(self.queued / f"{turn_id}.json")
+            except OSError:
+                continue
+
+    def claim(self, worker_id: str, roles: list[str] | None = None, lease_sec: float = DEFAULT_LEASE_SEC) -> dict | None:
+        self._requeue_expired()
+        self.cleanup()
+        for path in sorted(self.queued.glob("*.json")):
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            if roles and data.get("role") not in roles:
+                continue
+            target = self.claimed / f"{data['id']}@{worker_id}.json"
+            try:
+                path.rename(target)
+            except OSError:
+                continue  # another worker won the rename
+            # The claimed file's mtime doubles as the lease deadline.
+            deadline = time.time() + lease_sec
+            os.utime(target, (deadline, deadline))
+            return data
+        return None
+
+    def renew(self, turn_id: str, worker_id: str, lease_sec: float = DEFAULT_LEASE_SEC) -> bool:
+        target = self.claimed / f"{turn_id}@{worker_id}.json"
+        deadline = time.time() + lease_sec
+        try:
+            os.utime(target, (deadline, deadline))
+            return True
+        except OSError:
+            return False
+
+    def complete(self, turn_id: str, worker_id: str, result: dict) -> None:
+        try:
+            (self.results / f"{turn_id}.cancelled").unlink()
+        except FileNotFoundError:
+            self._write_atomic(self.results / f"{turn_id}.json", result)
+        with contextlib.suppress(OSError):
+            (self.claimed / f"{turn_id}@{worker_id}.json").unlink()
+
+    def fetch_result(self, turn_id: str) -> dict | None:
+        path = self.results / f"{turn_id}.json"
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def cancel(self, turn_id: str) -> None:
+        try:
+            (self.queued / f"{turn_id}.json").unlink()
+            return  # never claimed: nobody to tell
+        except OSError:
+            pass
+        (self.results / f"{turn_id}.cancelled").touch()
+        # The worker may have finished just before the mark.
+        self.discard(turn_id)
+
+    def discard(self, turn_id: str) -> None:
+        with contextlib.suppress(OSError):
+            (self.results / f"{turn_id}.json").unlink()
+
+    def _live(self, turn_id: str) -> bool:
+        return (self.queued / f"{turn_id}.json").exists() or any(self.claimed.glob(f"{turn_id}@*.json"))
+
+    def cleanup(self) -> None:
+        stale = time.time() - CANCEL_MARK_GRACE_SEC
+        for mark in self.results.glob("*.cancelled"):
+            try:
+                if mark.stat().st_mtime < stale and not self._live(mark.stem):
+                    mark.unlink()
+            except OSError:
+                continue
+
+
+def open_queue(url: str) -> TurnQueue:
+    """Open a queue from ``sqlite:///path``, ``file:///dir`` or a bare path."""
+    if url.startswith("sqlite://"):
+        return SqliteTurnQueue(Path(url[len("sqlite://"):]).expanduser())
+    if url.startswith("file://"):
+        return FileTurnQueue(Path(url[len("file://"):]).expanduser())
+    path = Path(url).expanduser()
+    if path.suffix in (".db", ".sqlite", ".sqlite3"):
+        return SqliteTurnQueue(path)
+    return FileTurnQueue(path)
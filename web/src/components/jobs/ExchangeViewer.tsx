@@ -1,8 +1,8 @@
 import { useEffect, useMemo, useState } from 'react';
 import { MessageSquare, ChevronDown, ChevronRight, AlertCircle } from 'lucide-react';
-import { fetchExchange, fetchExchanges, fetchScore } from '../../services/api';
+import { fetchExchange, fetchExchangeArchive, fetchExchanges, fetchScore } from '../../services/api';
 import { REFRESH_INTERVAL } from '../../constants';
-import type { ExchangeDetail, ExchangeSummary, Score } from '../../types';
+import type { ExchangeDetail, ExchangeHistoryItem, ExchangeSummary, Score } from '../../types';
 
 interface ExchangeViewerProps {
   jobId: string;
@@ -21,6 +21,7 @@ function stageLabel(status?: string): string {
   if (status === 'waiting_for_concertmaster') return 'コンマス待ち';
   if (status === 'waiting_for_performer') return '演奏者待ち';
   if (status === 'done') return '完了';
+  if (status === 'budget_exhausted') return '予算切れ';
   return status;
 }
 
@@ -29,6 +30,8 @@ export function ExchangeViewer({ jobId }: ExchangeViewerProps) {
   const [exchanges, setExchanges] = useState<ExchangeSummary[]>([]);
   const [expanded, setExpanded] = useState<string | null>(null);
   const [details, setDetails] = useState<Record<string, ExchangeDetail | null>>({});
+  // Archived segments loaded so far per exchange, oldest first (rolled-over history).
+  const [older, setOlder] = useState<Record<string, { seq: number; history: ExchangeHistoryItem[] }[]>>({});
   const [error, setError] = useState<string | null>(null);
 
   useEffect(() => {
@@ -75,6 +78,19 @@ export function ExchangeViewer({ jobId }: ExchangeViewerProps) {
     return [...exchanges].sort((a, b) => (a.id || '').localeCompare(b.id || '', undefined, { numeric: true }));
   }, [exchanges]);
 
+  const handleLoadOlder = async (exchangeId: string, detail: ExchangeDetail) => {
+    const loaded = new Set((older[exchangeId] || []).map((page) => page.seq));
+    // Newest segment not loaded yet, so segments sealed while viewing fill in too.
+    const next = [...(detail.archive || [])].reverse().find((seg) => !loaded.has(seg.seq));
+    if (!next) return;
+    const page = await fetchExchangeArchive(jobId, exchangeId, next.seq);
+    if (!page) return;
+    setOlder((prev) => ({
+      ...prev,
+      [exchangeId]: [...(prev[exchangeId] || []), { seq: next.seq, history: page.history }].sort((a, b) => a.seq - b.seq),
+    }));
+  };
+
   const handleToggle = async (exchangeId: string) => {
     if (expanded === exchangeId) {
       setExpanded(null);
@@ -141,7 +157,15 @@ export function ExchangeViewer({ jobId }: ExchangeViewerProps) {
                   </button>
                   {expanded === ex.id && detail && (
                     <div className="px-4 pb-4 space-y-3">
-                      {(detail.history || []).map((item, idx) => (
+                      {(detail.archive || []).length > (older[ex.id] || []).length && (
+                        <button
+                          onClick={() => handleLoadOlder(ex.id, detail)}
+                          className="text-xs text-slate-400 hover:text-slate-200"
+                        >
+                          古い履歴を読み込む（残り {(detail.archive || []).length - (older[ex.id] || []).length} 区間）
+                        </button>
+                      )}
+                      {[...(older[ex.id] || []).flatMap((page) => page.history), ...(detail.history || [])].map((item, idx) => (
                         <div key={idx} className="text-xs text-slate-300 whitespace-pre-wrap">
                           <span className="text-slate-500 mr-2">
                             {item.role === 'concertmaster' ? 'コンマス' : item.role === 'performer' ? '演奏者' : item.role}
@@ -1,5 +1,7 @@
-import { useState } from 'react';
-import { Send, Loader2, CheckCircle, AlertCircle } from 'lucide-react';
+import { useEffect, useState } from 'react';
+import { Send, Loader2, CheckCircle, AlertCircle, Gauge } from 'lucide-react';
+import { fetchEstimate } from '../../services/api';
+import type { RunEstimate } from '../../types';
 
 interface SubmitFormProps {
   onSubmit: (task: string, expertReview?: boolean) => Promise<{ id: string }>;
@@ -11,10 +13,18 @@ export function SubmitForm({ onSubmit }: SubmitFormProps) {
   const [submitting, setSubmitting] = useState(false);
   const [success, setSuccess] = useState<string | null>(null);
   const [error, setError] = useState<string | null>(null);
+  const [estimate, setEstimate] = useState<RunEstimate | null>(null);
+
+  useEffect(() => {
+    fetchEstimate().then(setEstimate);
+  }, []);
+
+  const blocked = (estimate?.blocked.length ?? 0) > 0;
+  const warned = (estimate?.warnings?.length ?? 0) > 0;
 
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault();
-    if (!task.trim() || submitting) return;
+    if (!task.trim() || submitting || blocked) return;
 
     setSubmitting(true);
     setError(null);
@@ -74,6 +84,48 @@ export function SubmitForm({ onSubmit }: SubmitFormProps) {
         </label>
       </div>
 
+      {/* Estimate from past runs */}
+      {estimate && estimate.samples > 0 && (
+        <div
+          className={`glass-light rounded-xl p-4 ${
+            blocked || warned ? 'border border-amber-500/30 bg-amber-500/5' : ''
+          }`}
+        >
+          <div className="flex items-center gap-2 mb-2">
+            <Gauge size={16} className={blocked || warned ? 'text-amber-400' : 'text-slate-400'} />
+            <span className="text-sm font-medium text-slate-300">見積もり</span>
+            <span className="text-xs text-slate-500">過去 {estimate.samples} 回の実行から</span>
+          </div>
+          <div className="grid grid-cols-3 gap-2 text-xs text-slate-400">
+            <div>
+              トークン
+              <p className="text-sm text-white">{formatRange(estimate.tokens, estimate.tokens_range)}</p>
+            </div>
+            <div>
+              所要時間
+              <p className="text-sm text-white">{formatRange(estimate.wall_sec, estimate.wall_sec_range, ' 秒')}</p>
+            </div>
+            <div>
+              最大同時実行数
+              <p className="text-sm text-white">{estimate.peak_concurrency ?? '-'}</p>
+            </div>
+          </div>
+          {estimate.cost_usd !== undefined && (
+            <p className="mt-2 text-xs text-slate-400">費用: ${estimate.cost_usd.toFixed(2)}</p>
+          )}
+          {estimate.blocked.map((reason) => (
+            <p key={reason} className="mt-2 text-xs text-amber-300">
+              {reason}。上限（config.json の estimate）を変更するまで投入できません。
+            </p>
+          ))}
+          {estimate.warnings?.map((reason) => (
+            <p key={reason} className="mt-2 text-xs text-amber-300">
+              {reason}（過去の実行の中央値による目安です）。
+            </p>
+          ))}
+        </div>
+      )}
+
       {/* Success message */}
       {success && (
         <div className="glass-light rounded-xl p-4 border border-emerald-500/30 bg-emerald-500/5 animate-fade-in">
@@ -97,7 +149,7 @@ export function SubmitForm({ onSubmit }: SubmitFormProps) {
       {/* Submit button */}
       <button
         type="submit"
-        disabled={!task.trim() || submitting}
+        disabled={!task.trim() || submitting || blocked}
         className="w-full glass-light rounded-xl py-4 px-6 font-semibold text-white flex items-center justify-center gap-3 hover:bg-slate-700/50 disabled:opacity-50 disabled:cursor-not-allowed transition-all duration-200 group"
       >
         {submitting ? (
@@ -115,3 +167,9 @@ export function SubmitForm({ onSubmit }: SubmitFormProps) {
     </form>
   );
 }
+
+function formatRange(value: number | null, range?: [number, number] | null, unit = ''): string {
+  if (value === null) return '-';
+  const text = `${value.toLocaleString()}${unit}`;
+  return range ? `${text}（${range[0].toLocaleString()}〜${range[1].toLocaleString()}）` : text;
+}
@@ -1,5 +1,5 @@
 import { API_CONFIG } from '../constants';
-import type { Job, Score, LogFile, ExchangeSummary, ExchangeDetail, OrchestratorConfig, TokenStatusResponse } from '../types';
+import type { Job, Score, LogFile, ExchangeSummary, ExchangeDetail, ExchangeArchivePage, OrchestratorConfig, TokenStatusResponse, RunEstimate } from '../types';
 
 function getApiUrl(path: string): string {
   const base = API_CONFIG.baseUrl.replace(/\/$/, '');
@@ -98,6 +98,18 @@ export async function fetchExchange(id: string, exchangeId: string): Promise<Exc
   }
 }
 
+export async function fetchExchangeArchive(
+  id: string,
+  exchangeId: string,
+  segment: number
+): Promise<ExchangeArchivePage | null> {
+  try {
+    return await apiFetch<ExchangeArchivePage>(`/api/jobs/${id}/exchanges/${exchangeId}/history?segment=${segment}`);
+  } catch {
+    return null;
+  }
+}
+
 export async function postExchangeReply(
   id: string,
   exchangeId: string,
@@ -136,3 +148,11 @@ export async function killJob(id: string): Promise<{ ok: boolean; message?: stri
 export async function fetchTokenStatus(): Promise<TokenStatusResponse> {
   return apiFetch<TokenStatusResponse>('/api/token-status');
 }
+
+export async function fetchEstimate(): Promise<RunEstimate | null> {
+  try {
+    return await apiFetch<RunEstimate>('/api/estimate');
+  } catch {
+    return null;
+  }
+}
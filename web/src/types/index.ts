@@ -37,6 +37,23 @@ export interface Job {
   last_log_update?: string;
   seconds_since_log_update?: number;
   stalled?: boolean;
+  estimate?: RunEstimate;
+}
+
+// Pre-run estimate from past runs (run_estimator.py)
+export interface RunEstimate {
+  samples: number;
+  basis: 'score' | 'history' | 'none';
+  tasks?: number;
+  tokens: number | null;
+  tokens_range?: [number, number] | null;
+  wall_sec: number | null;
+  wall_sec_range?: [number, number] | null;
+  peak_concurrency: number | null;
+  cost_usd?: number;
+  limits: { max_tokens: number; max_wall_sec: number };
+  blocked: string[];
+  warnings?: string[];
 }
 
 export interface Performer {
@@ -75,11 +92,28 @@ export interface ExchangeSummary {
   pending?: ExchangePending;
 }
 
+export interface ExchangeSegment {
+  seq: number;
+  file: string;
+  start: number;
+  count: number;
+  bytes?: number;
+  first_at?: string;
+  last_at?: string;
+}
+
+export interface ExchangeArchivePage {
+  segment: ExchangeSegment;
+  history: ExchangeHistoryItem[];
+}
+
 export interface ExchangeDetail {
   performer?: Performer;
   status?: string;
   turn?: number;
   history?: ExchangeHistoryItem[];
+  history_count?: number;
+  archive?: ExchangeSegment[];
   pending?: ExchangePending;
   updated_at?: string;
 }
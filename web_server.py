@@ -7,6 +7,7 @@ import json
 import subprocess
 import sys
 import threading
+import time
 import uuid
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
@@ -26,6 +27,8 @@ API_TOKEN: str | None = None
 DEFAULT_STALL_TIMEOUT_SEC = 120
 # Default stall-to-error timeout in seconds (stalled for this long = error)
 DEFAULT_STALL_ERROR_TIMEOUT_SEC = 600
+# How long a job gets to stop after a kill request on its control socket
+KILL_GRACE_SEC = 10
 
 _MIME_MAP = {
     ".html": "text/html; charset=utf-8",
@@ -46,10 +49,15 @@ def guess_mime(path: Path) -> str:
     return _MIME_MAP.get(path.suffix.lower(), "application/octet-stream")
 
 
-try:
-    import yaml
-except Exception:
-    yaml = None
+import artifact_codec
+import control_plane
+from exchange_log import LOG_SUFFIX, ExchangeLog, read_summary
+from quota_telemetry import get_cli_token_status
+from run_estimator import estimate_run
+from token_service import ProbeCache
+
+# ccusage and the Codex session scan take seconds; polling clients share one result.
+TOKEN_STATUS_CACHE = ProbeCache(60)
 
 _jobs_lock = threading.Lock()
 _active_jobs: dict[str, dict] = {}
@@ -67,11 +75,12 @@ def safe_json_load(path: Path) -> dict:
 
 
 def safe_yaml_load(path: Path) -> dict:
-    if yaml is None:
-        return {}
+    # Format is detected per file, so YAML and JSON artifacts both load.
     try:
-        return yaml.safe_load(path.read_text(encoding="utf-8")) or {}
-    except Exception:
+        return artifact_codec.load(path)
+    except Exception as exc:
+        # A broken artifact must not take the API down, but it should not pass for an empty one.
+        print(f"[Web] {path} を読み込めません: {exc}", file=sys.stderr)
         return {}
 
 
@@ -82,291 +91,6 @@ def read_config() -> dict:
     return safe_json_load(CONFIG_PATH)
 
 
-def get_cli_token_status() -> dict:
-    """Get token status from Claude and Codex CLIs.
-
-    For Claude Code, uses ccusage to get 5-hour block data and calculates usage percentage.
-    For Codex, reads rate limits from ~/.codex/sessions/**/*.jsonl
-
-    The 5-hour block percentage is calculated relative to historical max usage,
-    which provides a practical estimate of how close to the rate limit you are.
-    """
-    import os
-
-    result = {
-        "claude": {
-            "available": False,
-            "raw_output": "",
-            "error": None,
-            "used_percentage": None,
-            "short_term_percentage": None,
-            "weekly_percentage": None,
-            "rate_limit_5h": None,
-            "weekly_token_limit": None,
-            "daily_tokens": None,
-            "weekly_tokens": None,
-            "total_tokens": None,
-        },
-        "codex": {
-            "available": False,
-            "raw_output": "",
-            "error": None,
-            "used_percentage": None,
-            "short_term_percentage": None,
-            "weekly_percentage": None,
-            "rate_limit_5h": None,
-            "weekly_token_limit": None,
-        },
-    }
-
-    # Check Claude Code token usage using ccusage
-    try:
-        # Get all blocks to find historical max and active block
-        proc = subprocess.run(
-            ["npx", "ccusage@latest", "blocks", "--json"],
-            text=True,
-            capture_output=True,
-            timeout=30,
-            env=os.environ.copy(),
-        )
-        if proc.returncode == 0 and proc.stdout:
-            blocks_data = json.loads(proc.stdout)
-            blocks = blocks_data.get("blocks", [])
-
-            if blocks:
-                result["claude"]["available"] = True
-
-                # Find active block and historical max
-                active_block = None
-                max_tokens = 0
-                for block in blocks:
-                    if block.get("isGap"):
-                        continue
-                    total = block.get("totalTokens", 0)
-                    if total > max_tokens:
-                        max_tokens = total
-                    if block.get("isActive"):
-                        active_block = block
-
-                if active_block:
-                    current_tokens = active_block.get("totalTokens", 0)
-                    result["claude"]["daily_tokens"] = current_tokens
-
-                    # Calculate percentage relative to historical max
-                    if max_tokens > 0:
-                        pct = round((current_tokens / max_tokens) * 100, 1)
-                        result["claude"]["short_term_percentage"] = pct
-                        result["claude"]["used_percentage"] = pct
-
-                    # Get block end time for reset info
-                    end_time_str = active_block.get("endTime", "")
-                    reset_info = ""
-                    if end_time_str:
-                        try:
-                            end_time = dt.datetime.fromisoformat(end_time_str.replace("Z", "+00:00"))
-                            local_end = end_time.astimezone()
-                            reset_info = f" (リセット: {local_end.strftime('%H:%M')})"
-                        except (ValueError, TypeError):
-                            pass
-
-                    if max_tokens > 0:
-                        pct = round((current_tokens / max_tokens) * 100, 1)
-                        result["claude"]["rate_limit_5h"] = f"{pct}%{reset_info}"
-
-                    # Build raw output
-                    lines = []
-                    lines.append(f"5時間ブロック: {current_tokens:,} トークン")
-                    if max_tokens > 0:
-                        lines.append(f"過去最大: {max_tokens:,} トークン")
-                    projection = active_block.get("projection", {})
-                    if projection.get("totalTokens"):
-                        lines.append(f"予測: {projection['totalTokens']:,} トークン")
-                    result["claude"]["raw_output"] = "\n".join(lines)
-
-        # Also get weekly data from ccusage
-        proc_daily = subprocess.run(
-            ["npx", "ccusage@latest", "--json"],
-            text=True,
-            capture_output=True,
-            timeout=30,
-            env=os.environ.copy(),
-        )
-        if proc_daily.returncode == 0 and proc_daily.stdout:
-            daily_data = json.loads(proc_daily.stdout)
-            daily_entries = daily_data.get("daily", [])
-
-            # Sum tokens for last 7 days
-            week_ago = (dt.date.today() - dt.timedelta(days=7)).isoformat()
-            weekly_tokens = 0
-            for entry in daily_entries:
-                if entry.get("date", "") >= week_ago:
-                    weekly_tokens += entry.get("totalTokens", 0)
-
-            if weekly_tokens > 0:
-                result["claude"]["weekly_tokens"] = weekly_tokens
-
-                # Calculate total from all daily entries
-                total_tokens = sum(e.get("totalTokens", 0) for e in daily_entries)
-                result["claude"]["total_tokens"] = total_tokens
-
-                # For weekly percentage, use a rough estimate
-                # Claude Pro weekly limit is approximately 50-100M tokens based on usage patterns
-                # We'll use the sum of historical max blocks * 7 as a rough weekly limit
-                if max_tokens > 0:
-                    # Estimate: if you could hit max every 5h block, ~33 blocks/week
-                    estimated_weekly_limit = max_tokens * 33
-                    weekly_pct = round((weekly_tokens / estimated_weekly_limit) * 100, 1)
-                    result["claude"]["weekly_percentage"] = weekly_pct
-                    result["claude"]["weekly_token_limit"] = f"{weekly_pct}% ({weekly_tokens:,} トークン)"
-
-        if not result["claude"]["available"]:
-            # Fallback: check if claude command is available
-            proc = subprocess.run(
-                ["claude", "--version"],
-                text=True,
-                capture_output=True,
-                timeout=10,
-                env=os.environ.copy(),
-            )
-            if proc.returncode == 0:
-                result["claude"]["available"] = True
-                result["claude"]["raw_output"] = "ccusage データなし"
-            else:
-                result["claude"]["error"] = "claude コマンドが見つかりません"
-    except FileNotFoundError:
-        result["claude"]["error"] = "ccusage が見つかりません (npx ccusage@latest)"
-    except json.JSONDecodeError:
-        result["claude"]["error"] = "ccusage の出力を解析できませんでした"
-    except subprocess.TimeoutExpired:
-        result["claude"]["error"] = "タイムアウト"
-    except Exception as e:
-        result["claude"]["error"] = str(e)
-
-    # Check Codex token usage from session files
-    try:
-        codex_sessions_dir = Path.home() / ".codex" / "sessions"
-        if codex_sessions_dir.exists():
-            # Find the most recent session file
-            session_files = list(codex_sessions_dir.glob("**/*.jsonl"))
-            if session_files:
-                # Sort by modification time to get the most recent
-                session_files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-                latest_session = session_files[0]
-
-                # Read the session file and find the last rate_limits info
-                rate_limits = None
-                token_usage = None
-                with open(latest_session, "r", encoding="utf-8") as f:
-                    for line in f:
-                        try:
-                            data = json.loads(line)
-                            if data.get("type") == "event_msg":
-                                payload = data.get("payload", {})
-                                if payload.get("type") == "token_count":
-                                    info = payload.get("info") or {}
-                                    if "rate_limits" in payload:
-                                        rate_limits = payload["rate_limits"]
-                                    if info and "total_token_usage" in info:
-                                        token_usage = info["total_token_usage"]
-                        except json.JSONDecodeError:
-                            continue
-
-                if rate_limits:
-                    result["codex"]["available"] = True
-                    primary = rate_limits.get("primary", {})
-                    secondary = rate_limits.get("secondary", {})
-
-                    # Primary: 5-hour rate limit
-                    primary_pct = primary.get("used_percent")
-                    if primary_pct is not None:
-                        result["codex"]["rate_limit_5h"] = f"{primary_pct}%"
-                        resets_at = primary.get("resets_at")
-                        if resets_at:
-                            reset_time = dt.datetime.fromtimestamp(resets_at)
-                            result["codex"]["rate_limit_5h"] += f" (リセット: {reset_time.strftime('%H:%M')})"
-
-                    # Secondary: weekly rate limit
-                    secondary_pct = secondary.get("used_percent")
-                    if secondary_pct is not None:
-                        result["codex"]["weekly_token_limit"] = f"{secondary_pct}%"
-                        resets_at = secondary.get("resets_at")
-                        if resets_at:
-                            reset_time = dt.datetime.fromtimestamp(resets_at)
-                            result["codex"]["weekly_token_limit"] += f" (リセット: {reset_time.strftime('%m/%d %H:%M')})"
-
-                    # Set both short-term and weekly percentages
-                    if primary_pct is not None:
-                        result["codex"]["used_percentage"] = primary_pct
-                        result["codex"]["short_term_percentage"] = primary_pct
-                    if secondary_pct is not None:
-                        result["codex"]["weekly_percentage"] = secondary_pct
-
-                    # Build raw output
-                    lines = []
-                    if primary_pct is not None:
-                        lines.append(f"5時間制限: {primary_pct}%")
-                    if secondary_pct is not None:
-                        lines.append(f"週間制限: {secondary_pct}%")
-                    if token_usage:
-                        total = token_usage.get("total_tokens", 0)
-                        lines.append(f"セッショントークン: {total:,}")
-                    result["codex"]["raw_output"] = "\n".join(lines) if lines else "利用可能"
-                else:
-                    result["codex"]["available"] = True
-                    result["codex"]["raw_output"] = "セッションデータなし"
-            else:
-                result["codex"]["available"] = True
-                result["codex"]["raw_output"] = "セッション履歴なし"
-        else:
-            # Fallback: check if codex command exists
-            proc = subprocess.run(
-                ["codex", "--version"],
-                text=True,
-                capture_output=True,
-                timeout=10,
-                env=os.environ.copy(),
-            )
-            if proc.returncode == 0:
-                result["codex"]["available"] = True
-                result["codex"]["raw_output"] = proc.stdout.strip() if proc.stdout else "利用可能"
-            else:
-                result["codex"]["error"] = proc.stderr.strip() if proc.stderr else "codex コマンドが見つかりません"
-    except FileNotFoundError:
-        result["codex"]["error"] = "codex コマンドが見つかりません"
-    except subprocess.TimeoutExpired:
-        result["codex"]["error"] = "タイムアウト"
-    except Exception as e:
-        result["codex"]["error"] = str(e)
-
-    # Check Gemini CLI availability
-    result["gemini"] = {
-        "available": False,
-        "raw_output": "",
-        "error": None,
-    }
-    try:
-        proc = subprocess.run(
-            ["gemini", "--version"],
-            text=True,
-            capture_output=True,
-            timeout=10,
-            env=os.environ.copy(),
-        )
-        if proc.returncode == 0:
-            result["gemini"]["available"] = True
-            result["gemini"]["raw_output"] = proc.stdout.strip() if proc.stdout else "利用可能"
-        else:
-            result["gemini"]["error"] = proc.stderr.strip() if proc.stderr else "gemini コマンドが見つかりません"
-    except FileNotFoundError:
-        result["gemini"]["error"] = "gemini コマンドが見つかりません"
-    except subprocess.TimeoutExpired:
-        result["gemini"]["error"] = "タイムアウト"
-    except Exception as e:
-        result["gemini"]["error"] = str(e)
-
-    return result
-
-
 def write_config(config: dict) -> None:
     """Write the orchestrator config file with backup."""
     # Create backup
@@ -502,6 +226,9 @@ def get_run_summary(run_dir: Path, process: subprocess.Popen | None = None) -> d
 
     if final_path.exists():
         summary["has_result"] = True
+    estimate_path = run_dir / "estimate.json"
+    if estimate_path.exists():
+        summary["estimate"] = safe_json_load(estimate_path)
     return summary
 
 
@@ -617,19 +344,30 @@ def normalize_pending_for_api(pending: dict) -> dict:
     return pending
 
 
-def list_exchanges(run_dir: Path) -> list[dict]:
+def exchange_files(run_dir: Path) -> dict[str, Path]:
+    """Exchange id -> file: event logs, plus legacy YAML documents from older runs."""
     exchanges_dir = run_dir / "exchanges"
     if not exchanges_dir.exists():
-        return []
+        return {}
+    files: dict[str, Path] = {}
+    for path in exchanges_dir.glob("exchange_*.yaml"):
+        files[path.stem.replace("exchange_", "")] = path
+    for path in exchanges_dir.glob(f"exchange_*{LOG_SUFFIX}"):
+        files[path.name[: -len(LOG_SUFFIX)].replace("exchange_", "")] = path
+    return dict(sorted(files.items()))
+
+
+def list_exchanges(run_dir: Path) -> list[dict]:
     items = []
-    for path in sorted(exchanges_dir.glob("exchange_*.yaml")):
-        data = safe_yaml_load(path)
+    for exchange_id, path in exchange_files(run_dir).items():
+        # The snapshot has everything the list needs; the history is not parsed.
+        data = read_summary(path) if path.suffix == LOG_SUFFIX else safe_yaml_load(path)
         pending = data.get("pending") or {}
         # 質問文から選択肢を自動検出（optionsが空の場合）
         pending = normalize_pending_for_api(pending)
         items.append(
             {
-                "id": path.stem.replace("exchange_", ""),
+                "id": exchange_id,
                 "filename": path.name,
                 "status": data.get("status"),
                 "updated_at": data.get("updated_at"),
@@ -641,13 +379,25 @@ def list_exchanges(run_dir: Path) -> list[dict]:
 
 
 def read_exchange(run_dir: Path, exchange_id: str) -> dict | None:
-    exchanges_dir = run_dir / "exchanges"
-    path = exchanges_dir / f"exchange_{exchange_id}.yaml"
-    if not path.exists():
+    path = exchange_files(run_dir).get(exchange_id)
+    if path is None:
         return None
+    if path.suffix == LOG_SUFFIX:
+        return ExchangeLog.open(path).read()
     return safe_yaml_load(path)
 
 
+def read_exchange_archive(run_dir: Path, exchange_id: str, seq: int | None) -> dict | None:
+    """Archived history of a rolled-over exchange: the segment index, or one segment."""
+    path = exchange_files(run_dir).get(exchange_id)
+    if path is None or path.suffix != LOG_SUFFIX:
+        return None
+    if seq is None:
+        data = read_summary(path)
+        return {"archive": data.get("archive") or [], "history_count": data.get("history_count") or 0}
+    return ExchangeLog.open(path).archived(seq)
+
+
 def update_exchange_reply(
     run_dir: Path,
     exchange_id: str,
@@ -655,11 +405,22 @@ def update_exchange_reply(
     approved: bool,
     choice: str | None = None,
 ) -> dict | None:
-    if yaml is None:
+    path = exchange_files(run_dir).get(exchange_id)
+    if path is None:
         return None
-    exchanges_dir = run_dir / "exchanges"
-    path = exchanges_dir / f"exchange_{exchange_id}.yaml"
-    if not path.exists():
+    if path.suffix == LOG_SUFFIX:
+        # Through the running orchestrator when possible: it applies the reply
+        # under its own exchange lock and wakes the waiting concertmaster.
+        result = control_plane.request(
+            run_dir,
+            {"op": "reply", "exchange": exchange_id, "reply": reply, "approved": bool(approved), "choice": choice},
+        )
+        if result is not None:
+            # The orchestrator's answer, errors included: retrying on the log
+            # could apply the reply twice or race its exchange lock.
+            return result
+        return ExchangeLog.open(path).update(lambda data: control_plane.apply_reply(data, reply, approved, choice))
+    if artifact_codec.yaml is None:
         return None
     data = safe_yaml_load(path)
     pending = data.get("pending") or {}
@@ -669,7 +430,7 @@ def update_exchange_reply(
     pending["user_approved"] = bool(approved)
     data["pending"] = pending
     data["updated_at"] = now_iso()
-    path.write_text(yaml.safe_dump(data, allow_unicode=True, sort_keys=False), encoding="utf-8")
+    artifact_codec.dump(path, data)
     return data
 
 
@@ -734,7 +495,12 @@ def list_runs() -> list[dict]:
     return summaries
 
 
-def start_job(task: str, config_path: Path | None, expert_review: bool | None = None) -> dict:
+def start_job(
+    task: str,
+    config_path: Path | None,
+    expert_review: bool | None = None,
+    priority: str | None = None,
+) -> dict:
     RUNS_DIR.mkdir(parents=True, exist_ok=True)
     run_id = f"{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
     run_dir = RUNS_DIR / run_id
@@ -756,6 +522,8 @@ def start_job(task: str, config_path: Path | None, expert_review: bool | None =
         cmd.append("--expert-review")
     elif expert_review is False:
         cmd.append("--no-expert-review")
+    if priority in ("auto", "interactive", "batch"):
+        cmd.extend(["--priority", priority])
     proc = subprocess.Popen(
         cmd,
         cwd=str(ROOT),
@@ -779,8 +547,38 @@ def cleanup_finished_jobs() -> None:
             _active_jobs.pop(job_id, None)
 
 
+def request_job_control(job_id: str, msg: dict) -> dict | None:
+    """Send a control request to a running job: socket first, then the inbox file."""
+    run_dir = RUNS_DIR / job_id
+    result = control_plane.request(run_dir, msg, timeout=2.0)
+    if result is not None and not result.get("unanswered"):
+        return result
+    # kill and priority are idempotent, so an unanswered request may be queued again.
+    if control_plane.post_inbox(run_dir, msg):
+        return {"ok": True, "queued": True}
+    return None
+
+
 def kill_job(job_id: str) -> dict:
-    """Forcefully terminate a running job process."""
+    """Stop a running job: ask it to stop over the control channel, then terminate it."""
+    with _jobs_lock:
+        job = _active_jobs.get(job_id)
+    process = job["process"] if job else None
+    if process is not None and process.poll() is not None:
+        return {"ok": False, "error": "Job already finished"}
+    # The orchestrator cancels its CLI calls and records "killed" itself.
+    result = request_job_control(job_id, {"op": "kill"})
+    if result and result.get("ok"):
+        if process is None:  # started by another web server process
+            return {"ok": True, "message": "Stop requested"}
+        try:
+            process.wait(timeout=KILL_GRACE_SEC)
+            with _jobs_lock:
+                _active_jobs.pop(job_id, None)
+            return {"ok": True, "message": "Job stopped"}
+        except subprocess.TimeoutExpired:
+            pass
+
     with _jobs_lock:
         job = _active_jobs.get(job_id)
         if not job:
@@ -788,7 +586,8 @@ def kill_job(job_id: str) -> dict:
 
         process = job["process"]
         if process.poll() is not None:
-            return {"ok": False, "error": "Job already finished"}
+            _active_jobs.pop(job_id, None)
+            return {"ok": True, "message": "Job stopped"}
 
         import signal
         try:
@@ -862,7 +661,10 @@ class OrchestratorHandler(BaseHTTPRequestHandler):
             self.send_json(read_config())
             return
         if parsed.path == "/api/token-status":
-            self.send_json(get_cli_token_status())
+            self.send_json(TOKEN_STATUS_CACHE.get("cli", get_cli_token_status))
+            return
+        if parsed.path == "/api/estimate":
+            self.send_json(estimate_run(RUNS_DIR, read_config()))
             return
         if parsed.path == "/api/jobs":
             cleanup_finished_jobs()
@@ -878,6 +680,14 @@ class OrchestratorHandler(BaseHTTPRequestHandler):
                 job_id = job_id.rsplit("/exchanges", 1)[0].strip("/")
                 self.send_exchanges(job_id)
                 return
+            if job_id.endswith("/events"):
+                job_id = job_id.rsplit("/events", 1)[0].strip("/")
+                self.send_job_events(job_id)
+                return
+            if "/exchanges/" in job_id and job_id.endswith("/history"):
+                parts = job_id.rsplit("/history", 1)[0].split("/exchanges/")
+                self.send_exchange_archive(parts[0].strip("/"), parts[1].strip("/"), parsed)
+                return
             if "/exchanges/" in job_id:
                 parts = job_id.split("/exchanges/")
                 job_id = parts[0].strip("/")
@@ -940,6 +750,9 @@ class OrchestratorHandler(BaseHTTPRequestHandler):
         if parsed.path.startswith("/api/jobs/") and parsed.path.endswith("/kill"):
             self.handle_job_kill(parsed)
             return
+        if parsed.path.startswith("/api/jobs/") and parsed.path.endswith("/priority"):
+            self.handle_job_priority(parsed)
+            return
         if parsed.path == "/api/config":
             self.handle_config_update()
             return
@@ -968,8 +781,9 @@ class OrchestratorHandler(BaseHTTPRequestHandler):
         config_path = Path(cfg).expanduser().resolve() if cfg else None
         expert_review_raw = payload.get("expert_review")
         expert_review = bool(expert_review_raw) if expert_review_raw is not None else None
+        priority = str(payload.get("priority") or "").strip().lower() or None
         try:
-            job = start_job(task, config_path, expert_review=expert_review)
+            job = start_job(task, config_path, expert_review=expert_review, priority=priority)
             self.send_json(job, status=HTTPStatus.CREATED)
         except FileNotFoundError as exc:
             self.send_error(HTTPStatus.BAD_REQUEST, str(exc))
@@ -1045,6 +859,23 @@ class OrchestratorHandler(BaseHTTPRequestHandler):
             return
         self.send_json(data)
 
+    def send_exchange_archive(self, job_id: str, exchange_id: str, parsed) -> None:
+        run_dir = RUNS_DIR / job_id
+        if not run_dir.exists():
+            self.send_error(HTTPStatus.NOT_FOUND, "Job not found")
+            return
+        segment = (parse_qs(parsed.query).get("segment") or [""])[0]
+        try:
+            seq = int(segment) if segment else None
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "invalid segment")
+            return
+        data = read_exchange_archive(run_dir, exchange_id, seq)
+        if data is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "archive not found")
+            return
+        self.send_json(data)
+
     def handle_exchange_reply(self, parsed) -> None:
         if not self.require_token():
             self.send_error(HTTPStatus.UNAUTHORIZED, "Unauthorized")
@@ -1095,6 +926,10 @@ class OrchestratorHandler(BaseHTTPRequestHandler):
         if updated is None:
             self.send_error(HTTPStatus.NOT_FOUND, "exchange not found")
             return
+        if updated.get("ok") is False:
+            status = HTTPStatus.GATEWAY_TIMEOUT if updated.get("unanswered") else HTTPStatus.CONFLICT
+            self.send_error(status, updated.get("error") or "reply rejected")
+            return
         self.send_json({"ok": True})
 
     def handle_job_kill(self, parsed) -> None:
@@ -1117,6 +952,89 @@ class OrchestratorHandler(BaseHTTPRequestHandler):
         else:
             self.send_error(HTTPStatus.BAD_REQUEST, result.get("error", "Failed to kill job"))
 
+    def handle_job_priority(self, parsed) -> None:
+        """Handle POST /api/jobs/{id}/priority to move a running job between fair-share lanes."""
+        if not self.require_token():
+            self.send_error(HTTPStatus.UNAUTHORIZED, "Unauthorized")
+            return
+        job_id = parsed.path.split("/api/jobs/")[1].rsplit("/priority", 1)[0].strip("/")
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+        except ValueError:
+            length = 0
+        body = self.rfile.read(length) if length else b""
+        try:
+            payload = json.loads(body.decode("utf-8")) if body else {}
+        except json.JSONDecodeError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid JSON")
+            return
+        msg = {"op": "priority"}
+        if payload.get("lane") in ("interactive", "batch"):
+            msg["lane"] = payload["lane"]
+        if isinstance(payload.get("weight"), (int, float)):
+            msg["weight"] = float(payload["weight"])
+        if len(msg) == 1:
+            self.send_error(HTTPStatus.BAD_REQUEST, "lane or weight is required")
+            return
+        result = request_job_control(job_id, msg)
+        if result is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "Job not running")
+            return
+        if not result.get("ok"):
+            self.send_error(HTTPStatus.BAD_REQUEST, result.get("error", "Failed to change priority"))
+            return
+        self.send_json(result)
+
+    def send_job_events(self, job_id: str) -> None:
+        """GET /api/jobs/{id}/events: status/exchange events as server-sent events.
+
+        Streams from the job's control socket; for jobs without one it falls
+        back to watching status.json.
+        """
+        run_dir = RUNS_DIR / job_id
+        if not run_dir.exists():
+            self.send_error(HTTPStatus.NOT_FOUND, "Job not found")
+            return
+        self.send_response(HTTPStatus.OK)
+        self.add_cors_headers()
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def emit(event: str, data: dict) -> None:
+            payload = json.dumps(data, ensure_ascii=False)
+            self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            streamed = False
+            for event in control_plane.subscribe(run_dir, timeout=15.0):
+                streamed = True
+                if event is None:
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                    continue
+                emit(str(event.get("event") or "message"), event.get("data") or {})
+            if streamed:
+                emit("status", read_status(run_dir))
+                return
+            last_mtime = None
+            while True:
+                status_path = run_dir / "status.json"
+                mtime = status_path.stat().st_mtime if status_path.exists() else None
+                if mtime != last_mtime:
+                    last_mtime = mtime
+                    status = read_status(run_dir)
+                    emit("status", status)
+                    if status.get("stage") in ("done", "error", "killed"):
+                        return
+                else:
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                time.sleep(2.0)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
     def handle_config_update(self) -> None:
         """Handle POST /api/config to update orchestrator settings."""
         if not self.require_token():